@@ -3,43 +3,112 @@ __init__.py
 
 Author: Samuel B. Kachuck
 
-Import giapy submodules into convenient namespace and provide useful data to be
+Provide the giapy submodules in a convenient namespace and useful data to be
 used across the package.
 
+The submodules (e.g., giapy.sle, giapy.earth_tools) are imported when first
+accessed, so that importing giapy, or one of its submodules, does not import
+the others (and their dependencies, such as spharm and basemap).
+
 Data
 ----
 MODPATH: the path to the package
 GITVERSION: the hashed version of the git (for recording state of code along
-            with computations)
+            with computations), found when first accessed. It is 'unknown'
+            outside of a git checkout.
 Methods
 -------
 timestamp: fancy string of the current date and time
+get_gitversion: the hash of the git HEAD of the package (cached)
 load : filename (str)
     Convenience function for unpickling an object
 """
 
 
 import os, sys
+import importlib
 from datetime import datetime
-from subprocess import check_output, call
 if sys.version_info < (3,):
     import cPickle as pickle
 else:
     import pickle as pickle
 
 
-# Obtain the github hash of the current version
-command = 'git log -n 1 | grep commit | sed s/commit\ //'
 MODPATH = os.path.abspath(os.path.dirname(__file__))
-command = 'cd ' + MODPATH + ' && ' + command
-GITVERSION = check_output(command, shell=True)[:10]
-del command
+
+# Submodules imported on first access (see __getattr__).
+_SUBMODULES = ['command_line', 'earth_tools', 'harm_tools', 'icehistory',
+               'map_tools', 'numTools', 'parareal', 'profiling', 'sle',
+               'spharmt']
+
+_GITVERSION = None
+
+def get_gitversion():
+    """Return the first 10 characters of the hash of the git HEAD of the
+    package, or 'unknown' if not in a checkout.
+
+    The hash is read from the repository's files (without running git), once.
+    """
+    global _GITVERSION
+    if _GITVERSION is None:
+        try:
+            head = _readGitHead(MODPATH)
+        except (IOError, OSError):
+            head = None
+        _GITVERSION = head[:10] if head else 'unknown'
+    return _GITVERSION
+
+def _readGitHead(path):
+    """Return the commit hash of the HEAD of the git repository containing
+    path, or None."""
+    # Find the .git directory (or file, for worktrees) above path.
+    while not os.path.exists(os.path.join(path, '.git')):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    gitdir = os.path.join(path, '.git')
+    if os.path.isfile(gitdir):
+        with open(gitdir) as f:
+            gitdir = os.path.join(path, f.read().split('gitdir:')[1].strip())
+    commondir = gitdir
+    if os.path.exists(os.path.join(gitdir, 'commondir')):
+        with open(os.path.join(gitdir, 'commondir')) as f:
+            commondir = os.path.join(gitdir, f.read().strip())
+
+    with open(os.path.join(gitdir, 'HEAD')) as f:
+        head = f.read().strip()
+    if not head.startswith('ref:'):
+        # Detached HEAD
+        return head
+    ref = head[4:].strip()
+    for d in [gitdir, commondir]:
+        if os.path.exists(os.path.join(d, ref)):
+            with open(os.path.join(d, ref)) as f:
+                return f.read().strip()
+    # The ref may only be in packed-refs.
+    packed = os.path.join(commondir, 'packed-refs')
+    if os.path.exists(packed):
+        with open(packed) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+def __getattr__(name):
+    # Python >= 3.7 (PEP 562): import submodules and find GITVERSION lazily.
+    if name == 'GITVERSION':
+        return get_gitversion()
+    if name in _SUBMODULES:
+        return importlib.import_module('giapy.'+name)
+    raise AttributeError("module 'giapy' has no attribute '{}'".format(name))
+
+def __dir__():
+    return sorted(list(globals()) + _SUBMODULES + ['GITVERSION'])
 
 def timestamp():
     return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
 def load(filename):
     return pickle.load(open(filename, 'r'))
-
-import giapy.earth_tools
-import giapy.sle
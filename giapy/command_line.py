@@ -2,9 +2,11 @@ from argparse import ArgumentParser, FileType
 import sys, os
 import numpy as np
 
-from giapy.earth_tools.elasticlove import compute_love_numbers, hLK_asymptotic
-from giapy.earth_tools.viscellove import compute_viscel_numbers
-from giapy.earth_tools.earthParams import EarthParams
+from giapy.earth_tools.elasticlove import compute_love_numbers, hLK_asymptotic, \
+                                            converged_love_numbers, \
+                                            adaptive_love_numbers
+from giapy.earth_tools.laplacelove import compute_laplace_numbers
+from giapy.earth_tools.earthParams import EarthParams, radial_mesh
 
 def ellove():
     """useage: giapy-ellove [-h] [--lstart LSTART] [--params PARAMS]
@@ -27,6 +29,23 @@ def ellove():
             --conv [CONV]      perform convergence check for asymptotic love
                                number at supplied (very large) l (if flag
                                present, defaults to l=50000).
+            --tol TOL          solve only adaptively chosen order numbers,
+                               interpolating the others to relative error TOL
+                               (requires --discmesh, on which the Love numbers
+                               are smooth in the order number)
+            --meshtol MESHTOL  refine the mesh (doubling NLAYERS) for each order
+                               number until the estimated relative
+                               discretization error is below MESHTOL, and
+                               Richardson extrapolate, always from the mesh of
+                               --discmesh. The points of the finest mesh and
+                               the error estimate are written out.
+            --discmesh         use a mesh of NLAYERS points with points at the
+                               discontinuities of the parameters, refined
+                               where they vary and near the surface (for the
+                               largest order number), instead of the
+                               logarithmic mesh.
+            --order {2,4}      order of accuracy of the radial discretization
+                               (default: 2)
     """
     # Read the command line arguments.
     parser = ArgumentParser(description='Compute the elastic surface load love numbers')
@@ -47,7 +66,27 @@ density (kg/m^3) bulk mod (GPa) shear mod (GPa) g (m/2^2) (default: PREM)""")
 number at supplied (very large) l (if present, defaults to l=50000)''')
     parser.add_argument('--incomp', default=False, action='store_const',
                         const=True, help='impose incompressibility')
+    parser.add_argument('--tol', type=float, default=None,
+                        help='''solve only adaptively chosen order numbers,
+interpolating the others to relative error TOL (requires --discmesh)''')
+    parser.add_argument('--meshtol', type=float, default=None,
+                        help='''refine the mesh (doubling NLAYERS) for each
+order number until the estimated relative discretization error is below
+MESHTOL, and Richardson extrapolate, always from the mesh of --discmesh''')
+    parser.add_argument('--discmesh', default=False, action='store_const',
+                        const=True, help='''use a mesh with points at the
+discontinuities of the parameters, refined where they vary and near the
+surface, instead of the logarithmic mesh''')
+    parser.add_argument('--order', type=int, default=2, choices=[2, 4],
+                        help='''order of accuracy of the radial
+discretization (default: %(default)s)''')
     args = parser.parse_args()
+    if args.tol is not None and args.meshtol is not None:
+        parser.error('--tol and --meshtol cannot be combined')
+    if args.tol is not None and not args.discmesh:
+        # The solutions on the logarithmic mesh jump with the order number,
+        # and cannot be interpolated.
+        parser.error('--tol requires --discmesh')
 
    
     
@@ -65,14 +104,46 @@ number at supplied (very large) l (if present, defaults to l=50000)''')
 
     # If convergence check requested, append to ls.
     if args.conv:
+        args.conv = int(args.conv)
         ls = np.r_[ls, args.conv]
 
-    zarray = np.linspace(params.rCore, 1., args.nlayers)
+    if args.discmesh:
+        zarray = radial_mesh(params, args.nlayers, nref=max(ls),
+                                kinks=args.order > 2)
+        scaled = False
+    else:
+        zarray = np.linspace(params.rCore, 1., args.nlayers)
+        scaled = True
 
     # Compute the love numbers.
-    hLks = compute_love_numbers(ls, zarray, params, err=1e-14, Q=2,
-                                it_counts=False, comp=not args.incomp,
-                                scaled=True)
+    meshinfo = None
+    if args.meshtol is not None:
+        # Always on meshes with points at the discontinuities (see
+        # --discmesh), on which the solutions converge at their order.
+        hLks, meshinfo = converged_love_numbers(ls, params, tol=args.meshtol,
+                                    nlayers=args.nlayers, err=1e-14, Q=2,
+                                    comp=not args.incomp, scaled=False,
+                                    mesh=zarray if args.discmesh else None,
+                                    order=args.order, full_output=True)
+    elif args.tol is None:
+        hLks = compute_love_numbers(ls, zarray, params, err=1e-14, Q=2,
+                                    it_counts=False, comp=not args.incomp,
+                                    scaled=scaled, order=args.order)
+    else:
+        # The convergence check is solved, not interpolated.
+        hLks, tolinfo = adaptive_love_numbers(ls[:-1] if args.conv else ls,
+                                    zarray, params, tol=args.tol, err=1e-14,
+                                    Q=2, comp=not args.incomp, scaled=scaled,
+                                    order=args.order, full_output=True)
+        if not tolinfo['converged']:
+            sys.stdout.write('Interpolated order numbers did not converge to '
+                             '{} (estimated error {:.1e})\n'.format(args.tol,
+                                                        tolinfo['errest']))
+        if args.conv:
+            hLks = np.c_[hLks, compute_love_numbers([args.conv], zarray,
+                                    params, err=1e-14, Q=2,
+                                    comp=not args.incomp, scaled=scaled,
+                                    order=args.order)]
 
     if args.conv:
         hLk_conv = hLks[:,-1]
@@ -81,11 +152,23 @@ number at supplied (very large) l (if present, defaults to l=50000)''')
         
 
     # Write them out.
-    fmt = '{0:'+'{0:.0f}'.format(1+np.floor(np.log10(args.lmax)))+'d}\t{1}\t{2}\t{3}\n'
-    # Write out header
-    args.outfile.write("n\th'\tl'\tk'\n")
-    for l, hLk in zip(ls, hLks.T):
-        args.outfile.write(fmt.format(l, hLk[0], hLk[1]/l, -(1+hLk[2])))
+    fmt = '{0:'+'{0:.0f}'.format(1+np.floor(np.log10(args.lmax)))+'d}\t{1}\t{2}\t{3}'
+    if meshinfo is None:
+        # Write out header
+        args.outfile.write("n\th'\tl'\tk'\n")
+        for l, hLk in zip(ls, hLks.T):
+            args.outfile.write(fmt.format(l, hLk[0], hLk[1]/l, -(1+hLk[2]))+'\n')
+    else:
+        # With the mesh and error estimate of each order number.
+        args.outfile.write("n\th'\tl'\tk'\tnlayers\terr\n")
+        for l, hLk, nz, err in zip(ls, hLks.T, meshinfo['nlayers'],
+                                    meshinfo['errest']):
+            args.outfile.write(fmt.format(l, hLk[0], hLk[1]/l, -(1+hLk[2])) +
+                                '\t{}\t{:.2e}\n'.format(nz, err))
+        nbad = np.sum(~meshinfo['converged'][:len(hLks.T)])
+        if nbad:
+            sys.stdout.write('{} order numbers did not converge to {}\n'
+                                .format(nbad, args.meshtol))
 
     if args.conv:
         hLk_inf = np.array(hLK_asymptotic(params))
@@ -115,6 +198,8 @@ def velove():
             -n, --nlayers NLAYERS  number of layers (default: 100)
             --incomp           flag for incompressibility (default: False) 
             -D, --lith LITH    flexural rigidity of lith (1e23 N m), overwrite params
+            --laplace          invert Laplace-domain Love numbers instead of
+                               time stepping (default: False)
 
     """
     # Read the command line arguments.
@@ -133,6 +218,9 @@ density (kg/m^3) bulk mod (GPa) shear mod (GPa) g (m/2^2) viscosity (1e21 Pa s)
     parser.add_argument('--lith', '-D', type=float, default=-1, dest='lith',
                         help='''The flexural rigidity of the lithosphere, in units
 of 1e23 N m (overrides parameter table, if set)''')
+    parser.add_argument('--laplace', default=False, action='store_const',
+                        const=True, help='''invert Laplace-domain Love numbers
+instead of time stepping (default: %(default)s)''')
     parser.add_argument('outfile', nargs='?', type=FileType('w'),
                         default=sys.stdout,
                         help='file to save out')
@@ -156,8 +244,15 @@ of 1e23 N m (overrides parameter table, if set)''')
     zarray = np.linspace(params.rCore, 1., args.nlayers)
     times = np.logspace(-4,np.log10(250),30)
     # Compute the viscoelastic Love numbers.
-    hLkf = compute_viscel_numbers(ls, times, zarray, params,
-                                comp=not args.incomp, scaled=True)
+    if args.laplace:
+        hLkf = compute_laplace_numbers(ls, times, zarray, params,
+                                        comp=not args.incomp)
+    else:
+        # Imported here, as viscellove needs the compiled integrators of
+        # numTools, which the other commands do not.
+        from giapy.earth_tools.viscellove import compute_viscel_numbers
+        hLkf = compute_viscel_numbers(ls, times, zarray, params,
+                                    comp=not args.incomp, scaled=True)
     if len(ls)==1:
         hLkf = hLkf[None,...]
 
@@ -187,4 +282,4 @@ of 1e23 N m (overrides parameter table, if set)''')
     for l, hLkl in zip(ls, hLkf):
         args.outfile.write('# l={}\n'.format(l))
         for t, hLk in zip(np.r_[0,times], hLkl.T):
-            args.outfile.write(fmt.format(t, hLk[0], hLk[1]/l, -(1+hLk[2])))
+            args.outfile.write(fmt.format(t, hLk[0], hLk[1]/l, hLk[2]))
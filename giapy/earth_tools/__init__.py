@@ -1,2 +1,12 @@
-import giapy.earth_tools.earthParams
-import giapy.earth_tools.elasticlove
+import importlib
+
+# Submodules imported on first access, so that importing one (e.g.,
+# earthParams) does not import the others (and numba).
+_SUBMODULES = ['earthParams', 'earthSphericalLap', 'elasticlove', 'laplacelove',
+               'lovefit', 'normalmodes', 'viscellove', 'viscouslove']
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('giapy.earth_tools.'+name)
+    raise AttributeError("module 'giapy.earth_tools' has no attribute "
+                         "'{}'".format(name))
@@ -2,6 +2,8 @@
     NOTE ON UNITS:
     This module uses cgs units.
 """
+import copy
+
 import numpy as np
 from scipy.interpolate import interp1d
 
@@ -12,6 +14,9 @@ from giapy import MODPATH
 # 1 GPa  = 1e9 Pa = 1e9 N/m^2
 # 1 GPa = 1e10 dyne / cm^2
 
+# The number of meshes whose parameters EarthParams.onMesh keeps.
+MAXMESHES = 16
+
 class EarthParams(object):
     """Store and interpolate Earth's material parameters.
 
@@ -41,6 +46,22 @@ class EarthParams(object):
         which nondimensionalizes elastic parameters, radii, and viscosities, or
         'love' which nondimensionalizes everything for use with direct Love
         number computation.
+
+    Data
+    ----
+    surface, core : dicts of the parameters (floats) at the surface and at
+        the core-mantle boundary (mantle side), computed once.
+
+    Methods
+    -------
+    getParams : the parameters interpolated to radii z.
+    onMesh : the parameters interpolated to a mesh, computed once (see
+        MeshParams).
+    discontinuities : the radii of the discontinuities of the parameters.
+    getJumps : the jumps of the parameters at discontinuities.
+
+    The cached values are discarded whenever the parameters change (normalize,
+    addViscosity, addNonadiabatic, fullNonadiabatic, addLithosphere).
     """
     def __init__(self, model='prem', visArray=None, D=0, bulk=True,
                     normmode='larry', G=6.674e-11, disc=True):        
@@ -92,7 +113,7 @@ class EarthParams(object):
         self._paramArray = np.concatenate((locprem[1:,1:5], dend[:,np.newaxis], 
                                             filler, filler), axis=1).T
 
-        self._interpParams = interp1d(z, self._paramArray)
+        self._update()
  
         visLith = False
 
@@ -106,11 +127,11 @@ class EarthParams(object):
                     visLith = True
 
                 self._paramArray[6] = visArray
-                self._interpParams = interp1d(z, self._paramArray)
+                self._update()
 
             except:
                 self._paramArray[6] = np.ones_like(z)
-                self._interpParams = interp1d(z, self._paramArray)
+                self._update()
         else:
             self.addViscosity(visArray)
         
@@ -132,19 +153,46 @@ class EarthParams(object):
 
     def __getstate__(self):
         odict = self.__dict__.copy()
-        del odict['_interpParams']
+        for key in ['_interpParams', '_meshes', '_surface', '_core']:
+            odict.pop(key, None)
         return odict
 
     def __setstate__(self, state):
         self.__dict__.update(state)
+        self._update()
+
+    def _update(self):
+        """Recreate the interpolation object and discard cached values, after
+        the parameters have changed."""
         self._interpParams = interp1d(self.z, self._paramArray)
+        self._meshes = {}
+        self._surface = None
+        self._core = None
+
+    @property
+    def surface(self):
+        """The parameters at the surface (dict of floats)."""
+        if self._surface is None:
+            self._surface = dict((name, float(val)) for name, val in
+                                    zip(self._paramNames,
+                                        self._interpParams(1.)))
+        return self._surface
+
+    @property
+    def core(self):
+        """The parameters at the core-mantle boundary, mantle side (dict of
+        floats)."""
+        if self._core is None:
+            self._core = dict((name, float(val)) for name, val in
+                                zip(self._paramNames,
+                                    self._interpParams(self.rCore)))
+        return self._core
 
     @property
     def tau(self):
         """Viscous decay constant in ka without wavenumber factor or
         lithosphere factor"""
         re = self.norms['r']
-        paramSurf = self.getParams(1.)
         g0 = self.norms['g']
         rhobar = g0/self.G/re
         taunon = 2*self.norms['eta']/(rhobar*g0*re) / np.pi/1e10
@@ -220,7 +268,7 @@ class EarthParams(object):
         # Set the normmode for reference later and recreate interpolation
         # object.
         self.normmode = normmode
-        self._interpParams = interp1d(self.z, self._paramArray)
+        self._update()
 
     def getParams(self, z, depth=False):
         """
@@ -233,6 +281,49 @@ class EarthParams(object):
 
         return dict(zip(self._paramNames, vals))
 
+    def onMesh(self, z):
+        """Return the parameters interpolated to the radii z (array), as a
+        MeshParams.
+
+        The interpolation is done once for each mesh (until the parameters
+        change), so that repeated calls with the same radii (e.g., for each
+        order number) only look it up. The arrays are shared by the calls and
+        must not be modified.
+        """
+        z = np.ascontiguousarray(z, dtype=float)
+        key = (z.shape, z.tobytes())
+        mesh = self._meshes.get(key)
+        if mesh is None:
+            if len(self._meshes) >= MAXMESHES:
+                # Forget the oldest mesh.
+                del self._meshes[next(iter(self._meshes))]
+            mesh = MeshParams(self, z)
+            self._meshes[key] = mesh
+        return mesh
+
+    def discontinuities(self):
+        """Return the radii of the discontinuities of the parameters (where
+        the table repeats a radius) above the core-mantle boundary."""
+        zd = self.z[locateDiscontinuities(self.z)]
+        return np.unique(zd[(zd > self.z[0]) & (zd < self.z[-1])])
+
+    def getJumps(self, z):
+        """Return a dictionary of the jumps (value above minus value below)
+        of the parameters at radii z, which are zero except at
+        discontinuities."""
+        z = np.atleast_1d(z)
+        idisc = locateDiscontinuities(self.z)
+        jumps = np.zeros((len(self._paramNames), len(z)))
+        for j, zj in enumerate(z):
+            i = idisc[self.z[idisc] == zj]
+            if len(i) > 0:
+                # The last of repeated radii is the top of the discontinuity.
+                itop = i[-1] + 1
+                while itop+1 < len(self.z) and self.z[itop+1] == zj:
+                    itop += 1
+                jumps[:,j] = self._paramArray[:,itop] - self._paramArray[:,i[0]]
+        return dict(zip(self._paramNames, jumps))
+
     def addViscosity(self, visArray, etaStar=None):
         """visArray is an 2xN array of depths zi and viscosities at those
            depths, in poise."""
@@ -263,7 +354,7 @@ class EarthParams(object):
         """Make the entire density gradient non-adiabatic.
         """
         self._paramArray[5] = fac*self._paramArray[4] 
-        self._interpParams = interp1d(self.z, self._paramArray)
+        self._update()
 
     def addLithosphere(self, D=None, H=None, mu=None, lam=None):
         """Append a lithosphere with flexural rigidity D (N m) or of thickness
@@ -271,6 +362,7 @@ class EarthParams(object):
         """
         if D is not None:
             self.D = D
+            self._update()
         elif H is not None:
 
             re = self.norms['r']
@@ -278,7 +370,7 @@ class EarthParams(object):
             rhobar = g0/self.G/re
 
             if mu is None and lam is None:
-                paramSurf = self(1.)
+                paramSurf = self.surface
                 lam = paramSurf['bulk']#34.3 * 1e+10 # dyne / cm^2
                 mu =  paramSurf['shear']#26.6 * 1e+10 # dyne / cm^2
                 pois = lam/(2*(lam+mu))
@@ -295,6 +387,7 @@ class EarthParams(object):
             # 1e8 converts km^3 dyne / cm^2 to N m
             # 1e9 converts km^3 to m^3 for D to have units N m
             self.D = young * H**3 / (12*(1-pois**2))*1e9
+            self._update()
         else:
             raise ValueError('Muse specify either D (in N m) or H (in km)')
 
@@ -312,7 +405,7 @@ class EarthParams(object):
         g0 = self.norms['g']
         rhobar = g0/self.G/re
 
-        paramSurf = self(1.)
+        paramSurf = self.surface
         rho = paramSurf['den']*rhobar   # kg / m^3
         g = paramSurf['grav']*g0        # m/s^2
         # 1e1 converts rho*g in dyne/cm^3 to N/m^3
@@ -325,7 +418,7 @@ class EarthParams(object):
         g0 = self.norms['g']
         rhobar = g0/self.G/re
 
-        paramSurf = self(1.)
+        paramSurf = self.surface
         lam = paramSurf['bulk']#34.3 * 1e+10 # dyne / cm^2
         mu =  paramSurf['shear']#26.6 * 1e+10 # dyne / cm^2
         pois = lam/(2*(lam+mu))
@@ -386,7 +479,7 @@ class EarthParams(object):
         # and reset all the class data.
         self._paramArray = newparamArray 
         self.z = znew
-        self._interpParams = interp1d(self.z, self._paramArray)
+        self._update()
 
     def _alterColumnSmooth(self, col, zy):
         
@@ -396,7 +489,202 @@ class EarthParams(object):
         self.z = np.union1d(z, self.z)
         self._paramArray = self._interpParams(self.z)
         self._paramArray[col] = interpY(self.z)
-        self._interpParams = interp1d(self.z, self._paramArray)
+        self._update()
+
+class MeshParams(dict):
+    """The parameters of an EarthParams interpolated to a mesh.
+
+    A dict of contiguous arrays, keyed by parameter name ('den', 'bulk',
+    'shear', 'grav', 'dend', 'nonad', 'visc') like EarthParams.getParams, with
+    the mesh and the surface and core-mantle boundary values. Get from
+    EarthParams.onMesh.
+
+    Data
+    ----
+    z : the radii of the mesh
+    surface, core : dicts of the parameters at the surface and core-mantle
+        boundary (see EarthParams)
+
+    EarthParams discards its meshes when its parameters change, so that a
+    MeshParams kept from before is out of date.
+    """
+    def __init__(self, params, z):
+        vals = params._interpParams(z)
+        dict.__init__(self, zip(params._paramNames,
+                                [np.ascontiguousarray(val) for val in vals]))
+        self.z = z
+        self._params = params
+
+    @property
+    def surface(self):
+        return self._params.surface
+
+    @property
+    def core(self):
+        return self._params.core
+
+def radial_mesh(params, nlayers, coincident=True, gradweight=1., nref=None,
+                kinks=False):
+    """Generate a radial mesh of about nlayers points, from the core-mantle
+    boundary to the surface, with points at the discontinuities of params.
+
+    The points between discontinuities are distributed so that each interval
+    holds an equal share of the integral of the mesh density
+        1 + gradweight*(1-rCore)*max(|d ln p/dr|)
+          + (1-rCore)*nref*exp(-nref*(1-r)),
+    where p are the density and elastic moduli, so that the mesh is finer
+    where the parameters vary more and, for Love numbers of order numbers
+    near nref (if given), near the surface. Each layer between
+    discontinuities has at least one interval.
+
+    Parameters
+    ----------
+    params : <giapy.earth_tools.earthParams.EarthParams>
+    nlayers : int
+        The number of points (at least two per layer between
+        discontinuities).
+    coincident : boolean
+        If True (default), each discontinuity has two coincident points (the
+        bottom and top of the discontinuity), across which the solutions may
+        jump (see elasticlove.SphericalElasSMat). If False, it has one.
+    gradweight : float
+        The weight of the parameter gradients in the mesh density (default 1).
+    nref : float
+        The order number to refine the mesh near the surface for (default
+        None, no surface refinement).
+    kinks : boolean
+        If True, the mesh also has a point at each radius of the parameter
+        table, where the interpolated parameters are continuous but their
+        gradients are not (default False). Higher-order discretizations
+        (see elasticlove.SphericalElasSMat) need them to converge at their
+        order.
+
+    Returns
+    -------
+    z : array of radii (normalized as params)
+    """
+    rCore, rSurf = params.z[0], params.z[-1]
+    zd = params.discontinuities()
+    if kinks:
+        edges = np.unique(params.z)
+    else:
+        edges = np.r_[rCore, zd, rSurf]
+
+    # The mesh density on a fine grid in each layer.
+    nfine = 200
+    layers = []
+    for za, zb in zip(edges[:-1], edges[1:]):
+        zf = np.linspace(za, zb, nfine)
+        # Move the ends into the layer, to take its side of discontinuities.
+        eps = 1e-9*(zb - za)
+        zf[0], zf[-1] = za + eps, zb - eps
+        vals = params.onMesh(zf)
+        dens = np.ones(nfine)
+        for name in ['den', 'bulk', 'shear']:
+            p = np.abs(vals[name])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dlogp = np.abs(np.gradient(p, zf))/p
+            dens += gradweight*(rSurf-rCore)*np.where(p > 0, dlogp, 0)
+        if nref is not None:
+            dens += (rSurf-rCore)*nref*np.exp(-nref*(rSurf-zf))
+        # Cumulative integral of the density (trapezoidal).
+        cum = np.r_[0, np.cumsum(0.5*(dens[1:]+dens[:-1])*np.diff(zf))]
+        layers.append((zf, cum))
+
+    # Share the intervals among the layers by their integrated density.
+    total = np.array([cum[-1] for zf, cum in layers])
+    nint = max(nlayers - 1 - (coincident*len(zd)), len(layers))
+    share = nint*total/total.sum()
+    counts = np.maximum(1, np.floor(share).astype(int))
+    # Give the remaining intervals to the layers with the largest remainders
+    # (or take the excess from the layers with the most intervals).
+    while counts.sum() < nint:
+        counts[np.argmax(share - counts)] += 1
+    while counts.sum() > nint:
+        counts[np.argmax(counts)] -= 1
+
+    zs = []
+    for (zf, cum), count, za, zb in zip(layers, counts, edges[:-1],
+                                            edges[1:]):
+        zlayer = np.interp(np.linspace(0, cum[-1], count+1), cum, zf)
+        zlayer[0], zlayer[-1] = za, zb
+        # The bottom is the top of the last layer, or its own point at a
+        # discontinuity.
+        zs.append(zlayer if (coincident and za in zd) or not zs
+                    else zlayer[1:])
+    return np.concatenate(zs)
+
+def refine_mesh(z):
+    """Return the mesh z with a point added at the middle of each interval
+    (except between coincident points)."""
+    z = np.asarray(z)
+    zmids = 0.5*(z[1:] + z[:-1])
+    zmids = zmids[np.diff(z) > 0]
+    return np.sort(np.r_[z, zmids], kind='mergesort')
+
+def layered_params(params, radii=None, npts=8):
+    """Return a copy of params with homogeneous layers between radii.
+
+    The density and elastic moduli of each layer are the volume averages of
+    those of params, and the viscosity the volume average of its logarithm.
+    Density gradients vanish, and gravity is recomputed from the layer
+    densities (g r**2 = g_c rCore**2 + int rho r**2 dr, in 'love'
+    normalization). The Maxwell relaxation rate shear/visc of each layer is
+    then a single value, so that the Love numbers have finitely many
+    relaxation modes (see giapy.earth_tools.normalmodes).
+
+    Parameters
+    ----------
+    params : <giapy.earth_tools.earthParams.EarthParams>
+        In 'love' normalization.
+    radii : array
+        The radii of the boundaries between layers (default, the
+        discontinuities of params, which include the steps of a viscosity
+        profile added with addViscosity).
+    npts : int
+        The number of radii in the table of each layer, for gravity
+        (default 8).
+
+    Returns
+    -------
+    layered : <giapy.earth_tools.earthParams.EarthParams>
+    """
+    if radii is None:
+        radii = params.discontinuities()
+    rCore, rSurf = params.z[0], params.z[-1]
+    radii = np.asarray(radii)
+    edges = np.unique(np.r_[rCore, radii[(radii > rCore) & (radii < rSurf)],
+                            rSurf])
+
+    names = params._paramNames
+    zs, cols = [], []
+    gr2 = params.core['grav']*rCore**2
+    for za, zb in zip(edges[:-1], edges[1:]):
+        # Average on a fine grid inside the layer (the ends moved in, to
+        # take its side of discontinuities).
+        zf = np.linspace(za, zb, 201)
+        eps = 1e-9*(zb - za)
+        zf[0], zf[-1] = za + eps, zb - eps
+        vals = params.getParams(zf)
+        w = zf**2/np.sum(zf**2)
+        den = np.sum(w*vals['den'])
+
+        zl = np.linspace(za, zb, npts)
+        col = np.zeros((len(names), npts))
+        col[names.index('den')] = den
+        col[names.index('bulk')] = np.sum(w*vals['bulk'])
+        col[names.index('shear')] = np.sum(w*vals['shear'])
+        col[names.index('visc')] = np.exp(np.sum(w*np.log(vals['visc'])))
+        col[names.index('grav')] = (gr2 + den*(zl**3 - za**3)/3.)/zl**2
+        gr2 += den*(zb**3 - za**3)/3.
+        zs.append(zl)
+        cols.append(col)
+
+    layered = copy.deepcopy(params)
+    layered.z = np.concatenate(zs)
+    layered._paramArray = np.concatenate(cols, axis=1)
+    layered._update()
+    return layered
 
 def locateDiscontinuities(z):
     """Locate where in an array a value is repeated.
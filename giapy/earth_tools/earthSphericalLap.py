@@ -9,8 +9,10 @@ retrieving loading response curves on a spherically symmetric earth in the
 Laplace domain.
 """
 
+import copy
+
 import numpy as np
-from giapy.giasim import AbstractEarthGiaSimObserver
+from giapy.sle import AbstractEarthGiaSimObserver
 
 class SphericalEarth(object):
     """A class for calculating, storing, and recalling 
@@ -37,6 +39,9 @@ class SphericalEarth(object):
     getResp
     calcResponse
     calcElResponse
+    calcNormalModes
+    fitLoveNumbers
+    loadVeloveNumbers
     timeEvolve
 
     Data
@@ -48,6 +53,9 @@ class SphericalEarth(object):
     respInterp : <scipy.interpoate.interp1d>
         An inteprolation objectect computed in SphericalEarth.calcResponse and
         stored for fast retrieval.
+    fitResiduals : ndarray
+        The relative residuals of the fits of each order number, stored by
+        fitLoveNumbers.
     """
 
     def __init__(self): 
@@ -142,6 +150,95 @@ class SphericalEarth(object):
         self.nmax = nmax
         self.hlke, self.hlkf, self.hlks = hlke, hlkf, hlks
 
+    def calcNormalModes(self, params, nmax, **kwargs):
+        """Compute the responses of order numbers up to nmax from the normal
+        modes of params (see giapy.earth_tools.normalmodes.normal_modes).
+
+        The elastic Love numbers, relaxation rates (1/ka) and amplitudes are
+        stored as those read by loadTabooNumbers: h, l = L/n and
+        k = -(1+k_d) (as written by giapy-ellove).
+
+        Parameters
+        ----------
+        params : <giapy.earth_tools.earthParams.EarthParams>
+        nmax : int, the largest order number
+        **kwargs : passed to normal_modes (e.g., nprocs, cachedir, nlayers).
+        """
+        from giapy.earth_tools.normalmodes import normal_modes
+
+        if params.normmode != 'love':
+            params = copy.deepcopy(params)
+            params.normalize('love')
+
+        ns = np.arange(1, nmax+1)
+        hLke, modes = normal_modes(ns, params, **kwargs)
+
+        # The normalized rates are in units of params.tau/2 ka, and the
+        # thin-plate lithosphere accelerates the relaxation of each order
+        # number (as in compute_viscel_numbers and compute_laplace_numbers).
+        modes[:,:,0] *= params.getLithFilter(n=ns)[:,None]/(0.5*params.tau)
+        self._storeModes(ns, hLke, modes)
+
+    def fitLoveNumbers(self, ts, hLkt, ns=None, **kwargs):
+        """Compute the responses of order numbers ns by fitting viscoelastic
+        Love numbers with exponential modes (see
+        giapy.earth_tools.lovefit.fit_modes).
+
+        Parameters
+        ----------
+        ts : array of times (ka)
+        hLkt : (len(ns), 3, len(ts)) array of h, L and k_d (as computed by
+            compute_viscel_numbers or compute_laplace_numbers).
+        ns : array of order numbers (default, 1 to len(hLkt))
+        **kwargs : passed to fit_modes (e.g., nmodes, share_tol, verbose).
+
+        Returns
+        -------
+        resid : the residuals of the fits of each order number (relative to
+            the ranges of the Love numbers), also stored as fitResiduals.
+        """
+        from giapy.earth_tools.lovefit import fit_modes
+
+        ns = np.arange(1, len(hLkt)+1) if ns is None else np.asarray(ns)
+        hLke, modes, resid, _ = fit_modes(ts, hLkt, ns=ns, **kwargs)
+        self._storeModes(ns, hLke, modes)
+        self.fitResiduals = resid
+        return resid
+
+    def loadVeloveNumbers(self, fname, drctry='./', **kwargs):
+        """Compute the responses of the order numbers of a table written by
+        giapy-velove by fitting them with exponential modes (see
+        fitLoveNumbers, to which kwargs are passed)."""
+        with open(drctry+fname) as f:
+            ns = np.array([int(line.split('=')[1]) for line in f
+                            if line.startswith('# l=')])
+        text = np.loadtxt(drctry+fname).reshape(len(ns), -1, 4)
+        ts = text[0,:,0]
+        hLkt = np.stack([text[:,:,1], ns[:,None]*text[:,:,2],
+                            -1 - text[:,:,3]], axis=1)
+        return self.fitLoveNumbers(ts, hLkt, ns=ns, **kwargs)
+
+    def _storeModes(self, ns, hLke, modes):
+        """Store the elastic Love numbers hLke (len(ns), 3) and the modes
+        (len(ns), nmodes, 4), rates (1/ka) and amplitudes of h, L and k_d,
+        of order numbers ns, as those read by loadTabooNumbers: h, l = L/n
+        and k = -(1+k_d) (as written by giapy-ellove)."""
+        nmax = int(np.max(ns))
+        hlke = np.zeros((nmax+1, 3))
+        hlke[ns] = np.vstack([hLke[:,0], hLke[:,1]/ns, -(1+hLke[:,2])]).T
+
+        hlks = np.zeros((nmax+1, modes.shape[1], 4))
+        hlks[ns,:,0] = modes[:,:,0]
+        hlks[ns,:,1] = modes[:,:,1]
+        hlks[ns,:,2] = modes[:,:,2]/ns[:,None]
+        hlks[ns,:,3] = -modes[:,:,3]
+
+        hlkf = np.zeros((nmax+1, 3))
+        hlkf[ns] = hlke[ns] + hlks[ns,:,1:].sum(axis=1)
+
+        self.nmax = nmax
+        self.hlke, self.hlkf, self.hlks = hlke, hlkf, hlks
+
     
     class TotalUpliftObserver(AbstractEarthGiaSimObserver):
         def isolateRespArray(self, respArray):
@@ -162,7 +259,9 @@ class SphericalEarth(object):
             psi_l = 4*np.pi*RE**4/(2*self.ns+1.)/ME
             return respArray[self.ns,1]*psi_l
     
-        def transform(self, trans):      
+        def transform(self, trans, inverse=True):
+            # The displacement potential stays spectral (as transformObservers
+            # leaves it), its gradient is returned on the grid.
             u, v = trans.getgrad(self.array)
             return u, v
     
@@ -8,8 +8,12 @@ Date: April 1, 2017
     Methods
     -------
     compute_love_numbers : Compute surface elastic load elastic Love numbers.
+    adaptive_love_numbers : Compute Love numbers, solving only some orders.
+    converged_love_numbers : Compute Love numbers on refined meshes until
+        converged, with Richardson extrapolation.
     hLK_asymptotic : Compute large order-number elastic Love numbers.
     propMatElas : Generate propagator matrices at all points in zarray.
+    propMatElasBatch : Generate propagator matrices for several order numbers.
     gen_elas_b : Generate viscous gravitational source terms for elastic eqs.
 
     _matFill, _matFillscale, _matFillinc, _matFillincscale : 
@@ -30,18 +34,22 @@ Date: April 1, 2017
 from __future__ import division
 import numpy as np
 import sys
-from giapy.earth_tools.earthParams import EarthParams
+from giapy.earth_tools.earthParams import EarthParams, radial_mesh, refine_mesh
+from giapy.numTools.magnus import gauss_points, magnus_trapezoid
 # Check for numba, use if present otherwise, skip.
 try:
     from giapy.numTools.solvdeJit import interior_smatrix_fast, solvde
-    from numba import jit, void, int64, float64
+    from numba import jit, prange, void, int64, float64
+    from giapy.numTools.aot import kernel, jitted, generic, ahead_of_time
     numba_load = True
 except ImportError:
     from giapy.numTools.solvde import interior_smatrix_fast, solvde
+    prange = range
     numba_load = False
 
 def compute_love_numbers(ns, zarray, params, err=1e-14, Q=2, it_counts=False,
-                             comp=True, scaled=False):
+                             comp=True, scaled=False, nbatch=128, tol=None,
+                             order=2):
     """Compute surface elastic load love numbers for harmonic order numbers ns.
 
     Parameters
@@ -57,6 +65,16 @@ def compute_love_numbers(ns, zarray, params, err=1e-14, Q=2, it_counts=False,
     comp : True (default) for compressible, False for incompressible.
     scaled : Use uniform mesh in logarithmic scaling of radial variable if True
         (default False). Transformation is chi = exp(-(rC - r)*(2n-1)/rE).
+    nbatch : int
+        The number of order numbers whose propagator matrices are assembled
+        together (see propMatElasBatch, default 128).
+    tol : float
+        If given, solve only on adaptively chosen order numbers, and
+        interpolate the others (or use the asymptotic values), to relative
+        error tol (see adaptive_love_numbers). Cannot be used with it_counts.
+    order : 2 or 4
+        The order of accuracy of the radial discretization (default 2, see
+        SphericalElasSMat).
 
     Returns
     -------
@@ -65,6 +83,12 @@ def compute_love_numbers(ns, zarray, params, err=1e-14, Q=2, it_counts=False,
     its : len(ns) array of iteration numbers for relaxation method 
         (if it_counts=True).
     """
+    if tol is not None:
+        if it_counts:
+            raise ValueError('it_counts not available for adaptive orders')
+        return adaptive_love_numbers(ns, zarray, params, tol=tol, err=err,
+                                        Q=Q, comp=comp, scaled=scaled,
+                                        order=order)
 
     hLk = []
     if it_counts:
@@ -78,22 +102,23 @@ def compute_love_numbers(ns, zarray, params, err=1e-14, Q=2, it_counts=False,
     # Initial guess - subsequent orders use previous solution.
     y0 = (scalvElas*np.ones((6, len(zarray))).T).T
     
+    difeqElas = SphericalElasSMat(ns[0], zarray, params, Q=Q, comp=comp,
+                                    scaled=scaled, order=order)
+
     # Main order number loop.
     #TODO add adaptive n stepsize and interpolate to interior orders.
-    for n in ns:
+    for i, n in enumerate(ns):
         if n == 1:
             indexv = np.array([0,4,3,1,5,2])
         else:
             indexv = np.array([3,4,0,1,5,2])
         sys.stdout.write('Computing love number {}\r'.format(n))
-     
-        # If not first order num, update relaxation object...
-        try:
-            difeqElas.updateProps(n=n)
-        # ... otherwise create it.
-        except:
-            difeqElas = SphericalElasSMat(ns[0], zarray, params, Q=Q, 
-                                                comp=comp, scaled=scaled)
+
+        # Assemble the propagators of the next nbatch order numbers together,
+        if i % nbatch == 0:
+            As = difeqElas.propagators(ns[i:i+nbatch])
+        # and update the relaxation object.
+        difeqElas.updateProps(n=n, A=As[i % nbatch])
 
         # Perform the relaxation for the order number and store results.
         y0, it = solvde(500, err, slowc, scalvElas, indexv, 3,
@@ -118,11 +143,303 @@ def compute_love_numbers(ns, zarray, params, err=1e-14, Q=2, it_counts=False,
     else:
         return hLk
 
+def adaptive_love_numbers(ns, zarray, params, tol=1e-6, err=1e-14, Q=2,
+                            comp=True, scaled=False, ndense=16, nper=8,
+                            order=2, full_output=False):
+    """Compute elastic Love numbers for order numbers ns, solving only on an
+    adaptively chosen subset of order numbers.
+
+    The Love numbers vary smoothly with n and approach hLK_asymptotic. They
+    are solved (with compute_love_numbers) on all orders up to ndense, and on
+    an initial grid of nper orders per decade above it. Between solved orders,
+    they are interpolated in the scaled variables n*(X - X_inf), for X = h, L
+    and n*(1+k_d), by cubics in log(n). An interval between solved orders is
+    bisected (in log(n)) until the cubic through its neighbours predicts the
+    solution at its midpoint to within tol (relative to X_inf), so orders are
+    densest where the Love numbers curve most. Above the first grid order
+    where the solutions are within tol of X_inf (there and at all higher grid
+    orders), the asymptotic values are used.
+
+    The interpolation assumes the solutions are smooth in n, as they are on a
+    fixed mesh (e.g., earthParams.radial_mesh). On meshes that change with n
+    (scaled=True), the solutions jump by about the discretization error where
+    mesh points cross discontinuities of the parameters, and tol below that
+    error is not reached: intervals are bisected down to consecutive orders,
+    and the error estimate (and the converged flag) reports it.
+
+    Parameters
+    ----------
+    ns : increasing array of order numbers
+    zarray, params, err, Q, comp, scaled, order : see compute_love_numbers
+    tol : float
+        The relative error tolerated in interpolated Love numbers (default
+        1e-6).
+    ndense : int
+        Orders up to ndense are all solved (default 16).
+    nper : int
+        The number of orders per decade of the initial grid (default 8).
+    full_output : boolean
+        If True, also return a dict of information (default False).
+
+    Returns
+    -------
+    hLk : (3, len(ns)) array of h, L, and k_d, as compute_love_numbers.
+    info : dict, if full_output, with
+        solved : the solved order numbers
+        nswitch : the order number above which the asymptotic values are
+            used (None if not reached)
+        errest : the largest estimated relative error of the interpolation
+            (or of the asymptotic values), over the last estimate of every
+            interval, including those left above tol because no order of ns
+            lies inside their halves
+        converged : whether errest is below tol
+    """
+    ns = np.asarray(ns, dtype=int)
+    assert np.all(np.diff(ns) > 0), 'ns must be increasing'
+    assert ns[0] >= 1, 'ns must be positive'
+    nmin, nmax = ns[0], ns[-1]
+
+    Xinf = np.array(hLK_asymptotic(params))
+
+    solved = {}
+    def solve(degs):
+        degs = np.asarray(sorted(degs), dtype=int)
+        if len(degs) == 0:
+            return
+        hLk = compute_love_numbers(degs, zarray, params, err=err, Q=Q,
+                                    comp=comp, scaled=scaled, order=order)
+        for n, hLkn in zip(degs, hLk.T):
+            solved[n] = hLkn
+
+    def scaledVars(degs):
+        """The scaled variables n*(X - X_inf), (3, len(degs))"""
+        degs = np.asarray(degs)
+        X = np.array([solved[n] for n in degs]).T
+        X[2] = degs*(1+X[2])
+        return degs*(X - Xinf[:,None])
+
+    # All orders up to ndense, and the initial grid above it.
+    solve(ns[ns <= ndense])
+    nlow = max(ndense, nmin)
+    if nmax > nlow:
+        num = int(np.ceil(nper*np.log10(nmax/nlow))) + 1
+        grid = np.unique(np.round(np.geomspace(nlow, nmax, num)).astype(int))
+    else:
+        grid = ns[ns > ndense]
+    solve([n for n in grid if n not in solved])
+
+    # Switch to the asymptotic values above nswitch, if reached.
+    nswitch, errest = None, 0.
+    if len(grid) > 0:
+        resid = np.max(np.abs(scaledVars(grid)/grid/Xinf[:,None]), axis=0)
+        within = resid <= tol
+        if within[-1]:
+            # The first grid order from which all are within tol.
+            iswitch = (0 if within.all() else
+                        len(grid) - np.argmin(within[::-1]))
+            nswitch = grid[iswitch]
+            errest = resid[iswitch:].max()
+
+    # Bisect the intervals between solved orders (with orders of ns to
+    # interpolate) until the interpolation error estimate is below tol.
+    top = nmax if nswitch is None else nswitch
+    def needed(a, b):
+        return np.any((ns > a) & (ns < b))
+    nodes = np.array([n for n in sorted(solved) if n >= nlow and n <= top])
+    intervals = [(a, b) for a, b in zip(nodes[:-1], nodes[1:]) if needed(a, b)]
+    while intervals:
+        nodes = np.array([n for n in sorted(solved) if 1 < n <= top])
+        Fnodes = scaledVars(nodes)
+        mids = [min(max(int(round(np.sqrt(a*b))), a+1), b-1)
+                    for a, b in intervals]
+        Fpred = _cubicInterp(np.log(mids), np.log(nodes), Fnodes)
+        solve(mids)
+        est = np.max(np.abs((Fpred - scaledVars(mids))/mids/Xinf[:,None]),
+                        axis=0)
+        newintervals = []
+        for (a, b), m, e in zip(intervals, mids, est):
+            halves = [(a, m), (m, b)] if e > tol else []
+            halves = [(c, d) for c, d in halves if needed(c, d)]
+            # The estimate of an interval that is not bisected further.
+            if not halves:
+                errest = max(errest, e)
+            newintervals += halves
+        intervals = newintervals
+
+    # Assemble the Love numbers: solved, interpolated, or asymptotic.
+    hLk = np.zeros((3, len(ns)))
+    asym = np.zeros(len(ns), dtype=bool) if nswitch is None else ns > nswitch
+    isSolved = np.array([n in solved for n in ns], dtype=bool) & ~asym
+    interp = ~isSolved & ~asym
+    if isSolved.any():
+        hLk[:, isSolved] = np.array([solved[n] for n in ns[isSolved]]).T
+    if interp.any():
+        nodes = np.array([n for n in sorted(solved) if 1 < n <= top])
+        F = _cubicInterp(np.log(ns[interp]), np.log(nodes), scaledVars(nodes))
+        X = Xinf[:,None] + F/ns[interp]
+        X[2] = X[2]/ns[interp] - 1
+        hLk[:, interp] = X
+    if asym.any():
+        hLk[:2, asym] = Xinf[:2,None]
+        hLk[2, asym] = Xinf[2]/ns[asym] - 1
+
+    if full_output:
+        info = {'solved': np.array(sorted(solved)), 'nswitch': nswitch,
+                'errest': errest, 'converged': errest <= tol}
+        return hLk, info
+    else:
+        return hLk
+
+def converged_love_numbers(ns, params, tol=1e-6, nlayers=100, maxlevel=4,
+                            err=1e-14, Q=2, comp=True, scaled=False,
+                            mesh=None, order=2, full_output=False):
+    """Compute elastic Love numbers for order numbers ns, refining the radial
+    mesh for each order number until the discretization error is below tol.
+
+    The order numbers are solved (with compute_love_numbers) on nested
+    meshes of nlayers, 2*nlayers-1, 4*nlayers-3, ... points (each halving
+    the spacing of the last), refined from earthParams.radial_mesh (or a
+    given mesh), or uniform if scaled. From the last three meshes (X_{k-2},
+    X_{k-1}, X_k, for X = h, L and n*(1+k_d)), the order of convergence is
+    observed,
+        p = log2(|X_{k-1} - X_{k-2}|/|X_k - X_{k-1}|),
+    and the Love numbers are Richardson extrapolated,
+        X = X_k + (X_k - X_{k-1})/(2**p - 1),
+    with p limited to 1 <= p <= order. The error of X is estimated by its
+    change from the extrapolation of the previous mesh, or at the first
+    extrapolation (conservatively) by the error of X_k, |X - X_k|, relative
+    to |X|. If the solutions do not converge monotonically (the differences
+    change sign), they are not extrapolated (X = X_k) and the error is
+    estimated as |X_k - X_{k-1}|. Order numbers whose error estimate is
+    below tol are not refined further.
+
+    Uniform meshes cross the discontinuities of the parameters, where the
+    solutions converge slowly (to first order), so that small tolerances are
+    only reached with scaled=False.
+
+    Parameters
+    ----------
+    ns : array of order numbers
+    params, err, Q, comp, scaled, order : see compute_love_numbers
+    tol : float
+        The relative discretization error tolerated (default 1e-6).
+    nlayers : int
+        The number of points of the coarsest mesh (default 100).
+    mesh : array of radii, optional
+        The coarsest mesh, refined by earthParams.refine_mesh. Requires
+        scaled=False. Default is radial_mesh(params, nlayers) (refined near
+        the surface for the largest order number, with the radii of the
+        table for order > 2), or nlayers uniform points if scaled.
+    maxlevel : int
+        The number of refinements, at most (default 4, i.e., meshes of up to
+        16*(nlayers-1)+1 points, at least 2).
+    full_output : boolean
+        If True, also return a dict of information (default False).
+
+    Returns
+    -------
+    hLk : (3, len(ns)) array of h, L, and k_d (extrapolated), as
+        compute_love_numbers.
+    info : dict, if full_output, with arrays (len(ns)) of
+        nlayers : the number of points of the finest mesh used
+        errest : the estimated relative error of the returned solution
+        order : the order of convergence used (0 if not extrapolated)
+        converged : whether errest is below tol
+    """
+    ns = np.asarray(ns, dtype=int)
+    assert maxlevel >= 2, 'Need at least three meshes'
+    assert mesh is None or not scaled, 'A mesh requires scaled=False'
+    if mesh is None and not scaled:
+        mesh = radial_mesh(params, nlayers, nref=ns.max(), kinks=order > 2)
+
+    hLk = np.zeros((3, len(ns)))
+    layers = np.zeros(len(ns), dtype=int)
+    errest = np.full(len(ns), np.inf)
+    observed = np.zeros(len(ns))
+
+    # The solutions (X = h, L, n*(1+k_d)) of the active order numbers on the
+    # last three meshes.
+    active = np.arange(len(ns))
+    Xs = []
+    # The extrapolated solutions of the previous mesh (nan if not
+    # extrapolated).
+    Xprev = None
+    for level in range(maxlevel+1):
+        if mesh is None:
+            zarray = np.linspace(params.rCore, 1., (nlayers-1)*2**level + 1)
+        else:
+            zarray = mesh if level == 0 else refine_mesh(zarray)
+        nz = len(zarray)
+        X = compute_love_numbers(ns[active], zarray, params, err=err, Q=Q,
+                                    comp=comp, scaled=scaled,
+                                    order=order).reshape(3, -1)
+        X[2] = ns[active]*(1+X[2])
+        Xs.append(X)
+        layers[active] = nz
+        hLk[:, active] = X
+        if level < 2:
+            continue
+
+        d1, d2 = Xs[-2] - Xs[-3], Xs[-1] - Xs[-2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = np.clip(np.log2(np.max(np.abs(d1), axis=0) /
+                                np.max(np.abs(d2), axis=0)), 1, order)
+            monotone = np.all(d1*d2 > 0, axis=0) & np.isfinite(p)
+            Xext = np.where(monotone, X + d2/(2**p - 1), X)
+            est = np.where(monotone, np.max(np.abs(Xext - X)/np.abs(Xext),
+                                                axis=0),
+                                    np.max(np.abs(d2/X), axis=0))
+            if Xprev is not None:
+                est = np.where(monotone & np.all(np.isfinite(Xprev), axis=0),
+                                np.max(np.abs(Xext - Xprev)/np.abs(Xext),
+                                        axis=0), est)
+        est[np.all(d2 == 0, axis=0)] = 0.
+
+        hLk[:, active] = Xext
+        errest[active] = est
+        observed[active] = np.where(monotone, p, 0)
+
+        # Refine only the order numbers not yet converged.
+        keep = est > tol
+        active = active[keep]
+        Xs = [Xk[:,keep] for Xk in Xs[-2:]]
+        Xprev = np.where(monotone, Xext, np.nan)[:,keep]
+        if len(active) == 0:
+            break
+        sys.stdout.write('{} order numbers not converged with {} points\n'
+                            .format(len(active), nz))
+
+    hLk[2] = hLk[2]/ns - 1
+
+    if full_output:
+        info = {'nlayers': layers, 'errest': errest, 'order': observed,
+                'converged': errest <= tol}
+        return hLk, info
+    else:
+        return hLk
+
+def _cubicInterp(x, xp, fp):
+    """Interpolate fp (..., len(xp)), given at increasing xp, to x with the
+    cubic through the four nearest points (fewer if xp is shorter)."""
+    x = np.atleast_1d(x)
+    k = min(4, len(xp))
+    j = np.clip(np.searchsorted(xp, x) - k//2, 0, len(xp)-k)
+    idx = j[:,None] + np.arange(k)
+    xs = xp[idx]
+    f = np.zeros(fp.shape[:-1] + (len(x),))
+    for a in range(k):
+        w = np.ones(len(x))
+        for b in range(k):
+            if b != a:
+                w *= (x - xs[:,b])/(xs[:,a] - xs[:,b])
+        f += w*fp[..., idx[:,a]]
+    return f
+
 def hLK_asymptotic(params):
     """Compute large order-number elastic Love numbers from params.
     """
     params.normalize('love')
-    paramSurf = params(1.)
+    paramSurf = params.surface
     mu = paramSurf['shear']
     lam = paramSurf['bulk']
     rho = paramSurf['den']
@@ -133,7 +450,7 @@ def hLK_asymptotic(params):
 
     return(h, L, K)
 
-def propMatElas(zarray, n, params, Q=2, comp=True, scaled=False):
+def propMatElas(zarray, n, params, Q=2, comp=True, scaled=False, breaks=None):
     """Generate the propagator matrix at all points in zarray.
 
     Parameters
@@ -146,6 +463,10 @@ def propMatElas(zarray, n, params, Q=2, comp=True, scaled=False):
         Flag for the definition of the gravity perturbation (see note at top of
         module).
     comp : True (default) for compressible, False for incompressible.
+    breaks : array of indices of zarray, optional
+        Where the parameters are discontinuous, between zarray[i-1] and
+        zarray[i] for i in breaks. The density gradient is not taken across
+        them.
 
     Returns
     -------
@@ -162,13 +483,17 @@ def propMatElas(zarray, n, params, Q=2, comp=True, scaled=False):
         zarray[zarray>1] = 1
         singz = True
             
-    # Interpolate the material parameters to solution points zarray.
-    parvals = params.getParams(zarray)
+    # Interpolate the material parameters to solution points zarray (once
+    # for each mesh).
+    parvals = params.getParams(zarray) if singz else params.onMesh(zarray)
     lam = parvals['bulk']
     mu = parvals['shear']
     rho = parvals['den']
     g = parvals['grav']
-    grad_rho = np.gradient(parvals['den'])/np.gradient(zarray)
+    if breaks is None:
+        grad_rho = np.gradient(rho)/np.gradient(zarray)
+    else:
+        grad_rho = _segmentGradient(rho, zarray, breaks)
 
     # Common values
     beta_i = 1./(lam+2*mu)
@@ -177,10 +502,15 @@ def propMatElas(zarray, n, params, Q=2, comp=True, scaled=False):
     l = (2.*n+1.)
     li = 1./l
 
-    a = np.zeros((len(zarray), 6, 6))
+    # Complex moduli (e.g., in the Laplace domain, see normalmodes) give
+    # complex matrices.
+    cplx = np.iscomplexobj(lam) or np.iscomplexobj(mu)
+    a = np.zeros((len(zarray), 6, 6), dtype=complex if cplx else float)
 
     # Determine which matrix filling function to use
-    if comp:
+    if cplx:
+        fillfunc = _cfills[2*(not comp) + scaled]
+    elif comp:
         if scaled:
             fillfunc = _matFillscale
         else:
@@ -201,8 +531,86 @@ def propMatElas(zarray, n, params, Q=2, comp=True, scaled=False):
     else:
         return (z_i*a.T).T
 
+def propMatElasBatch(zarray, ns, params, Q=2, comp=True, scaled=False,
+                        breaks=None):
+    """Generate the propagator matrices of several order numbers at once.
+
+    The material parameters are interpolated once, and the matrices of the
+    order numbers are filled in parallel (with numba).
+
+    Parameters
+    ----------
+    zarray : array of radius values, (nz) for all order numbers, or 
+        (len(ns), nz), for each order number (e.g., scaled meshes).
+    ns : array of order numbers
+    params, Q, comp, scaled, breaks : see propMatElas
+
+    Returns
+    -------
+    a : (len(ns), nz, 6, 6) array. a[i] is propMatElas(zarray (or zarray[i]),
+        ns[i], params, Q, comp, scaled, breaks).
+    """
+    assert params.normmode == 'love', 'Must normalize parameters'
+
+    ns = np.atleast_1d(ns).astype(np.int64)
+    zarray = np.atleast_2d(np.asarray(zarray, dtype=float))
+
+    # Interpolate the material parameters to all solution points at once.
+    parvals = params.onMesh(zarray)
+    lam = parvals['bulk']
+    mu = parvals['shear']
+    rho = parvals['den']
+    g = parvals['grav']
+    if breaks is None:
+        grad_rho = np.gradient(rho, axis=-1)/np.gradient(zarray, axis=-1)
+    else:
+        grad_rho = _segmentGradient(rho, zarray, breaks)
 
-def gen_elasb(n, hV, params, zarray, Q=1):
+    # Common values
+    beta_i = 1./(lam+2*mu)
+    gamma = mu*(3*lam+2*mu)*beta_i
+    z_i = 1./zarray
+
+    # The row of the parameter arrays of each order number (all share one
+    # row if the mesh is common).
+    rows = np.arange(len(ns)) if len(zarray) > 1 else np.zeros(len(ns), int)
+
+    if np.iscomplexobj(lam) or np.iscomplexobj(mu):
+        # Complex moduli are filled one order number at a time.
+        a = np.zeros((len(ns), zarray.shape[1], 6, 6), dtype=complex)
+        fillfunc = _cfills[2*(not comp) + scaled]
+        for i, (n, j) in enumerate(zip(ns, rows)):
+            l = 2.*n+1.
+            fillfunc(a[i], n, zarray[j], lam[j], mu[j], rho[j], grad_rho[j],
+                        g[j], beta_i[j], gamma[j], z_i[j], l, 1./l, Q)
+        return z_i[rows][:,:,None,None]*a
+
+    a = np.zeros((len(ns), zarray.shape[1], 6, 6))
+    _matFillBatch(a, ns, rows, zarray, lam, mu, rho, grad_rho, g, beta_i,
+                    gamma, z_i, Q, comp, scaled)
+    return a
+
+def _segmentGradient(y, z, breaks):
+    """The gradient of y with respect to z (along the last axis), within each
+    segment between the indices breaks. Points alone in a segment, or
+    coincident with their segment, have zero gradient."""
+    m = y.shape[-1]
+    edges = np.r_[0, breaks, m].astype(int)
+    # The neighbours of each point within its segment (itself at the ends),
+    # giving central differences inside and one-sided ones at the ends, as
+    # np.gradient.
+    idx = np.arange(m)
+    first = np.zeros(m, dtype=bool)
+    first[edges[:-1][edges[:-1] < m]] = True
+    last = np.zeros(m, dtype=bool)
+    last[edges[1:][edges[1:] > 0] - 1] = True
+    inext = np.where(last, idx, idx+1)
+    iprev = np.where(first, idx, idx-1)
+    dz = z[..., inext] - z[..., iprev]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(dz != 0, (y[..., inext] - y[..., iprev])/dz, 0.)
+
+def gen_elasb(n, hV, params, zarray, Q=1, out=None):
     """Generate viscous gravitational source terms for elastic eqs.
 
     Parameters
@@ -215,6 +623,9 @@ def gen_elasb(n, hV, params, zarray, Q=1):
     Q : 1 or 2
         Flag for the definition of the gravity perturbation (see note at top of
         module).
+    out : (len(zarray) + 2, 6) array, optional
+        The array to fill, instead of a new one (e.g., reused for each call
+        in an integration).
 
     Returns
     -------
@@ -231,7 +642,7 @@ def gen_elasb(n, hV, params, zarray, Q=1):
         singz = True
     assert params.normmode == 'love', 'Must normalize parameters' 
      
-    parvals = params.getParams(np.r_[params.rCore, zarray, 1.])
+    parvals = params.onMesh(np.r_[params.rCore, zarray, 1.])
     # CMB values (mantle side)
     rhoC = parvals['den'][0]
     gC = parvals['grav'][0]
@@ -239,27 +650,25 @@ def gen_elasb(n, hV, params, zarray, Q=1):
     denC = params.denCore
 
     # Mantle values.
-    rho = parvals['den'][1:-1]
     g = parvals['grav'][1:-1]
     nonad = parvals['nonad'][1:-1]
-    eta = parvals['visc'][1:-1]
 
     # Surface values.
     rhoS = parvals['den'][-1]
 
-    z_i = 1./zarray
     l = (2.*n+1.)
     li = 1./l
 
-    b = np.zeros((len(zarray)+2, 6))
+    if out is None:
+        b = np.zeros((len(zarray)+2, 6))
+    else:
+        b = out
+        b[:] = 0.
 
     # Lower Boundary Condition inhomogeneity
     if n != 1:
-        b[0,0] = 0.
-        b[0,1] = 0.
         b[0,2] = ((denC-rhoC)*gC*hV[0]*li
                     -rhoC*(denC-rhoC)*hV[0]*li**2)
-        b[0,3] = 0.
         b[0,4] = -(denC-rhoC)*hV[0]*li
         if Q == 1:
             b[0,5] = (denC-rhoC)*hV[0]*li - n/params.rCore*(denC-rhoC)*hV[0]*li**2
@@ -267,29 +676,16 @@ def gen_elasb(n, hV, params, zarray, Q=1):
             b[0,5] = denC*hV[0]*li - 1./params.rCore*(denC-rhoC)*hV[0]*li**2
 
     # Upper Boundary Condition inhomogeneity
-    b[-1,0] = 0.
-    b[-1,1] = 0.
     b[-1,2] = -rhoS*li*hV[-1]
-    b[-1,3] = 0.
-    b[-1,4] = 0.
     if Q == 1:
         b[-1,5] = -rhoS*li*hV[-1]
-    else:
-        b[-1,5] = 0.
 
     # Interior points
-    for i, bi in enumerate(b[1:-1]):
-        hvi = 0.5*(hV[i] + hV[i+1]) 
-
-        bi[0] = 0.
-        bi[1] = 0.
-        bi[2] = -g[i]*nonad[i]*hvi*li
-        bi[3] = 0.
-        bi[4] = zarray[i]*nonad[i]*hvi*li
-        if Q == 1:
-            bi[5] = -(n+1.)*nonad[i]*li*li*hvi
-        else:
-            bi[5] = 0.
+    hvi = 0.5*(hV[:len(zarray)] + hV[1:len(zarray)+1])
+    b[1:-1,2] = -g*nonad*hvi*li
+    b[1:-1,4] = zarray*nonad*hvi*li
+    if Q == 1:
+        b[1:-1,5] = -(n+1.)*nonad*li*li*hvi
 
     return b
 
@@ -308,18 +704,35 @@ class SphericalElasSMat(object):
     comp : 
     b : instantiate with an inhomogeneity vector, see gen_elasb
     scaled : use the logarithmic radius transformation
+    order : 2 or 4 (default 2)
+        The order of accuracy of the difference equations: trapezoidal, with
+        the propagator at the middle of each interval, or fourth-order
+        Magnus steps, with the propagators at the two Gauss points of each
+        interval (see numTools.magnus). The inhomogeneity b is taken at the
+        middle of each interval in both.
+
+    A radius repeated in z (coincident points, see earthParams.radial_mesh)
+    is taken as the bottom and top of a discontinuity of the parameters.
+    Between them, the solution satisfies the jump conditions (for Q=1, q
+    jumps by -(density jump)*h/(2n+1); the other variables, and all for Q=2,
+    are continuous) instead of the differential equations.
 
     Methods
     -------
     updateProps : Update the stored propagator matrices
+    propagators : Propagator matrices of several order numbers
+    jump : The jump matrix across coincident points
     smatrix : Provide the kth block-diagonal matrix for Solvde
     checkbc : Check the error at the boundary conditions for a solution array y
     """
-    def __init__(self, n, z, params, Q=1, comp=True, b=None, scaled=False):
+    def __init__(self, n, z, params, Q=1, comp=True, b=None, scaled=False,
+                    order=2):
+        assert order in (2, 4), 'order must be 2 or 4'
         self.n = n
         self.mpt = len(z)
         self.z = z
         self.scaled = scaled
+        self.order = order
 
         # Make sure parameters are normalized properly.
         params.normalize('love')
@@ -331,7 +744,7 @@ class SphericalElasSMat(object):
       
         self.updateProps(self.n, self.z, self.b)
         
-    def updateProps(self, n=None, z=None, b=None):
+    def updateProps(self, n=None, z=None, b=None, A=None):
         """Update the stored propagator matrices.
 
         Note: arguments input as None are not changed.
@@ -341,17 +754,26 @@ class SphericalElasSMat(object):
         n : update the order number
         z : update the array of radii
         b : update the inhomogeneity vector
+        A : the propagator matrices for n and z, if already computed (see
+            propagators)
         """
         self.n = n or self.n
         if not self.scaled:
             self.z = self.z if z is None else z
+        if z is not None:
+            self._findDiscontinuities()
 
         # Only recompute A matrix if n or z are changed.
         if n is not None or z is not None:
-            self.A = propMatElas(self.zmids, self.n, self.params, self.Q, 
-                                    self.comp, self.scaled)
-            if self.scaled:
-                self.A = 1./self.zetamids[:,None,None]*self.A
+            if A is not None:
+                self.A = A
+            elif self.order == 4:
+                self.A = self.propagators(self.n)[0]
+            else:
+                self.A = propMatElas(self.zmids, self.n, self.params, self.Q, 
+                                        self.comp, self.scaled, self.breaks)
+                if self.scaled:
+                    self.A = 1./self.zetamids[:,None,None]*self.A
             self.load = 1./self.params.getLithFilter(n=n)
 
         if b is not None:
@@ -359,6 +781,79 @@ class SphericalElasSMat(object):
                 b[1:-1] *= 1./self.zetamids[:,None]/(self.n+0.5)
             self.b = b
 
+    def propagators(self, ns):
+        """Return the propagator matrices (len(ns), mpt-1, 6, 6) of order
+        numbers ns on the mesh, as stored by updateProps (see
+        propMatElasBatch)."""
+        ns = np.atleast_1d(ns)
+        if self.order == 4:
+            return self._magnusPropagators(ns)
+        if self.scaled:
+            # The scaled mesh depends on the order number.
+            zeta_c = np.exp((ns[:,None] + 0.5)*(self.params.rCore - 1))
+            zetamids = ((np.arange(1,self.mpt)-0.5)/(self.mpt-1)*(1-zeta_c) +
+                            zeta_c)
+            zmids = 1 + np.log(zetamids)/(ns[:,None]+0.5)
+            A = propMatElasBatch(zmids, ns, self.params, self.Q, self.comp,
+                                    self.scaled)
+            return 1./zetamids[:,:,None,None]*A
+        else:
+            return propMatElasBatch(self.zmids, ns, self.params, self.Q,
+                                    self.comp, self.scaled, self.breaks)
+
+    def _magnusPropagators(self, ns):
+        """The propagators of order numbers ns whose trapezoidal steps are
+        the fourth-order Magnus steps (see numTools.magnus)."""
+        if self.scaled:
+            zeta_c = np.exp((ns[:,None] + 0.5)*(self.params.rCore - 1))
+            h = np.repeat((1-zeta_c)/(self.mpt-1), self.mpt-1, axis=1)
+            zetamids = (np.arange(1,self.mpt)-0.5)*h + zeta_c
+            zetas = gauss_points(zetamids, h).reshape(len(ns), -1)
+            zs = 1 + np.log(zetas)/(ns[:,None]+0.5)
+            A = propMatElasBatch(zs, ns, self.params, self.Q, self.comp,
+                                    self.scaled)
+            A = 1./zetas[:,:,None,None]*A
+        else:
+            h = np.diff(self.z)
+            zs = gauss_points(self.zmids, h).ravel()
+            breaks = None if self.breaks is None else 2*self.breaks
+            A = propMatElasBatch(zs, ns, self.params, self.Q, self.comp,
+                                    self.scaled, breaks)
+        A = A.reshape(len(ns), self.mpt-1, 2, 6, 6)
+        return magnus_trapezoid(A[:,:,0], A[:,:,1], h)
+
+    def _findDiscontinuities(self):
+        """Find the discontinuities of the parameters on the mesh: the
+        intervals between coincident points (self.coincident), the jumps in
+        density across them (self.denjump), and the indices of the interval
+        midpoints between which the density gradient is not taken
+        (self.breaks, at the points of the mesh at radii of the parameter
+        table, where the interpolated density is discontinuous or kinked,
+        None if there are none)."""
+        self.coincident = np.zeros(self.mpt-1, dtype=bool)
+        self.denjump = np.zeros(self.mpt-1)
+        self.breaks = None
+        if self.scaled:
+            return
+        z = np.asarray(self.z)
+        # Points at the table's radii separate the intervals below and above.
+        atdisc = np.isin(z, self.params.z)
+        atdisc[[0, -1]] = False
+        if atdisc.any():
+            self.breaks = np.nonzero(atdisc)[0]
+        self.coincident = np.diff(z) == 0
+        if self.coincident.any():
+            icoin = np.nonzero(self.coincident)[0]
+            self.denjump[icoin] = self.params.getJumps(z[icoin])['den']
+
+    def jump(self, k):
+        """The matrix J of the jump conditions y[k+1] - y[k] = J y[k] across
+        the coincident points k and k+1."""
+        J = np.zeros((6, 6))
+        if self.Q == 1:
+            J[5,0] = -self.denjump[k]/(2.*self.n+1.)
+        return J
+
     @property
     def zeta(self):
         return np.arange(self.mpt)/(self.mpt-1)*(1-self.zeta_c)+self.zeta_c
@@ -392,6 +887,26 @@ class SphericalElasSMat(object):
     def zeta2z(self, zeta):
         return 1 + np.log(zeta)/(self.n+0.5)
 
+    def relaxArrays(self):
+        """Return the propagators, inhomogeneities and point separations of
+        the interior s matrices (see solvdeJit.solvde_linear)."""
+        if self.scaled:
+            h = np.repeat(self.zetasep, self.mpt-1)
+        else:
+            h = np.diff(self.z)
+        if self.b is None:
+            b = np.zeros((self.mpt-1, 6))
+        else:
+            b = self.b[2:self.mpt+1]
+        A = self.A
+        if self.coincident.any():
+            # Jump conditions across coincident points (0.5*h*A = J/2, as
+            # in smatrix).
+            A, b, h = A.copy(), b.copy(), h.astype(float)
+            for k in np.nonzero(self.coincident)[0]:
+                A[k], b[k], h[k] = self.jump(k), 0., 1.
+        return A, b, h
+
     def smatrix(self, k, k1, k2, jsf, is1, isf, indexv, s, y): 
         Q = self.Q
 
@@ -406,7 +921,7 @@ class SphericalElasSMat(object):
         if comp1(k, k1):      # Core-Mantle boundary conditions.
                 
             rCore = self.params.rCore
-            paramsCore = self.params(rCore)
+            paramsCore = self.params.core
             gCore = paramsCore['grav']
             
             denCore = self.params.denCore
@@ -465,7 +980,7 @@ class SphericalElasSMat(object):
                 
 
         elif comp2(k,k2):     # Surface boundary conditions.    
-            paramsSurf = self.params(1.) 
+            paramsSurf = self.params.surface
             rhoSurf = paramsSurf['den']
 
             # Radial stress on surface.
@@ -510,6 +1025,13 @@ class SphericalElasSMat(object):
                 s[[k2i,k2j,k2k],jsf] -= self.b[-1, [2,3,5]]
                 
 
+        elif self.coincident[k-1]:  # Jump conditions at a discontinuity.
+            # y_k - y_{k-1} = J y_{k-1} = J (y_k + y_{k-1})/2, as J only
+            # involves h, which is continuous.
+            A = 0.5*self.jump(k-1)
+            b = np.zeros(6)
+            interior_smatrix_fast(6, k, jsf, A, b, y, indexv, s)
+
         else:           # Finite differences.
             A = 0.5*self.sep(k)*self.A[k-1]
             if self.b is None:
@@ -778,18 +1300,89 @@ def _matFillscaleinc(a, n, zarray, lam, mu, rho, grad_rho, g,
 
 # numba speeds up the filling of the propagator matrix dramatically.
 if numba_load: 
-    _matFill = jit(void(float64[:,:,:], int64, float64[:], float64[:], float64[:], float64[:],
+    _matFill = kernel(void(float64[:,:,:], int64, float64[:], float64[:], float64[:], float64[:],
         float64[:], float64[:], float64[:], float64[:], float64[:], float64,
-        float64, int64), nopython=True)(_matFill)
-    _matFillscale = jit(void(float64[:,:,:], int64, float64[:], float64[:], float64[:], float64[:],
+        float64, int64))(_matFill)
+    _matFillscale = kernel(void(float64[:,:,:], int64, float64[:], float64[:], float64[:], float64[:],
         float64[:], float64[:], float64[:], float64[:], float64[:], float64,
-        float64, int64), nopython=True)(_matFillscale)
-    _matFillinc = jit(void(float64[:,:,:], int64, float64[:], float64[:], float64[:], float64[:],
+        float64, int64))(_matFillscale)
+    _matFillinc = kernel(void(float64[:,:,:], int64, float64[:], float64[:], float64[:], float64[:],
         float64[:], float64[:], float64[:], float64[:], float64[:], float64,
-        float64, int64), nopython=True)(_matFillinc)
-    _matFillscaleinc = jit(void(float64[:,:,:], int64, float64[:], float64[:], float64[:], float64[:],
+        float64, int64))(_matFillinc)
+    _matFillscaleinc = kernel(void(float64[:,:,:], int64, float64[:], float64[:], float64[:], float64[:],
         float64[:], float64[:], float64[:], float64[:], float64[:], float64,
-        float64, int64), nopython=True)(_matFillscaleinc)
+        float64, int64))(_matFillscaleinc)
+
+# The fill functions called by _matFillBatch (numba functions, even if the
+# kernels were compiled ahead of time).
+if numba_load:
+    _fills = [jitted(f) for f in (_matFill, _matFillscale, _matFillinc,
+                                    _matFillscaleinc)]
+else:
+    _fills = [_matFill, _matFillscale, _matFillinc, _matFillscaleinc]
+_fill, _fillscale, _fillinc, _fillscaleinc = _fills
+
+# The fill functions for complex parameters, compiled for the types of their
+# arguments.
+if numba_load:
+    _cfills = [generic(f) for f in (_matFill, _matFillscale, _matFillinc,
+                                    _matFillscaleinc)]
+else:
+    _cfills = _fills
+
+def _matFillBatch(a, ns, rows, zarray, lam, mu, rho, grad_rho, g, beta_i,
+                    gamma, z_i, Q, comp, scaled):
+    """Fill (and scale by 1/z) the propagator matrices a[i] of order numbers
+    ns[i], in parallel, used internally by propMatElasBatch. The parameter
+    arrays' row rows[i] is used for order number ns[i]."""
+    nz = zarray.shape[1]
+    for i in prange(len(ns)):
+        n = ns[i]
+        j = rows[i]
+        l = 2.*n+1.
+        li = 1./l
+        if comp:
+            if scaled:
+                _fillscale(a[i], n, zarray[j], lam[j], mu[j], rho[j],
+                            grad_rho[j], g[j], beta_i[j], gamma[j], z_i[j],
+                            l, li, Q)
+            else:
+                _fill(a[i], n, zarray[j], lam[j], mu[j], rho[j],
+                        grad_rho[j], g[j], beta_i[j], gamma[j], z_i[j],
+                        l, li, Q)
+        else:
+            if scaled:
+                _fillscaleinc(a[i], n, zarray[j], lam[j], mu[j], rho[j],
+                                grad_rho[j], g[j], beta_i[j], gamma[j],
+                                z_i[j], l, li, Q)
+            else:
+                _fillinc(a[i], n, zarray[j], lam[j], mu[j], rho[j],
+                            grad_rho[j], g[j], beta_i[j], gamma[j], z_i[j],
+                            l, li, Q)
+        for k in range(nz):
+            for p in range(6):
+                for q in range(6):
+                    a[i,k,p,q] *= z_i[j,k]
+
+def _matFillSerial(a, ns, rows, zarray, lam, mu, rho, grad_rho, g, beta_i,
+                    gamma, z_i, Q, comp, scaled):
+    """As _matFillBatch, one order number at a time with the kernels compiled
+    ahead of time, which the parallel _matFillBatch cannot call without
+    compiling them again."""
+    fillfunc = [_matFill, _matFillscale, _matFillinc,
+                    _matFillscaleinc][2*(not comp) + scaled]
+    for i, (n, j) in enumerate(zip(ns, rows)):
+        l = 2.*n+1.
+        fillfunc(a[i], n, zarray[j], lam[j], mu[j], rho[j], grad_rho[j],
+                    g[j], beta_i[j], gamma[j], z_i[j], l, 1./l, Q)
+    a *= z_i[rows][:,:,None,None]
+
+if numba_load:
+    if ahead_of_time(_matFill):
+        _matFillBatch = _matFillSerial
+    else:
+        _matFillBatch = jit(nopython=True, parallel=True,
+                                cache=True)(_matFillBatch)
 
 
 
@@ -0,0 +1,128 @@
+"""
+laplacelove.py
+Author: Samuel B. Kachuck
+
+    Compute the viscoelastic Love numbers in the Laplace domain.
+
+    An alternative to the time stepping of viscellove.compute_viscel_numbers:
+    by the correspondence principle, the Laplace-domain Love numbers X(s) of
+    a Maxwell earth are the elastic Love numbers of the moduli of
+    normalmodes.LaplaceParams, computed by one radial solve per (complex)
+    rate (normalmodes.laplace_love_numbers). The response to a Heaviside
+    load, X(t), the inverse transform of X(s)/s, is evaluated by the
+    quadrature of numTools.invlaplace on hyperbolic contours, each serving
+    the times of a window of a decade.
+
+    The cost is then set by the number of windows spanned by the times, not
+    by their number or by the stiffness of the relaxation at long times, and
+    the solves, independent of each other, are spread over processes. Unlike
+    normalmodes.find_modes, no modes are sought, so that parameters varying
+    continuously (with continua of modes) need not be layered.
+
+    Methods
+    -------
+    compute_laplace_numbers : Compute the viscoelastic Love numbers.
+
+"""
+
+from __future__ import division
+import multiprocessing
+
+import numpy as np
+
+from giapy.earth_tools.normalmodes import laplace_love_numbers
+from giapy.numTools.invlaplace import time_windows, hyperbola, invert
+
+def compute_laplace_numbers(ns, ts, zarray, params, Q=2, comp=True, order=2,
+                                nodes=24, nprocs=None):
+    """Compute the viscoelastic Love numbers associated with params at times
+    ts by inversion of the Laplace-domain Love numbers.
+
+    Parameters
+    ----------
+    ns : order numbers to compute (at least 1)
+    ts : times (ka) at which to compute, nonnegative (t = 0 gives the
+        elastic Love numbers)
+    zarray : array of radii
+    params : <giapy.earth_tools.earthParams.EarthParams>
+        Object for storing and interpolating the earth's material parameters.
+    Q, comp, order : see elasticlove.SphericalElasSMat (default 2,
+        compressible, second order).
+    nodes : int
+        The contour of each window of times has 2*nodes+1 points, nodes+1 of
+        which are solved for (default 24, relative error about 1e-9, see
+        numTools.invlaplace).
+    nprocs : int
+        The number of processes (default, the number of cpus; 1 computes in
+        this process).
+
+    Returns
+    -------
+    hLkt : array size (len(ns), 3, len(ts)) of love numbers
+            Vertical Displacement, Horizontal Displacement, Geoid
+        (squeezed, as compute_viscel_numbers).
+
+    As compute_viscel_numbers, the thin-plate lithosphere
+    (params.getLithFilter) filters the load and accelerates the relaxation of
+    each order number.
+    """
+    params.normalize('love')
+    ns = np.atleast_1d(ns).astype(int)
+    ts = np.atleast_1d(np.asarray(ts, dtype=float))
+    assert np.all(ts >= 0), 'Times must be nonnegative.'
+
+    # The windows of normalized times (in units of tau/2) of each order
+    # number, and the rates at which they need X(s) (the last elastic).
+    windows, rates = [], []
+    for n in ns:
+        tn = ts*params.getLithFilter(n=n)/(0.5*params.tau)
+        nwins = [(inds, tn[inds]) + hyperbola(t0, nodes)
+                    for t0, inds in time_windows(tn)]
+        windows.append(nwins)
+        rates.append(np.concatenate([s for _, _, s, _ in nwins] +
+                                    [[np.inf]]))
+
+    tasks = [(n, s) for n, srates in zip(ns, rates) for s in srates]
+    if nprocs == 1:
+        _init_worker(zarray, params, dict(Q=Q, comp=comp, order=order))
+        results = list(map(_laplaceWorker, tasks))
+    else:
+        pool = multiprocessing.Pool(nprocs, initializer=_init_worker,
+                                    initargs=(zarray, params,
+                                        dict(Q=Q, comp=comp, order=order)))
+        try:
+            results = pool.map(_laplaceWorker, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    hLkt = np.zeros((len(ns), 3, len(ts)))
+    i0 = 0
+    for i, nwins in enumerate(windows):
+        X = np.array(results[i0:i0+len(nwins)*(nodes+1)+1]).T
+        i0 += len(nwins)*(nodes+1)+1
+        hLkt[i] = X[:,-1,None].real
+        for j, (inds, tn, s, w) in enumerate(nwins):
+            seg = slice(j*(nodes+1), (j+1)*(nodes+1))
+            hLkt[i,:,inds] = invert(X[:,seg]/s, s, w, tn).T
+
+    # Correct n=1 case
+    if ns[0] == 1:
+        hLkt[0,:2,:] += hLkt[0,2,:]
+        hLkt[0,2,:] -= hLkt[0,2,:]
+
+    return np.squeeze(hLkt)
+
+# The mesh, parameters and options used by worker processes, set by
+# _init_worker.
+_ZARRAY, _PARAMS, _KWARGS = None, None, None
+
+def _init_worker(zarray, params, kwargs):
+    global _ZARRAY, _PARAMS, _KWARGS
+    _ZARRAY, _PARAMS, _KWARGS = zarray, params, kwargs
+
+def _laplaceWorker(args):
+    """The Laplace-domain Love numbers of one order number at one rate, used
+    by compute_laplace_numbers."""
+    n, s = args
+    return laplace_love_numbers(n, s, _PARAMS, _ZARRAY, **_KWARGS)[2]
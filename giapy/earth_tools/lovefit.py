@@ -0,0 +1,168 @@
+"""
+lovefit.py
+Author: Samuel B. Kachuck
+
+    Fit viscoelastic Love numbers computed in the time domain (e.g., by
+    viscellove.compute_viscel_numbers, laplacelove.compute_laplace_numbers or
+    read from the table of giapy-velove) with sums of exponential modes,
+        X(t) = X_e + sum_j a_j (1 - exp(s_j t)),
+    the form of normalmodes.find_modes and of
+    earthSphericalLap.SphericalEarth (see fitLoveNumbers).
+
+    The rates are fit by variable projection: for given rates the amplitudes
+    (and X_e) of all the fit series are linear least squares, and only the
+    rates are varied (scipy.optimize.least_squares, on their logarithms).
+    They are started by forward selection from a logarithmic grid spanning
+    the times, adding one rate at a time, the one that most reduces the
+    residual. Each series is weighted by its range, so that the relaxation
+    of each Love number is fit to the same relative accuracy.
+
+    Consecutive order numbers share their rates (and the cost of their
+    convolution with a load history) as long as the fit of every one of them
+    stays within a tolerance (see fit_modes).
+
+    Methods
+    -------
+    fit_modes : fit the modes of Love numbers of many order numbers.
+    fit_exponentials : fit series with sums of exponentials of shared rates.
+
+"""
+
+from __future__ import division
+import sys
+
+import numpy as np
+from scipy.optimize import least_squares
+
+# The density (per decade) of the grid of rates of the forward selection,
+# and its extent beyond the rates resolved by the times.
+GRIDDENSITY = 8
+GRIDMARGIN = 10.
+
+def fit_modes(ts, hLkt, nmodes=8, share_tol=1e-3, ns=None, verbose=False):
+    """Fit the Love numbers of many order numbers with exponential modes.
+
+    Parameters
+    ----------
+    ts : array of times (nonnegative). If 0 is not among them, the elastic
+        values are extrapolated.
+    hLkt : (len(ns), 3, len(ts)) array of Love numbers (e.g., h, L and k_d,
+        see compute_viscel_numbers).
+    nmodes : int
+        The number of modes of each order number (default 8). Fewer modes
+        make convolutions faster, and the fits less accurate.
+    share_tol : float
+        Consecutive order numbers share their rates if the residuals of all
+        of them stay below share_tol (default 1e-3). If None, each order
+        number has its own rates.
+    ns : array of the order numbers of hLkt, for the output of verbose
+        (default, 1 to len(hLkt)).
+    verbose : boolean
+        Print the groups of order numbers and their residuals.
+
+    Returns
+    -------
+    hLke : (len(ns), 3) array of the elastic (t = 0) values.
+    modes : (len(ns), nmodes, 4) array of the rates s_j (negative, in the
+        inverse units of ts) and amplitudes a_j, by decreasing rate, as
+        normalmodes.normal_modes.
+    resid : (len(ns)) array of the largest root-mean-square residual of the
+        three Love numbers of each order number, relative to their ranges.
+    groups : (len(ns)) array labelling the order numbers that share rates.
+    """
+    ts = np.asarray(ts, dtype=float)
+    hLkt = np.asarray(hLkt, dtype=float)
+    nn = len(hLkt)
+    ns = np.arange(1, nn+1) if ns is None else np.asarray(ns)
+
+    hLke = np.zeros((nn, 3))
+    modes = np.zeros((nn, nmodes, 4))
+    resid = np.zeros(nn)
+    groups = np.zeros(nn, dtype=int)
+
+    def store(i0, i1, fit, label):
+        rates, Xe, amps, res = fit
+        hLke[i0:i1] = Xe.reshape(i1-i0, 3)
+        modes[i0:i1,:,0] = -rates
+        modes[i0:i1,:,1:] = amps.T.reshape(i1-i0, 3, -1).transpose(0, 2, 1)
+        resid[i0:i1] = res.reshape(i1-i0, 3).max(axis=1)
+        groups[i0:i1] = label
+        if verbose:
+            sys.stdout.write('Order numbers {0}-{1}: {2} modes, residual '
+                             '{3:.1e}\n'.format(ns[i0], ns[i1-1], len(rates),
+                                                resid[i0:i1].max()))
+
+    i0, label = 0, 0
+    while i0 < nn:
+        fit = fit_exponentials(ts, hLkt[i0], nmodes)
+        i1 = i0 + 1
+        # Extend the group while the shared rates fit.
+        while share_tol is not None and i1 < nn:
+            trial = fit_exponentials(ts, hLkt[i0:i1+1].reshape(-1, len(ts)),
+                                        nmodes, rates=fit[0])
+            if trial[3].max() > share_tol:
+                break
+            fit, i1 = trial, i1 + 1
+        store(i0, i1, fit, label)
+        i0, label = i1, label + 1
+    return hLke, modes, resid, groups
+
+def fit_exponentials(ts, Y, nmodes, rates=None):
+    """Fit the series Y (m, len(ts)) with sums of decaying exponentials of
+    nmodes shared rates,
+        Y(t) = Y_e + sum_j a_j (1 - exp(-rates_j t)).
+
+    Parameters
+    ----------
+    ts : array of times (nonnegative)
+    Y : (m, len(ts)) array of series
+    nmodes : int, the number of rates
+    rates : array of nmodes initial rates (default, chosen by forward
+        selection from a logarithmic grid)
+
+    Returns
+    -------
+    rates : (nmodes) array of positive rates, decreasing.
+    Ye : (m) array of the fit values at t = 0.
+    amps : (nmodes, m) array of the amplitudes a_j.
+    resid : (m) array of the root-mean-square residuals, relative to the
+        ranges of the series.
+    """
+    ts = np.asarray(ts, dtype=float)
+    Y = np.atleast_2d(Y)
+    scale = np.ptp(Y, axis=1)
+    scale[scale == 0] = 1.
+    Yw = (Y/scale[:,None]).T
+
+    tpos = ts[ts > 0]
+    lo, hi = 1./(GRIDMARGIN*tpos.max()), GRIDMARGIN/tpos.min()
+
+    def residual(logr):
+        B = _basis(ts, np.exp(logr))
+        c = np.linalg.lstsq(B, Yw, rcond=None)[0]
+        return (Yw - B.dot(c)).ravel()
+
+    if rates is None:
+        grid = np.logspace(np.log10(lo), np.log10(hi),
+                            int(GRIDDENSITY*np.log10(hi/lo))+1)
+        rates = []
+        for j in range(nmodes):
+            cost = [np.sum(residual(np.log(np.r_[rates, r]))**2)
+                        if r not in rates else np.inf for r in grid]
+            rates.append(grid[np.argmin(cost)])
+    logr0 = np.clip(np.log(rates), np.log(lo/GRIDMARGIN),
+                        np.log(hi*GRIDMARGIN))
+    res = least_squares(residual, logr0, bounds=(np.log(lo/GRIDMARGIN),
+                                                 np.log(hi*GRIDMARGIN)))
+    logr = res.x if res.cost <= 0.5*np.sum(residual(logr0)**2) else logr0
+    rates = np.sort(np.exp(logr))[::-1]
+
+    # Y = c_0 + sum_j c_j exp(-rates_j t), so Y_e = sum_j c_j, a_j = -c_j.
+    B = _basis(ts, rates)
+    c = np.linalg.lstsq(B, Y.T, rcond=None)[0]
+    resid = np.sqrt(np.mean((Y.T - B.dot(c))**2, axis=0))/scale
+    return rates, c.sum(axis=0), -c[1:], resid
+
+def _basis(ts, rates):
+    """The columns 1 and exp(-rates_j t) of the fits."""
+    return np.c_[np.ones(len(ts)), np.exp(-np.outer(ts, rates))]
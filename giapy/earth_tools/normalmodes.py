@@ -0,0 +1,461 @@
+"""
+normalmodes.py
+Author: Samuel B. Kachuck
+
+    Compute the viscoelastic normal modes of the load Love numbers.
+
+    A Maxwell earth responds to a load in the Laplace domain as an elastic
+    earth with the shear modulus
+        mu(s) = mu s/(s + mu/eta),
+    and the same bulk modulus, so that the Laplace-domain Love numbers X(s)
+    are computed by the propagator matrices of the elastic equations (see
+    elasticlove.SphericalElasSMat) with the moduli of LaplaceParams. They
+    are meromorphic, with poles at the relaxation rates s_j of the normal
+    modes, the roots of the secular determinant D(s) of the boundary value
+    problem,
+        X(s) = X_e - sum_j a_j s_j/(s - s_j),
+    so that the response to a Heaviside load is
+        X(t) = X_e + sum_j a_j (1 - exp(s_j t)),
+    with X_e the elastic Love numbers and X_e + sum_j a_j the fluid limit.
+    These are the hlke, hlks and hlkf of
+    earthSphericalLap.SphericalEarth (see calcNormalModes).
+
+    The rates are negative, except for the slow, unstable modes of density
+    inversions (e.g., PREM's low-velocity zone, in a mantle without an
+    elastic lithosphere).
+
+    The roots are found by scanning D(s) on logarithmic grids of positive
+    and negative rates, refined near the Maxwell rates -mu/eta of the model
+    (where D has poles), and bracketing its sign changes, and the pairs of
+    roots between two points of the grid at which |D| has a local minimum
+    that crosses zero.
+    The modes are finitely many, and so found, only if the Maxwell rates
+    are, so the parameters are first made homogeneous in layers (see
+    earthParams.layered_params), as in other normal-mode codes. Continuous
+    variations of the moduli or density give continua of modes instead.
+
+    Methods
+    -------
+    laplace_love_numbers : Laplace-domain Love numbers and secular
+        determinant.
+    find_modes : the relaxation modes of one order number.
+    normal_modes : the relaxation modes of many order numbers, in parallel
+        and cached on disk.
+    cayley_propagate : propagate solutions through trapezoidal steps.
+
+    Classes
+    -------
+    LaplaceParams : the Laplace-domain parameters of a Maxwell earth.
+
+"""
+
+from __future__ import division
+import os
+import sys
+import hashlib
+import multiprocessing
+
+import numpy as np
+from scipy.optimize import brentq, minimize_scalar
+from numba import float64
+
+from giapy.earth_tools.earthParams import layered_params, radial_mesh
+from giapy.earth_tools.elasticlove import SphericalElasSMat
+from giapy.numTools.solvdeJit import boundary_rows
+from giapy.numTools.aot import kernel, generic
+
+# The default directory of the cached modes, from the environment variable
+# GIAPY_CACHEDIR (None disables the disk cache).
+CACHEDIR = os.environ.get('GIAPY_CACHEDIR', None)
+
+class LaplaceParams(object):
+    """The Laplace-domain parameters of a Maxwell earth at rate s.
+
+    Wraps an EarthParams, replacing the shear modulus with
+    mu s/(s + mu/eta) and the first Lame parameter with
+    lam + 2(mu - mu(s))/3 (the same bulk modulus). Other attributes are
+    those of params. s = inf gives the elastic parameters.
+
+    Parameters
+    ----------
+    params : <giapy.earth_tools.earthParams.EarthParams>
+        In 'love' normalization.
+    s : float or complex
+        The (normalized) Laplace rate.
+    """
+    def __init__(self, params, s):
+        self.params = params
+        self.s = s
+
+    def __getattr__(self, name):
+        return getattr(self.params, name)
+
+    def _laplace(self, vals):
+        vals = dict(vals)
+        if np.isinf(self.s):
+            return vals
+        mu, lam = vals['shear'], vals['bulk']
+        mus = mu*self.s/(self.s + mu/vals['visc'])
+        vals['shear'] = mus
+        vals['bulk'] = lam + 2.*(mu - mus)/3.
+        return vals
+
+    def getParams(self, z, depth=False):
+        return self._laplace(self.params.getParams(z, depth))
+
+    def onMesh(self, z):
+        return self._laplace(self.params.onMesh(z))
+
+@kernel(float64(float64[:,:,:], float64[:], float64[:,:]))
+def cayley_propagate(A, h, Y):
+    """Propagate the solutions Y (m, nc) through the trapezoidal (Cayley)
+    steps y_k = (I - h_k A_k/2)**-1 (I + h_k A_k/2) y_{k-1}, in place.
+
+    The columns are orthonormalized after each step (Gram-Schmidt), so that
+    they stay independent, and the logarithm of the product of their
+    normalizations (the determinant of the change of basis) is returned.
+    Complex A and Y (at complex rates) are propagated by
+    _cayleyPropagateComplex.
+    """
+    m = Y.shape[0]
+    nc = Y.shape[1]
+    M = np.empty((m, m), dtype=Y.dtype)
+    P = np.empty((m, nc), dtype=Y.dtype)
+    logdet = 0.
+    for k in range(A.shape[0]):
+        hh = 0.5*h[k]
+        for i in range(m):
+            for j in range(m):
+                M[i,j] = -hh*A[k,i,j]
+            M[i,i] += 1.
+            for c in range(nc):
+                rgt = Y[i,c]
+                for j in range(m):
+                    rgt += hh*A[k,i,j]*Y[j,c]
+                P[i,c] = rgt
+
+        # Solve M.Y = P by Gaussian elimination with partial pivoting.
+        for j in range(m):
+            piv = j
+            big = abs(M[j,j])
+            for i in range(j+1, m):
+                if abs(M[i,j]) > big:
+                    big = abs(M[i,j])
+                    piv = i
+            if piv != j:
+                for l in range(m):
+                    M[j,l], M[piv,l] = M[piv,l], M[j,l]
+                for c in range(nc):
+                    P[j,c], P[piv,c] = P[piv,c], P[j,c]
+            for i in range(j+1, m):
+                fac = M[i,j]/M[j,j]
+                for l in range(j, m):
+                    M[i,l] -= fac*M[j,l]
+                for c in range(nc):
+                    P[i,c] -= fac*P[j,c]
+        for c in range(nc):
+            for i in range(m-1, -1, -1):
+                rgt = P[i,c]
+                for l in range(i+1, m):
+                    rgt -= M[i,l]*Y[l,c]
+                Y[i,c] = rgt/M[i,i]
+
+        # Modified Gram-Schmidt.
+        for c in range(nc):
+            for c1 in range(c):
+                p = 0.*Y[0,c]
+                for i in range(m):
+                    p += np.conj(Y[i,c1])*Y[i,c]
+                for i in range(m):
+                    Y[i,c] -= p*Y[i,c1]
+            r = 0.
+            for i in range(m):
+                r += abs(Y[i,c])**2
+            r = np.sqrt(r)
+            logdet += np.log(r)
+            for i in range(m):
+                Y[i,c] /= r
+    return logdet
+
+# The propagation at complex rates, compiled for complex arrays.
+_cayleyPropagateComplex = generic(cayley_propagate)
+
+def laplace_love_numbers(n, s, params, zarray, Q=2, comp=False, order=2):
+    """Compute the Laplace-domain Love numbers and secular determinant of
+    order number n at rate s.
+
+    The three solutions that satisfy the core-mantle boundary conditions are
+    propagated to the surface (cayley_propagate) through the difference
+    equations of elasticlove.SphericalElasSMat (unscaled), and combined to
+    satisfy the surface conditions.
+
+    Parameters
+    ----------
+    n : int, order number
+    s : float or complex, normalized Laplace rate (np.inf for elastic)
+    params : <giapy.earth_tools.earthParams.EarthParams>
+        In 'love' normalization.
+    zarray : array of radii
+    Q, comp, order : see SphericalElasSMat (default incompressible).
+
+    Returns
+    -------
+    D : float (complex for complex s)
+        The secular determinant, det(Btop.Y) for the surface conditions
+        Btop.y + ctop = 0 and propagated solutions Y, up to a positive
+        factor.
+    logdet : float
+        The logarithm of the positive factor left out of D.
+    hLk : array of h, L and k_d (as elasticlove.compute_love_numbers).
+    """
+    difeq = SphericalElasSMat(n, zarray, LaplaceParams(params, s), Q=Q,
+                                comp=comp, order=order)
+    A, _, h = difeq.relaxArrays()
+    if n == 1:
+        indexv = np.array([0,4,3,1,5,2])
+    else:
+        indexv = np.array([3,4,0,1,5,2])
+    Bbot, _, Btop, ctop = boundary_rows(difeq, 6, 3, len(zarray), indexv,
+                                        np.zeros((6, 13)))
+
+    # The solutions satisfying the (homogeneous) core conditions.
+    Y = np.ascontiguousarray(np.linalg.svd(Bbot)[2][3:].T)
+    h = np.ascontiguousarray(h, dtype=float)
+    if np.iscomplexobj(A):
+        Y = Y.astype(complex)
+        logdet = _cayleyPropagateComplex(np.ascontiguousarray(A), h, Y)
+    else:
+        logdet = cayley_propagate(np.ascontiguousarray(A, dtype=float), h, Y)
+    M = Btop.dot(Y)
+    try:
+        y = Y.dot(np.linalg.solve(M, -ctop))
+    except np.linalg.LinAlgError:
+        # Exactly at a mode (e.g., hit by the root finding of find_modes),
+        # where the Love numbers are infinite.
+        y = np.full(len(Y), np.nan, dtype=Y.dtype)
+    return np.linalg.det(M), logdet, y[[0,1,4]]
+
+def find_modes(n, params, zarray=None, nlayers=300, srange=(1e-10, 1e4),
+                nscan=40, Q=2, comp=False, order=2, restol=1e-10):
+    """Find the relaxation modes of the Love numbers of order number n.
+
+    Parameters
+    ----------
+    n : int, order number (at least 1)
+    params : <giapy.earth_tools.earthParams.EarthParams>
+        In 'love' normalization, homogeneous in layers (see
+        earthParams.layered_params).
+    zarray : array of radii
+        The mesh (default, earthParams.radial_mesh of nlayers points,
+        refined near the surface for n, with points at all the radii of the
+        table of params).
+    srange : (float, float)
+        The smallest and largest magnitudes of the (normalized) relaxation
+        rates sought (default 1e-10 to 1e4).
+    nscan : int
+        The number of points per decade of the logarithmic grid of rates
+        (default 40).
+    Q, comp, order : see SphericalElasSMat (default incompressible).
+    restol : float
+        Modes whose amplitudes are all smaller than restol times the sum of
+        the magnitudes of the amplitudes are dropped (default 1e-10).
+
+    Returns
+    -------
+    hLke : (3) array of elastic h, L and k_d.
+    modes : (nmodes, 4) array of the rates s_j (normalized) and amplitudes
+        a_j of h, L and k_d, by decreasing rate.
+    """
+    if zarray is None:
+        zarray = radial_mesh(params, nlayers, nref=n, kinks=True)
+
+    def lapl(s):
+        return laplace_love_numbers(n, s, params, zarray, Q=Q, comp=comp,
+                                        order=order)
+
+    # Scale the determinant by its elastic factor, to keep it in range.
+    _, logdet0, hLke = lapl(np.inf)
+    def det(s):
+        try:
+            D, logdet, _ = lapl(s)
+        except ZeroDivisionError:
+            # A singular trapezoidal step, a pole of the discrete
+            # determinant (not a mode): step off it.
+            D, logdet, _ = lapl(s*(1 + 1e-12))
+        with np.errstate(over='ignore'):
+            return D*np.exp(logdet - logdet0)
+
+    # The Maxwell rates, where the determinant has poles, with points
+    # approaching them from both sides.
+    mesh = params.onMesh(zarray)
+    with np.errstate(divide='ignore'):
+        rates = np.unique(mesh['shear']/mesh['visc'])
+    rates = rates[np.isfinite(rates) & (rates > 0)]
+    offsets = np.logspace(-12, -1, 23)
+    ndec = np.log10(srange[1]/srange[0])
+    logs = np.logspace(np.log10(srange[0]), np.log10(srange[1]),
+                        int(nscan*ndec)+1)
+    ss = np.unique(np.r_[-logs, logs,
+                         -np.outer(rates, np.r_[1-offsets, 1+offsets]).ravel()])
+    ds = np.array([det(s) for s in ss])
+
+    # Sign changes,
+    brackets = [(ss[i], ss[i+1], ds[i], ds[i+1]) for i in
+                    np.nonzero(np.sign(ds[1:]) != np.sign(ds[:-1]))[0]]
+    # and local minima of |D| between which it may cross zero twice.
+    sgn, mag = np.sign(ds), np.abs(ds)
+    imins = np.nonzero((mag[1:-1] < mag[:-2]) & (mag[1:-1] < mag[2:]) &
+                        (sgn[1:-1] == sgn[:-2]) & (sgn[1:-1] == sgn[2:]))[0]+1
+    for i in imins:
+        res = minimize_scalar(lambda s: sgn[i]*det(s),
+                                bounds=(ss[i-1], ss[i+1]), method='bounded',
+                                options={'xatol': 1e-14*abs(ss[i])})
+        if res.fun < 0:
+            brackets += [(ss[i-1], res.x, ds[i-1], -res.fun),
+                         (res.x, ss[i+1], -res.fun, ds[i+1])]
+
+    roots = []
+    for a, b, da, db in brackets:
+        # Poles change sign without a root, s = 0 is not a mode and the
+        # modes decay (sign changes at small positive rates are roundoff
+        # near the fluid limit).
+        if np.any((-rates > a) & (-rates < b)) or b > 0:
+            continue
+        r = brentq(det, a, b, xtol=1e-300, rtol=1e-14)
+        if abs(det(r)) < min(abs(da), abs(db)):
+            roots.append(r)
+    roots = np.sort(roots)[::-1]
+
+    # The amplitudes from the residues of X(s), by symmetric differences
+    # smaller than the distance to the nearest other root.
+    gaps = np.abs(np.diff(np.r_[0., roots, -np.inf]))
+    amps = np.zeros((len(roots), 3))
+    for j, r in enumerate(roots):
+        d = min(1e-7*abs(r), 1e-3*min(gaps[j], gaps[j+1]))
+        res = 0.5*d*(lapl(r+d)[2] - lapl(r-d)[2])
+        amps[j] = -res/r
+
+    keep = np.any(np.abs(amps) > restol*np.abs(amps).sum(axis=0), axis=1)
+    modes = np.c_[roots[keep], amps[keep]]
+
+    # Correct n=1 case (see compute_love_numbers).
+    if n == 1:
+        for X in [hLke, modes[:,1:].T]:
+            X[:2] += X[2]
+            X[2] -= X[2]
+    return hLke, modes
+
+def normal_modes(ns, params, layered=True, nprocs=None, cachedir=None,
+                    verbose=False, **kwargs):
+    """Find the relaxation modes of the Love numbers of order numbers ns.
+
+    The order numbers are computed in parallel, and the modes saved in
+    cachedir, so that later calls with the same parameters and options only
+    compute the order numbers not yet saved.
+
+    Parameters
+    ----------
+    ns : array of order numbers (at least 1)
+    params : <giapy.earth_tools.earthParams.EarthParams>
+        In 'love' normalization.
+    layered : boolean
+        If True (default), find the modes of earthParams.layered_params(params)
+        (homogeneous between the discontinuities of params). Otherwise,
+        params should already be homogeneous in layers.
+    nprocs : int
+        The number of processes (default, the number of cpus; 1 computes in
+        this process).
+    cachedir : str
+        The directory of the saved modes (default CACHEDIR). If None, they
+        are not saved.
+    verbose : boolean
+        Print the order numbers as they are done.
+    **kwargs : passed to find_modes.
+
+    Returns
+    -------
+    hLke : (len(ns), 3) array of elastic h, L and k_d.
+    modes : (len(ns), nmodes, 4) array of the rates (normalized) and
+        amplitudes of h, L and k_d of the modes (see find_modes), padded
+        with zeros to the largest number of modes.
+    """
+    ns = np.atleast_1d(ns).astype(int)
+    if layered:
+        params = layered_params(params)
+    cachedir = cachedir or CACHEDIR
+
+    saved = {}
+    if cachedir is not None:
+        fname = os.path.join(cachedir, 'normalmodes_{}.npz'.format(
+                                                _cacheKey(params, kwargs)))
+        saved = _loadModes(fname)
+
+    todo = [n for n in np.unique(ns) if n not in saved]
+    if todo:
+        if nprocs == 1:
+            results = map(_modesWorker, [(n, params, kwargs) for n in todo])
+        else:
+            pool = multiprocessing.Pool(nprocs)
+            results = pool.imap(_modesWorker, [(n, params, kwargs)
+                                                for n in todo])
+        try:
+            for n, result in zip(todo, results):
+                saved[n] = result
+                if verbose:
+                    sys.stdout.write('Found {0} modes of order number '
+                                        '{1}\r'.format(len(result[1]), n))
+        finally:
+            if nprocs != 1:
+                pool.close()
+                pool.join()
+        if verbose:
+            sys.stdout.write('\n')
+        if cachedir is not None:
+            _saveModes(fname, saved)
+
+    nmodes = max(len(saved[n][1]) for n in ns)
+    hLke = np.array([saved[n][0] for n in ns])
+    modes = np.zeros((len(ns), nmodes, 4))
+    for i, n in enumerate(ns):
+        modes[i, :len(saved[n][1])] = saved[n][1]
+    return hLke, modes
+
+def _modesWorker(args):
+    """Find the modes of one order number, used by normal_modes."""
+    n, params, kwargs = args
+    return find_modes(n, params, **kwargs)
+
+def _cacheKey(params, kwargs):
+    """A hash of the parameters and options of find_modes."""
+    key = hashlib.sha1()
+    for arr in [params.z, params._paramArray]:
+        key.update(np.ascontiguousarray(arr, dtype=float).tobytes())
+    key.update(repr((params.rCore, params.denCore, params.D,
+                        params.normmode)).encode())
+    for name in sorted(kwargs):
+        val = kwargs[name]
+        if isinstance(val, np.ndarray):
+            val = val.tobytes()
+        key.update(repr((name, val)).encode())
+    return key.hexdigest()[:16]
+
+def _loadModes(fname):
+    """Load saved modes as {n: (hLke, modes)}."""
+    if not os.path.exists(fname):
+        return {}
+    with np.load(fname) as data:
+        counts = np.r_[0, np.cumsum(data['nmodes'])]
+        return dict((n, (hLke, data['modes'][i0:i1])) for n, hLke, i0, i1 in
+                        zip(data['ns'], data['hLke'], counts[:-1], counts[1:]))
+
+def _saveModes(fname, saved):
+    """Save modes {n: (hLke, modes)}, writing to a temporary file and
+    renaming, so that other processes never see a partially written file."""
+    ns = sorted(saved)
+    tmpname = fname + '.{0}.npz'.format(os.getpid())
+    if not os.path.isdir(os.path.dirname(fname) or '.'):
+        os.makedirs(os.path.dirname(fname))
+    np.savez(tmpname, ns=ns, hLke=np.array([saved[n][0] for n in ns]),
+                nmodes=[len(saved[n][1]) for n in ns],
+                modes=np.concatenate([saved[n][1] for n in ns]))
+    os.rename(tmpname, fname)
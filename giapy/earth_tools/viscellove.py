@@ -30,12 +30,13 @@ from scipy.integrate import ode, odeint
 from giapy.earth_tools.viscouslove import propMatVisc, gen_viscb, SphericalViscSMat
 from giapy.earth_tools.elasticlove import propMatElas, gen_elasb, SphericalElasSMat
 from giapy.numTools.solvdeJit import solvde
+from giapy.numTools.timeindex import TimeIndex
 from giapy.numTools.odeintJit import Odeint, StepperDopr5
 import giapy.numTools.odeintJit
 
 def compute_viscel_numbers(ns, ts, zarray, params, atol=1e-4, rtol=1e-4,
                            h=1, hmin=0.001, Q=1, scaled=False, logtime=False,
-                             comp=True, verbose=False):
+                             comp=True, verbose=False, order=2):
     """
     Compute the viscoelastic Love numbers associated with params at times ts.
 
@@ -51,6 +52,8 @@ def compute_viscel_numbers(ns, ts, zarray, params, atol=1e-4, rtol=1e-4,
     Q : code for gravity flux (see note above, default 1)
     scaled_time : scales the time dimension into log(t)
     comp : indicates compressibility (default True)
+    order : 2 or 4, the order of accuracy of the radial discretization
+        (default 2, see elasticlove.SphericalElasSMat)
 
     Returns
     -------
@@ -61,7 +64,7 @@ def compute_viscel_numbers(ns, ts, zarray, params, atol=1e-4, rtol=1e-4,
     ns = np.atleast_1d(ns)
 
     vels = SphericalLoveVelocities(params, zarray, ns[0], comp=comp,
-                                scaled=scaled, logtime=logtime)
+                                scaled=scaled, logtime=logtime, order=order)
     # Initialize viscous Love numbers, vertical and horizontal
     hvLv0 = np.zeros(2*len(zarray)) 
 
@@ -116,6 +119,7 @@ class SphericalLoveVelocities(object):
    scaled : Use uniform mesh in logarithmic scaling of radial variable if True
        (default False). Transformation is chi = exp(-(rC - r)*(2n-1)/rE).
    logtime : use logarithmic time. BROKEN
+   order : 2 or 4, the order of accuracy of the radial discretization
 
    Methods
    -------
@@ -125,7 +129,7 @@ class SphericalLoveVelocities(object):
         
 
     def __init__(self, params, zs, n, yEVt0=None, Q=1, comp=True, 
-                    scaled=False, logtime=False):
+                    scaled=False, logtime=False, order=2):
         # t==0 Initial guesses
         if yEVt0 is None:
             self.yEt0, self.yVt0 = np.ones((6, len(zs))), np.ones((4, len(zs)))
@@ -144,11 +148,14 @@ class SphericalLoveVelocities(object):
 
         # Initialize smatrices for Solvde relaxation method
         self.difeqElas = SphericalElasSMat(n, zs, params, Q, comp=comp,
-                                            scaled=scaled)
+                                            scaled=scaled, order=order)
         self.difeqVisc = SphericalViscSMat(n, zs, params, Q, scaled=scaled, 
-                                            logtime=logtime)
+                                            logtime=logtime, order=order)
         # Store between-mesh points for easier calls later.
         self.zmids = self.difeqElas.zmids
+        # Inhomogeneity arrays, filled at each velocity evaluation.
+        self.be = np.zeros((self.nz+1, 6))
+        self.bv = np.zeros((self.nz+1, 4))
 
         if n == 1:
             self.indexvE = np.array([0,4,3,1,5,2]) 
@@ -172,14 +179,16 @@ class SphericalLoveVelocities(object):
         hv = hvLv[:self.nz] 
         
         # Compute the elastic profiles 
-        be = gen_elasb(self.n, hv, self.params, self.zmids, self.Q)
+        be = gen_elasb(self.n, hv, self.params, self.zmids, self.Q,
+                        out=self.be)
 
         self.difeqElas.updateProps(b=be)
         self.yE, = solvde(itmax, tol, slowc, np.ones(6), self.indexvE, 
                                 3, self.yE, self.difeqElas)
     
         # Compute the viscous profiles
-        bv = gen_viscb(self.n, self.yE, hv, self.params, self.zmids, self.Q)
+        bv = gen_viscb(self.n, self.yE, hv, self.params, self.zmids, self.Q,
+                        out=self.bv)
         
         self.difeqVisc.updateProps(b=bv, t=t)
         self.yV, = solvde(itmax, tol, slowc, np.ones(4), self.indexvV, 
@@ -294,15 +303,14 @@ class SphericalEarthOutput(object):
        
         #   he  hv  Le  Lv  k q  hdv f_Le    f_Lv
         self.outArray = np.zeros((len(self.times), len(self.inds), 9))
+        self.timeIndex = TimeIndex(self.times)
 
     def out(self, t, hvLv):
-        ind = np.argwhere(np.abs(self.times - t)<1e-15)
-        try:
-            self.maxind = ind[0][0]
-            ind = ind[0][0]
-        except IndexError:
+        ind = self.timeIndex.get(t)
+        if ind is None:
             raise IndexError("SphericalEarthOutput received a time t={0:.3f}".format(t)+
                             " that was not in its output times.")
+        self.maxind = ind
         self.f(t, hvLv.copy(), 0*hvLv)
         #self.f(t, hvLv.copy())
         he, Le, k, q, hdv = self.f.solout()
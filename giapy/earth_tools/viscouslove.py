@@ -15,13 +15,16 @@ Date: July 13, 2017
 from __future__ import division
 import numpy as np
 from giapy.numTools.solvdeJit import interior_smatrix_fast
+from giapy.numTools.magnus import gauss_points, magnus_trapezoid
 # Check for numba, use if present otherwise, skip.
 try:
     from giapy.numTools.solvdeJit import interior_smatrix_fast, solvde
-    from numba import jit, void, int64, float64
+    from numba import jit, prange, void, int64, float64
+    from giapy.numTools.aot import kernel, jitted, ahead_of_time
     numba_load = True
 except ImportError:
     from giapy.numTools.solvde import interior_smatrix_fast, solvde
+    prange = range
     numba_load = False
 
 def propMatVisc(zarray, n, params, t=1, Q=1, scaled=False, logtime=False):
@@ -52,7 +55,7 @@ def propMatVisc(zarray, n, params, t=1, Q=1, scaled=False, logtime=False):
         zarray = zarray[np.newaxis]
         singz = True
     
-    parvals = params.getParams(zarray)
+    parvals = params.getParams(zarray) if singz else params.onMesh(zarray)
 
     eta = parvals['visc']
 
@@ -80,6 +83,44 @@ def propMatVisc(zarray, n, params, t=1, Q=1, scaled=False, logtime=False):
     else:
         return (z_i*a.T).T
 
+def propMatViscBatch(zarray, ns, params, t=1, Q=1, scaled=False,
+                        logtime=False):
+    """Generate the viscous propagator matrices of several order numbers at
+    once.
+
+    The viscosity is interpolated once, and the matrices of the order numbers
+    are filled in parallel (with numba).
+
+    Parameters
+    ----------
+    zarray : numpy.ndarray
+        The (normalized) radii, (nz) for all order numbers, or (len(ns), nz)
+        for each order number (e.g., scaled meshes).
+    ns : array of order numbers.
+    params, t, Q, scaled, logtime : see propMatVisc.
+
+    Returns
+    -------
+    a : numpy.ndarray of shape (len(ns), nz, 4, 4). a[i] is propMatVisc(
+        zarray (or zarray[i]), ns[i], params, t, Q, scaled, logtime).
+    """
+    assert params.normmode == 'love', 'Must normalize parameters'
+
+    ns = np.atleast_1d(ns).astype(np.int64)
+    zarray = np.atleast_2d(np.asarray(zarray, dtype=float))
+
+    eta = params.onMesh(zarray)['visc']
+    z_i = 1./zarray
+    alpha = params.getLithFilter(n=ns)*np.ones(len(ns))
+
+    # The row of eta, zarray, z_i of each order number (all share one row if
+    # the mesh is common).
+    rows = np.arange(len(ns)) if len(zarray) > 1 else np.zeros(len(ns), int)
+
+    a = np.zeros((len(ns), zarray.shape[1], 4, 4))
+    _matFillBatch(a, ns, rows, zarray, eta, z_i, alpha, t, scaled, logtime)
+    return a
+
 def _matFill(a, n, zarray, eta, z_i, l, li, alpha, t): 
     for i in range(len(zarray)):
         
@@ -184,30 +225,102 @@ def _matFilllogscale(a, n, zarray, eta, z_i, l, li, alpha, t):
 
 # numba speeds up the filling of the propagator matrix dramatically.
 if numba_load: 
-    _matFill = jit(void(float64[:,:,:], int64, float64[:], float64[:],
-            float64[:], float64, float64, float64, float64), nopython=True)(_matFill)
-    _matFillscale = jit(void(float64[:,:,:], int64, float64[:], float64[:], 
-            float64[:], float64, float64, float64, float64), nopython=True)(_matFillscale)
-    _matFilllog = jit(void(float64[:,:,:], int64, float64[:], float64[:], 
-            float64[:], float64, float64, float64, float64), nopython=True)(_matFilllog)
-    _matFilllogscale = jit(void(float64[:,:,:], int64, float64[:], float64[:], 
-            float64[:], float64, float64, float64, float64), nopython=True)(_matFilllogscale)
+    _matFill = kernel(void(float64[:,:,:], int64, float64[:], float64[:],
+            float64[:], float64, float64, float64, float64))(_matFill)
+    _matFillscale = kernel(void(float64[:,:,:], int64, float64[:], float64[:], 
+            float64[:], float64, float64, float64, float64))(_matFillscale)
+    _matFilllog = kernel(void(float64[:,:,:], int64, float64[:], float64[:], 
+            float64[:], float64, float64, float64, float64))(_matFilllog)
+    _matFilllogscale = kernel(void(float64[:,:,:], int64, float64[:], float64[:], 
+            float64[:], float64, float64, float64, float64))(_matFilllogscale)
+
+# The fill functions called by _matFillBatch (numba functions, even if the
+# kernels were compiled ahead of time).
+if numba_load:
+    _fills = [jitted(f) for f in (_matFill, _matFillscale, _matFilllog,
+                                    _matFilllogscale)]
+else:
+    _fills = [_matFill, _matFillscale, _matFilllog, _matFilllogscale]
+_fill, _fillscale, _filllog, _filllogscale = _fills
+
+def _matFillBatch(a, ns, rows, zarray, eta, z_i, alpha, t, scaled, logtime):
+    """Fill (and scale by 1/z) the propagator matrices a[i] of order numbers
+    ns[i], in parallel, used internally by propMatViscBatch. The row rows[i]
+    of zarray, eta and z_i is used for order number ns[i]."""
+    nz = zarray.shape[1]
+    for i in prange(len(ns)):
+        n = ns[i]
+        j = rows[i]
+        l = 2.*(n+1.)
+        li = 1./(2.*n+1.)
+        if not scaled:
+            if logtime:
+                _filllog(a[i], n, zarray[j], eta[j], z_i[j], l, li,
+                            alpha[i], t)
+            else:
+                _fill(a[i], n, zarray[j], eta[j], z_i[j], l, li, alpha[i], t)
+        else:
+            if logtime:
+                _filllogscale(a[i], n, zarray[j], eta[j], z_i[j], l, li,
+                                alpha[i], t)
+            else:
+                _fillscale(a[i], n, zarray[j], eta[j], z_i[j], l, li,
+                            alpha[i], t)
+        for k in range(nz):
+            for p in range(4):
+                for q in range(4):
+                    a[i,k,p,q] *= z_i[j,k]
+
+def _matFillSerial(a, ns, rows, zarray, eta, z_i, alpha, t, scaled, logtime):
+    """As _matFillBatch, one order number at a time with the kernels compiled
+    ahead of time, which the parallel _matFillBatch cannot call without
+    compiling them again."""
+    fillfunc = [_matFill, _matFillscale, _matFilllog,
+                    _matFilllogscale][2*logtime + scaled]
+    for i, (n, j) in enumerate(zip(ns, rows)):
+        fillfunc(a[i], n, zarray[j], eta[j], z_i[j], 2.*(n+1.),
+                    1./(2.*n+1.), alpha[i], float(t))
+    a *= z_i[rows][:,:,None,None]
+
+if numba_load:
+    if ahead_of_time(_matFill):
+        _matFillBatch = _matFillSerial
+    else:
+        _matFillBatch = jit(nopython=True, parallel=True,
+                                cache=True)(_matFillBatch)
+
 
+def gen_viscb(n, yE, hV, params, zarray, Q=1, out=None):
+    """Generate elastic and nonadiabatic source terms for viscous eqs.
 
-def gen_viscb(n, yE, hV, params, zarray, Q=1):
+    Parameters
+    ----------
+    n : int. Order number of computation.
+    yE : (6, len(zarray)+1) array of elastic solutions.
+    hV : array of viscous vertical deformation mantle love numbers.
+    params : <giapy.earth_tools.earthParams.EarthParams>
+    zarray : array of radius values between the solution points.
+    Q : int. Gravity perturbation definition flag (see note at top of file).
+    out : (len(zarray) + 2, 4) array, optional
+        The array to fill, instead of a new one (e.g., reused for each call
+        in an integration).
+
+    Returns
+    -------
+    b - (len(zarray) + 2, 4) array
+        The array of inhomogeneities at the two boundaries, and the interior
+        mantle points.
+    """
     assert params.normmode == 'love', 'Must normalize parameters'
     
     # Check for individual z call
     zarray = np.asarray(zarray)
    
-    parvals = params.getParams(np.r_[params.rCore, zarray, 1.])
+    parvals = params.onMesh(np.r_[params.rCore, zarray, 1.])
 
     rho = parvals['den'][1:-1]
     g = parvals['grav'][1:-1]
     nonad = parvals['nonad'][1:-1] 
-    eta = parvals['visc'][1:-1]
-
-
 
     rhoC = parvals['den'][0]
     gC = parvals['grav'][0]
@@ -218,45 +331,41 @@ def gen_viscb(n, yE, hV, params, zarray, Q=1):
 
     z_i = 1./zarray
 
-    b = np.zeros((len(zarray)+2, 4))
+    if out is None:
+        b = np.zeros((len(zarray)+2, 4))
+    else:
+        b = out
+        b[:] = 0.
 
     if n != 1: 
         # Lower Boundary Condition inhomogeneity
-        b[0,0] = 0.
-        b[0,1] = 0.
         b[0,2] = ((denC-rhoC)*gC*hV[0] + denC*yE[4,0] +
                     0.33*params.rCore*denC**2*yE[0,0]
                     -rhoC*(denC-rhoC)*hV[0]*li)*li
-        b[0,3] = 0.
 
     # Upper Boundary Condition inhomogeneity
-    b[-1,0] = 0.
-    b[-1,1] = 0.
     b[-1,2] = -rhoS*li*hV[-1]
-    b[-1,3] = 0.
-
-    # Interior points
-    for i, bi in enumerate(b[1:-1]):
-        hvi = 0.5*(hV[i] + hV[i+1])
-        hi = 0.5*(yE[0,i] + yE[0,i+1])
-        Li = 0.5*(yE[1,i] + yE[1,i+1])
-        ki = 0.5*(yE[4,i] + yE[4,i+1])
-        qi = 0.5*(yE[5,i] + yE[5,i+1])
-
-        bi[0] = 0.
-        bi[1] = 0.
-        if Q == 1:
-            bi[2] = (rho[i]*(qi +
-                    (rho[i] - 4*g[i]*z_i[i])*li*hi
-                    + g[i]*z_i[i]*(n+1.)*li*Li)
-                    - g[i]*nonad[i]*hvi*li)
-        else:
-            bi[2] = (rho[i]*(qi +
-                    - 4*g[i]*z_i[i]*li*hi
-                    + g[i]*z_i[i]*(n+1.)*li*Li
-                    + z_i[i]*(n+1.)*li*ki)
-                    - g[i]*nonad[i]*hvi*li)
-        bi[3] = rho[i]*(g[i]*hi + ki)*n*li*z_i[i]
+
+    # Interior points, at the midpoints of the solutions.
+    m = len(zarray)
+    hvi = 0.5*(hV[:m] + hV[1:m+1])
+    hi = 0.5*(yE[0,:m] + yE[0,1:m+1])
+    Li = 0.5*(yE[1,:m] + yE[1,1:m+1])
+    ki = 0.5*(yE[4,:m] + yE[4,1:m+1])
+    qi = 0.5*(yE[5,:m] + yE[5,1:m+1])
+
+    if Q == 1:
+        b[1:-1,2] = (rho*(qi +
+                    (rho - 4*g*z_i)*li*hi
+                    + g*z_i*(n+1.)*li*Li)
+                    - g*nonad*hvi*li)
+    else:
+        b[1:-1,2] = (rho*(qi +
+                    - 4*g*z_i*li*hi
+                    + g*z_i*(n+1.)*li*Li
+                    + z_i*(n+1.)*li*ki)
+                    - g*nonad*hvi*li)
+    b[1:-1,3] = rho*(g*hi + ki)*n*li*z_i
 
     return b
 
@@ -265,13 +374,21 @@ class SphericalViscSMat(object):
     
     The boundary conditions in smatrix have assumed that the equations of
     motion in propMatVisc have been nondimensionalized.
+
+    With order=4 (default 2), the difference equations are fourth-order
+    Magnus steps, as in elasticlove.SphericalElasSMat. Coincident points in
+    z (see earthParams.radial_mesh) need no special treatment: the viscous
+    variables are continuous across discontinuities.
     """
-    def __init__(self, n, z, params, Q=1, b=None, scaled=False, logtime=False):
+    def __init__(self, n, z, params, Q=1, b=None, scaled=False, logtime=False,
+                    order=2):
+        assert order in (2, 4), 'order must be 2 or 4'
         self.n = n
         self.mpt = len(z)
         self.z = z
         self.scaled = scaled
         self.logtime = logtime
+        self.order = order
 
         # Make sure parameters are normalized properly.
         params.normalize('love')
@@ -282,19 +399,26 @@ class SphericalViscSMat(object):
       
         self.updateProps(self.n, self.z, self.b)
         
-    def updateProps(self, n=None, z=None, b=None, t=None):
+    def updateProps(self, n=None, z=None, b=None, t=None, A=None):
         self.n = n or self.n
         if not self.scaled:
             self.z = self.z if z is None else z
 
-        # Only recompute A matrix if n or z are changed.
-        if n is not None or z is not None or t is not None:
+        # Only recompute A matrix if n or z are changed (unless given, see
+        # propagators).
+        if A is not None:
+            self.A = A
+            self.load = 1./self.params.getLithFilter(n=self.n)
+        elif n is not None or z is not None or t is not None:
             t = t or 1
-            self.A = propMatVisc(self.zmids, self.n, self.params, t, self.Q, 
-                                    self.scaled, self.logtime)
+            if self.order == 4:
+                self.A = self.propagators(self.n, t)[0]
+            else:
+                self.A = propMatVisc(self.zmids, self.n, self.params, t,
+                                        self.Q, self.scaled, self.logtime)
 
-            if self.scaled:
-                self.A = 1./self.zetamids[:,None,None]*self.A
+                if self.scaled:
+                    self.A = 1./self.zetamids[:,None,None]*self.A
             self.load = 1./self.params.getLithFilter(n=self.n)
 
         if b is not None:
@@ -302,6 +426,46 @@ class SphericalViscSMat(object):
                 b[1:-1] *= 1./self.zetamids[:,None]/(self.n+0.5)
             self.b = b
 
+    def propagators(self, ns, t=1):
+        """Return the propagator matrices (len(ns), mpt-1, 4, 4) of order
+        numbers ns on the mesh, as stored by updateProps (see
+        propMatViscBatch)."""
+        ns = np.atleast_1d(ns)
+        if self.order == 4:
+            return self._magnusPropagators(ns, t)
+        if self.scaled:
+            # The scaled mesh depends on the order number.
+            zeta_c = np.exp((ns[:,None] + 0.5)*(self.params.rCore - 1))
+            zetamids = ((np.arange(1,self.mpt)-0.5)/(self.mpt-1)*(1-zeta_c) +
+                            zeta_c)
+            zmids = 1 + np.log(zetamids)/(ns[:,None]+0.5)
+            A = propMatViscBatch(zmids, ns, self.params, t, self.Q,
+                                    self.scaled, self.logtime)
+            return 1./zetamids[:,:,None,None]*A
+        else:
+            return propMatViscBatch(self.zmids, ns, self.params, t, self.Q,
+                                    self.scaled, self.logtime)
+
+    def _magnusPropagators(self, ns, t=1):
+        """The propagators of order numbers ns whose trapezoidal steps are
+        the fourth-order Magnus steps (see numTools.magnus)."""
+        if self.scaled:
+            zeta_c = np.exp((ns[:,None] + 0.5)*(self.params.rCore - 1))
+            h = np.repeat((1-zeta_c)/(self.mpt-1), self.mpt-1, axis=1)
+            zetamids = (np.arange(1,self.mpt)-0.5)*h + zeta_c
+            zetas = gauss_points(zetamids, h).reshape(len(ns), -1)
+            zs = 1 + np.log(zetas)/(ns[:,None]+0.5)
+            A = propMatViscBatch(zs, ns, self.params, t, self.Q, self.scaled,
+                                    self.logtime)
+            A = 1./zetas[:,:,None,None]*A
+        else:
+            h = np.diff(self.z)
+            zs = gauss_points(self.zmids, h).ravel()
+            A = propMatViscBatch(zs, ns, self.params, t, self.Q, self.scaled,
+                                    self.logtime)
+        A = A.reshape(len(ns), self.mpt-1, 2, 4, 4)
+        return magnus_trapezoid(A[:,:,0], A[:,:,1], h)
+
     @property
     def zeta(self):
         return np.arange(self.mpt)/(self.mpt-1)*(1-self.zeta_c)+self.zeta_c
@@ -334,6 +498,19 @@ class SphericalViscSMat(object):
     def zeta2z(self, zeta):
         return 1 + np.log(zeta)/(self.n+0.5)
 
+    def relaxArrays(self):
+        """Return the propagators, inhomogeneities and point separations of
+        the interior s matrices (see solvdeJit.solvde_linear)."""
+        if self.scaled:
+            h = np.repeat(self.zetasep, self.mpt-1)
+        else:
+            h = np.diff(self.z)
+        if self.b is None:
+            b = np.zeros((self.mpt-1, 4))
+        else:
+            b = self.b[2:self.mpt+1]
+        return self.A, b, h
+
     def smatrix(self, k, k1, k2, jsf, is1, isf, indexv, s, y):
         Q = self.Q
         if k == k1:      # Core-Mantle boundary conditions.            
@@ -0,0 +1,428 @@
+"""
+harm_tools.py
+
+    Methods for managing the spherical harmonic transforms used in giapy.
+
+    Building a spharm.Spharmt with stored Legendre functions is expensive in
+    time and memory at high resolution, so transforms are kept in a
+    process-wide registry and shared by all simulations on the same grid. The
+    stored Legendre tables may also be saved to disk and memory-mapped by
+    other processes.
+
+    Transforms come from spharm (SPHEREPACK) or, if it is not installed or
+    if asked for, from the pure NumPy giapy.spharmt, which has the same
+    interface. BatchTransform transforms stacks of fields at once, with the
+    field axis first, so that the Legendre transforms are matrix-matrix
+    products.
+
+    Author: Samuel B. Kachuck
+
+Data
+----
+MEMBUDGET : the default memory (bytes) allowed for stored Legendre tables.
+CACHEDIR : the default directory for stored Legendre tables, from the
+    environment variable GIAPY_CACHEDIR (None disables the disk cache).
+LEGDTYPE : the dtype of stored Legendre tables, by which their memory is
+    estimated.
+ENGINE : the default transform engine, 'spharm' if it is installed, else
+    'numpy'.
+
+Methods
+-------
+get_transform : return the shared transform for a grid.
+choose_legfunc : choose stored or computed Legendre functions.
+legendre_table_bytes : estimate the memory of stored Legendre tables.
+clear_transforms : empty the registry.
+get_batch_transform : return the shared batched transform for a grid.
+legendre_table : normalized associated Legendre functions.
+legendre_functions : generate legendre_table one m at a time.
+quadrature : colatitude nodes and weights for a grid.
+
+Classes
+-------
+BatchTransform
+"""
+
+import os
+
+import numpy as np
+try:
+    import spharm
+except ImportError:
+    spharm = None
+
+MEMBUDGET = 2**30
+# The dtype of stored Legendre tables (SPHEREPACK, as built by spharm, and
+# BatchTransform both work in double precision).
+LEGDTYPE = np.dtype(np.float64)
+CACHEDIR = os.environ.get('GIAPY_CACHEDIR', None)
+ENGINE = 'spharm' if spharm is not None else 'numpy'
+
+# The process-wide registries, keyed by (nlon, nlat, gridtype, legfunc,
+# engine) and (nlon, nlat, gridtype, legfunc).
+_TRANSFORMS = {}
+_BATCHTRANSFORMS = {}
+
+def get_transform(nlon, nlat, gridtype='regular', legfunc=None,
+                    membudget=None, cachedir=None, engine=None):
+    """Return the shared spherical harmonic transform for a grid.
+
+    Parameters
+    ----------
+    nlon, nlat : int
+        The number of longitudes and latitudes of the grid.
+    gridtype : 'regular' or 'gaussian'
+    legfunc : 'stored', 'computed', or None
+        Whether the Legendre functions are precomputed and stored, or
+        recomputed at each transform. If None (default), they are stored if
+        they fit into membudget (see choose_legfunc).
+    membudget : int
+        Bytes allowed for stored Legendre tables (default MEMBUDGET).
+    cachedir : str
+        Directory in which stored Legendre tables are saved and from which they
+        are memory-mapped by later calls, in this or other processes (default
+        CACHEDIR). If None, tables are not saved. Only used by spharm.
+    engine : 'spharm', 'numpy', or None
+        The spharm (SPHEREPACK) transform, or the pure NumPy giapy.spharmt,
+        which shares its Legendre tables with get_batch_transform (default
+        ENGINE).
+
+    Returns
+    -------
+    trans : <spharm.Spharmt> or <giapy.spharmt.Spharmt>
+    """
+    if legfunc is None:
+        legfunc = choose_legfunc(nlon, nlat, membudget)
+    cachedir = cachedir or CACHEDIR
+    engine = engine or ENGINE
+    if engine not in ['spharm', 'numpy']:
+        raise ValueError('engine {} not supported.'.format(engine))
+    if engine == 'spharm' and spharm is None:
+        raise ImportError('spharm is not installed, use engine=\'numpy\'.')
+
+    key = (nlon, nlat, gridtype, legfunc, engine)
+    if key not in _TRANSFORMS:
+        if engine == 'numpy':
+            from giapy.spharmt import Spharmt
+            batch = None
+            if legfunc == 'stored':
+                batch = get_batch_transform(nlon, nlat, gridtype, legfunc)
+            trans = Spharmt(nlon, nlat, gridtype=gridtype, legfunc=legfunc,
+                                batch=batch)
+        elif legfunc == 'stored' and cachedir is not None:
+            trans = _load_stored(nlon, nlat, gridtype, cachedir)
+        else:
+            trans = spharm.Spharmt(nlon, nlat, gridtype=gridtype,
+                                    legfunc=legfunc)
+        _TRANSFORMS[key] = trans
+    return _TRANSFORMS[key]
+
+def get_batch_transform(nlon, nlat, gridtype='regular', legfunc='stored'):
+    """Return the shared BatchTransform for a grid, with stored (default) or
+    computed Legendre functions."""
+    key = (nlon, nlat, gridtype, legfunc)
+    if key not in _BATCHTRANSFORMS:
+        _BATCHTRANSFORMS[key] = BatchTransform(nlon, nlat, gridtype, legfunc)
+    return _BATCHTRANSFORMS[key]
+
+def clear_transforms():
+    """Remove all transforms from the registries."""
+    _TRANSFORMS.clear()
+    _BATCHTRANSFORMS.clear()
+
+def legendre_table_bytes(nlon, nlat, dtype=None):
+    """Estimate the memory (bytes) of stored Legendre tables for a grid.
+
+    Uses the SPHEREPACK workspace sizes for the scalar and vector analysis and
+    synthesis on a regular grid (Gaussian grids need similar amounts), with
+    elements of dtype (default LEGDTYPE).
+    """
+    itemsize = np.dtype(LEGDTYPE if dtype is None else dtype).itemsize
+    l1 = min(nlat, (nlon+2)//2)
+    l2 = (nlat+1)//2
+    lsh = (l1*l2*(2*nlat-l1+1))//2 + nlon + 15
+    lvh = l1*l2*(2*nlat-l1+1) + nlon + 15
+    return 2*(lsh + lvh)*itemsize
+
+def choose_legfunc(nlon, nlat, membudget=None):
+    """Return 'stored' if the Legendre tables fit in membudget bytes (default
+    MEMBUDGET), otherwise 'computed'."""
+    membudget = MEMBUDGET if membudget is None else membudget
+    if legendre_table_bytes(nlon, nlat) <= membudget:
+        return 'stored'
+    else:
+        return 'computed'
+
+def _load_stored(nlon, nlat, gridtype, cachedir):
+    """Load memory-mapped stored Legendre tables, building them if needed."""
+    path = os.path.join(cachedir, 'spharmt_{0}_{1}_{2}'.format(nlon, nlat,
+                                                                gridtype))
+    if not os.path.isdir(path):
+        trans = spharm.Spharmt(nlon, nlat, gridtype=gridtype,
+                                legfunc='stored')
+        # Write to a temporary directory and rename, so that other processes
+        # never see partially written tables.
+        tmppath = path + '.{0}'.format(os.getpid())
+        os.makedirs(tmppath)
+        for name, value in trans.__dict__.items():
+            if isinstance(value, np.ndarray):
+                np.save(os.path.join(tmppath, name+'.npy'), value)
+        try:
+            os.rename(tmppath, path)
+        except OSError:
+            # Another process finished first.
+            for fname in os.listdir(tmppath):
+                os.remove(os.path.join(tmppath, fname))
+            os.rmdir(tmppath)
+        return trans
+
+    # The cheap computed transform provides the scalar attributes, the stored
+    # tables are mapped in. (Spharmt forbids rebinding attributes, so the
+    # instance dictionary is updated directly.)
+    trans = spharm.Spharmt(nlon, nlat, gridtype=gridtype, legfunc='computed')
+    for fname in os.listdir(path):
+        name = os.path.splitext(fname)[0]
+        trans.__dict__[name] = np.load(os.path.join(path, fname),
+                                        mmap_mode='r')
+    trans.__dict__['legfunc'] = 'stored'
+    return trans
+
+class BatchTransform(object):
+    """Spherical harmonic transforms of stacks of fields.
+
+    Grids and coefficients follow spharm: latitudes run from north to south,
+    longitudes eastward from 0, and the coefficients of each field are ordered
+    by m, then n (see spharm.getspecindx). With P the associated Legendre
+    functions normalized on [-1, 1] (see legendre_table), a field is
+
+        g = sum_n c_0n P_0n + 2 Re( sum_{m>0} sum_n c_mn P_mn exp(i m lon) ).
+
+    Fields are stacked along the first axis, (nfields, nlat, nlon), and
+    coefficients as (nfields, ncoeff). The Fourier transforms are batched over
+    all fields and latitudes, and the Legendre transform of each m is one
+    matrix-matrix product over all fields.
+
+    Parameters
+    ----------
+    nlon, nlat : int
+        The number of longitudes and latitudes of the grid.
+    gridtype : 'regular' (default, including the poles) or 'gaussian'
+    legfunc : 'stored' (default) or 'computed'
+        Whether the Legendre tables are computed once and stored, or
+        recomputed in each transform to save memory.
+
+    Methods
+    -------
+    grdtospec : transform grids into coefficients.
+    spectogrd : transform coefficients into grids.
+    gradient : the gradient on the unit sphere of coefficients.
+    """
+    batched = True
+
+    def __init__(self, nlon, nlat, gridtype='regular', legfunc='stored'):
+        if gridtype not in ['regular', 'gaussian']:
+            raise ValueError('gridtype {} not supported.'.format(gridtype))
+        if legfunc not in ['stored', 'computed']:
+            raise ValueError('legfunc {} not supported.'.format(legfunc))
+        self.nlon = nlon
+        self.nlat = nlat
+        self.gridtype = gridtype
+        self.legfunc = legfunc
+        self.ntrunc = nlat - 1
+        
+        self.x, self.w = quadrature(nlat, gridtype)
+        self._tables = None
+        self._gradtables = None
+        if legfunc == 'stored':
+            self._tables = list(self._computeTables())
+
+    def _computeTables(self):
+        """Generate the synthesis and analysis tables for each m.
+
+        The synthesis table of m is P_mn (nlat, ntrunc+1-m). Gauss-Legendre
+        quadrature is exact up to ntrunc = nlat-1, but no quadrature on the
+        regular grid is, so there the fields are fit by least squares, which
+        is exact for band-limited fields. For m > 0 the poles carry no
+        information, and P_1,nlat-1 cannot be told from lower degrees on the
+        remaining nlat-2 latitudes, so it is left out of the fit.
+        """
+        for m, p in enumerate(legendre_functions(self.ntrunc, self.x)):
+            if self.gridtype == 'gaussian':
+                ana = self.w[:, None]*p
+            else:
+                nfit = min(p.shape[1], self.nlat-2 if m > 0 else self.nlat)
+                ana = np.zeros_like(p)
+                ana[:, :nfit] = np.linalg.pinv(p[:, :nfit]).T
+            yield p, ana
+
+    def _iterTables(self):
+        if self._tables is not None:
+            return iter(self._tables)
+        return self._computeTables()
+
+    def _iterGradTables(self):
+        """Generate the tables of dP_mn/dcolat and m P_mn/sin(colat)."""
+        if self._gradtables is not None:
+            return iter(self._gradtables)
+        tables = self._gradientTables()
+        if self.legfunc == 'stored':
+            self._gradtables = tables
+        return iter(tables)
+
+    def _gradientTables(self):
+        """Compute dP_mn/dcolat and m P_mn/sin(colat) from P_(n,m+-1) and
+        P_(n-1,m+-1), so that the latter is regular at the poles."""
+        P = [p for p, ana in self._iterTables()]
+        N = self.ntrunc
+        tables = []
+        for m in range(N+1):
+            n = np.arange(m, N+1, dtype=float)
+            dp = np.zeros_like(P[m])
+            sp = np.zeros_like(P[m])
+            if m == 0:
+                if N > 0:
+                    dp[:, 1:] = -np.sqrt(n[1:]*(n[1:]+1))*P[1]
+            else:
+                dp += 0.5*np.sqrt((n+m)*(n-m+1))*P[m-1][:, 1:]
+                c = 0.5*np.sqrt((2*n+1)/(2*n-1))
+                sp += c*np.sqrt((n+m)*(n+m-1))*P[m-1][:, :N-m+1]
+            if 0 < m < N:
+                dp[:, 1:] -= 0.5*np.sqrt((n[1:]-m)*(n[1:]+m+1))*P[m+1]
+            if 0 < m < N-1:
+                sp[:, 2:] += c[2:]*np.sqrt((n[2:]-m)*(n[2:]-m-1))*\
+                                P[m+1][:, :N-m-1]
+            tables.append((dp, sp))
+        return tables
+
+    def _offsets(self, ntrunc):
+        """Index of first coefficient of each m, and the end."""
+        ms = np.arange(ntrunc+2)
+        return ms*(ntrunc+1) - ms*(ms-1)//2
+
+    def _ntrunc(self, ncoeff):
+        ntrunc = int(np.sqrt(8*ncoeff + 1) - 3)//2
+        assert ntrunc <= self.ntrunc, 'Coefficients exceed grid resolution'
+        return ntrunc
+
+    def grdtospec(self, grids, ntrunc=None):
+        """Transform grids (nlat, nlon) or (nfields, nlat, nlon) into
+        coefficients (ncoeff) or (nfields, ncoeff), truncated at ntrunc 
+        (default nlat-1)."""
+        ntrunc = self.ntrunc if ntrunc is None else ntrunc
+        grids = np.asarray(grids)
+        single = grids.ndim == 2
+        if single:
+            grids = grids[None]
+        nfields = grids.shape[0]
+
+        # Fourier transform in longitude, then put m first so that each m is a
+        # contiguous (nfields, nlat) block. Orders above nlon/2 are not
+        # resolved by the longitudes, and their coefficients are zero (as in
+        # SPHEREPACK).
+        four = np.fft.rfft(grids, axis=-1)[:, :, :ntrunc+1]/self.nlon
+        four = np.ascontiguousarray(four.transpose(2, 0, 1))
+        mmax = min(ntrunc, self.nlon//2)
+
+        offsets = self._offsets(ntrunc)
+        spec = np.zeros((nfields, offsets[-1]), dtype=complex)
+        for m, (p, ana) in zip(range(mmax+1), self._iterTables()):
+            spec[:, offsets[m]:offsets[m+1]] = four[m].dot(
+                                                    ana[:, :ntrunc+1-m])
+        
+        return spec[0] if single else spec
+
+    def spectogrd(self, spec):
+        """Transform coefficients (ncoeff) or (nfields, ncoeff) into grids
+        (nlat, nlon) or (nfields, nlat, nlon)."""
+        return self._synthesize(spec, 0)
+
+    def gradient(self, spec):
+        """Return the eastward and northward components of the gradient on
+        the unit sphere of coefficients (ncoeff) or (nfields, ncoeff), as grids
+        (nlat, nlon) or (nfields, nlat, nlon)."""
+        return self._synthesize(spec, 1), self._synthesize(spec, 2)
+
+    def _synthesize(self, spec, kind):
+        """Synthesize P (kind=0), m P/sin(colat) (1, times i, for the eastward
+        gradient) or -dP/dcolat (2, for the northward gradient)."""
+        spec = np.asarray(spec)
+        single = spec.ndim == 1
+        if single:
+            spec = spec[None]
+        nfields, ncoeff = spec.shape
+        ntrunc = self._ntrunc(ncoeff)
+
+        if kind == 0:
+            tables = (p for p, ana in self._iterTables())
+        else:
+            tables = (t[2-kind] for t in self._iterGradTables())
+
+        offsets = self._offsets(ntrunc)
+        four = np.zeros((self.nlon//2+1, nfields, self.nlat), dtype=complex)
+        for m, p in zip(range(min(ntrunc, self.nlon//2)+1), tables):
+            four[m] = spec[:, offsets[m]:offsets[m+1]].dot(
+                                                    p[:, :ntrunc+1-m].T)
+        if kind == 1:
+            four *= 1j
+        elif kind == 2:
+            four *= -1
+
+        grids = np.fft.irfft(four.transpose(1, 2, 0)*self.nlon, n=self.nlon,
+                                axis=-1)
+
+        return grids[0] if single else grids
+
+def quadrature(nlat, gridtype='regular'):
+    """Return the cosines of colatitude (north to south) and the quadrature
+    weights on [-1, 1] for a grid.
+
+    Regular grids include the poles, and use Clenshaw-Curtis weights. Gaussian
+    grids use Gauss-Legendre nodes and weights.
+    """
+    if gridtype == 'regular':
+        N = nlat - 1
+        k = np.arange(nlat)
+        x = np.cos(k*np.pi/N)
+        j = np.arange(1, N//2+1)
+        b = np.where(2*j == N, 1., 2.)
+        c = np.where((k == 0) | (k == N), 1., 2.)
+        w = c/N*(1 - np.sum(b/(4.*j**2 - 1)*np.cos(2.*np.outer(k, j)*np.pi/N),
+                                axis=1))
+    elif gridtype == 'gaussian':
+        x, w = np.polynomial.legendre.leggauss(nlat)
+        x, w = x[::-1], w[::-1]
+    else:
+        raise ValueError('gridtype {} not supported.'.format(gridtype))
+    return x, w
+
+def legendre_table(ntrunc, x):
+    """Compute the associated Legendre functions P_mn(x) for n, m <= ntrunc.
+
+    The functions are normalized so that the integral of P_mn**2 over [-1, 1]
+    is 1, and are computed with the stable three-term recursion in n starting
+    from the sectoral functions P_mm.
+
+    Returns
+    -------
+    table : list of ntrunc+1 arrays, the mth with shape (len(x), ntrunc+1-m)
+        and columns n = m, ..., ntrunc.
+    """
+    return list(legendre_functions(ntrunc, x))
+
+def legendre_functions(ntrunc, x):
+    """Generate the arrays of legendre_table one m at a time."""
+    x = np.asarray(x, dtype=float)
+    sint = np.sqrt(1. - x**2)
+    pmm = np.sqrt(0.5)*np.ones_like(x)
+    for m in range(ntrunc+1):
+        if m > 0:
+            pmm = np.sqrt((2.*m + 1)/(2.*m))*sint*pmm
+        p = np.empty((len(x), ntrunc+1-m))
+        p[:, 0] = pmm
+        if m < ntrunc:
+            p[:, 1] = np.sqrt(2.*m + 3)*x*pmm
+        for n in range(m+2, ntrunc+1):
+            a = np.sqrt((4.*n*n - 1)/(n*n - m*m))
+            b = np.sqrt(((n - 1.)**2 - m*m)/(4.*(n - 1)**2 - 1))
+            p[:, n-m] = a*(x*p[:, n-m-1] - b*p[:, n-m-2])
+        yield p
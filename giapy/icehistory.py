@@ -10,9 +10,10 @@ icehistory.py
 import numpy as np
 
 import os
+import copy
 
 from giapy import pickle
-from giapy.map_tools import loadXYZGridData
+from giapy.map_tools import loadXYZGridData, regrid
 
 
 class IceHistory(object):
@@ -243,6 +244,144 @@ class IceHistory(object):
         self.Lat = self.Lat[::2**n,::2**n]
         self.shape = self.Lon.shape
 
+    def regrid(self, grid, newgrid):
+        """Conservatively regrid the ice stages from grid to newgrid.
+
+        Parameters
+        ----------
+        grid : <GridObject>
+            The grid of the ice history.
+        newgrid : <GridObject>
+            The new grid, e.g., a Gaussian grid (see map_tools.regrid).
+
+        Returns
+        -------
+        ice : <PersistentIceHistory>
+            The regridded ice history, with the same stages and times.
+        """
+        if self.areaProps:
+            raise ValueError('Apply the alterations before regridding.')
+        stages = getattr(self, 'stageArray', None)
+        if stages is None:
+            stages = [self.load(fname) for fname in self.fnames]
+        stageArray = np.array([regrid(stage, grid, newgrid) 
+                                for stage in stages])
+
+        # Keep the units (degrees or radians) of the coordinates.
+        scale = 1. if np.abs(self.Lat).max() > np.pi/2+1e-6 else np.pi/180
+        metadata = {'Lon'               : newgrid.Lon*scale,
+                    'Lat'               : newgrid.Lat*scale,
+                    'nlat'              : newgrid.shape[0],
+                    'shape'             : newgrid.shape,
+                    '_alterationMask'   : np.zeros(newgrid.shape),
+                    'areaProps'         : None,
+                    'areaVerts'         : None,
+                    'areaNames'         : None,
+                    'times'             : np.array(self.times),
+                    'stageOrder'        : np.array(self.stageOrder),
+                    'path'              : self.path,
+                    'fnames'            : list(self.fnames)}
+        return PersistentIceHistory(stageArray, metadata)
+
+    def coarsenStages(self, tol, grid=None, harmTrans=None, out_times=None,
+                        norm='mass', verbose=False):
+        """Merge consecutive small load changes into single load stages.
+
+        Stages are dropped while the change accumulated since the last kept
+        stage stays below tol times the total change over the history. Stages
+        bracketing a time in out_times are always kept, so that no merged
+        stage spans a requested output time. The original object is
+        unchanged.
+
+        Parameters
+        ----------
+        tol : float
+            The tolerated accumulated change in a merged stage, relative to the
+            summed change of all stages.
+        grid : <giapy.map_tools.GridObject>
+            Used to integrate ice volume changes (required for norm='mass').
+        harmTrans : <spharm.Spharmt>
+            Used to transform ice changes (required for norm='spectral').
+        out_times : array
+            Times across which no stages may be merged.
+        norm : 'mass' or 'spectral'
+            The measure of a load change. 'mass' is the area-integrated
+            absolute change in ice height, 'spectral' is the 2-norm of the
+            spherical harmonic coefficients of the change (default 'mass').
+        verbose : boolean
+            Print the stage counts and error estimate.
+
+        Returns
+        -------
+        ice : IceHistory
+            A (shallow) copy with reduced times and stageOrder. The stage
+            counts and estimated error are stored in its coarseningReport.
+        """
+        if norm == 'mass':
+            assert grid is not None, 'norm=mass needs a grid'
+            measure = lambda dI: grid.integrate(np.abs(dI), km=False)
+        elif norm == 'spectral':
+            assert harmTrans is not None, 'norm=spectral needs harmTrans'
+            measure = lambda dI: np.sqrt(np.sum(np.abs(
+                                            harmTrans.grdtospec(dI))**2))
+        else:
+            raise ValueError('norm {} not supported.'.format(norm))
+
+        times = np.asarray(self.times)
+        nstages = len(times)
+
+        # Magnitude of the change between consecutive stages, measured on
+        # altered copies (pairIter alters the stored stages in place).
+        def stage(i):
+            ice = np.array(self[i], dtype=float)
+            if self.areaProps is not None:
+                self.alterStage(ice, self.stageOrder[i])
+            return ice
+        changes = []
+        icea = stage(0)
+        for i in range(1, nstages):
+            iceb = stage(i)
+            changes.append(measure(iceb - icea))
+            icea = iceb
+        changes = np.array(changes)
+        total = changes.sum()
+
+        # Stages immediately before and after a requested time are barriers.
+        barriers = set()
+        if out_times is not None:
+            for t in np.atleast_1d(out_times):
+                i = np.searchsorted(-times, -t, side='right') - 1
+                if 0 <= i < nstages:
+                    barriers.add(i)
+                if i+1 < nstages:
+                    barriers.add(i+1)
+
+        keep = [0]
+        acc = 0.
+        err = 0.
+        for i in range(1, nstages-1):
+            acc += changes[i-1]
+            if i in barriers or acc + changes[i] > tol*total:
+                keep.append(i)
+                acc = 0.
+            else:
+                # The dropped change is applied later than it would have been,
+                # so the load mismatch in this window is at most acc.
+                err = max(err, acc)
+        keep.append(nstages-1)
+        keep = np.unique(keep)
+
+        coarse = copy.copy(self)
+        coarse.times = times[keep]
+        coarse.stageOrder = np.asarray(self.stageOrder)[keep]
+        coarse.coarseningReport = {'nstages'   : nstages,
+                                   'ncoarse'   : len(keep),
+                                   'error'     : err/total if total else 0.}
+        if verbose:
+            print('Stages coarsened from {0} to {1}, est. error {2:.2e}'.format(
+                    nstages, len(keep), coarse.coarseningReport['error']))
+        return coarse
+
     def createAlterationAreas(self, grid, props, areaNames=None, areaVerts=None):
         """Create alteration areas for proportional ice height changes.
 
@@ -307,7 +446,7 @@ class IceHistory(object):
             (assumes the order follows self.stageOrder)
 
         """
-        for area, prop in updateDict.iteritems():
+        for area, prop in updateDict.items():
             self.areaProps[area] = prop 
 
     def alterStage(self, stage, stageNum):
@@ -323,7 +462,7 @@ class IceHistory(object):
             retrieved.
         """
         #TODO Fix this type checking
-        for name, prop in self.areaProps.iteritems():
+        for name, prop in self.areaProps.items():
             if (isinstance(prop, list) or \
                     isinstance(prop, np.ndarray)):
                 stage[self._alterationMask==hash(name)] *= prop[stageNum]
@@ -371,7 +510,7 @@ class PersistentIceHistory(IceHistory):
 
         self.stageArray = iceArray
         # Copy important info from icehistory
-        for attr, value in metadata.iteritems():
+        for attr, value in metadata.items():
             setattr(self, attr, value)
 
         self.fnameDict = dict(zip(self.fnames,
@@ -410,7 +549,6 @@ class PersistentIceHistory(IceHistory):
         #for time, fname in zip(self.times[1:], self.fnames[1:]):
         for i, stage in enumerate(self.stageOrder[1:], start=1):
             time = self.times[i]
-            fname = self[stage]
             ice0, t0, ice1, t1 = ice1, t1, self.stageArray[stage], time
             if self.areaProps is not None:
                 self.alterStage(ice1, stage)
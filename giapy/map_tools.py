@@ -20,6 +20,9 @@ class GridObject(object):
     basemap (Basemap, optional): a basemap object defining the map
     mapparam (dict, optional): the dict defining parameters for a basemap
     shape (tuple, optional): the shape of the grid desired, default (50, 50)
+    gridtype (str, optional): 'regular' (default), equispaced in the map
+        coordinates, or 'gaussian', with Gaussian latitudes (for global
+        cylindrical maps only), integrated by Gaussian quadrature.
 
     Note
     ----
@@ -32,7 +35,8 @@ class GridObject(object):
     y     : 
     shape : 
     """
-    def __init__(self, basemap=None, mapparam=None, shape=None):
+    def __init__(self, basemap=None, mapparam=None, shape=None,
+                    gridtype='regular'):
         if basemap is not None: 
             self.basemap = basemap
         elif mapparam is not None:
@@ -42,12 +46,10 @@ class GridObject(object):
             raise ValueError('GridObject needs either Basemap object or\
                                 paramaters.')
 
-        self.shape = shape or (50, 50)
-        self.x = np.linspace(basemap.xmin, basemap.xmax, self.shape[1],
-                                endpoint=False)
-        self.y = np.linspace(basemap.ymin, basemap.ymax, self.shape[0],
-                                endpoint=True)
-        self.Lon, self.Lat = basemap(*np.meshgrid(self.x, self.y), inverse=True)
+        if gridtype not in ['regular', 'gaussian']:
+            raise ValueError('gridtype {} not supported.'.format(gridtype))
+        self.gridtype = gridtype
+        self.update_shape(shape or (50, 50))
 
     def update_shape(self, shape):
         self.shape = shape
@@ -56,10 +58,33 @@ class GridObject(object):
 
         self.x = np.linspace(basemap.xmin, basemap.xmax, self.shape[1],
                                 endpoint=False)
-        self.y = np.linspace(basemap.ymin, basemap.ymax, self.shape[0],
-                                endpoint=True)
+        if self.gridtype == 'gaussian':
+            # Gaussian latitudes, south to north like the regular grid.
+            x, w = np.polynomial.legendre.leggauss(self.shape[0])
+            self.y = np.degrees(np.arcsin(x))
+            self.weights = w
+        else:
+            self.y = np.linspace(basemap.ymin, basemap.ymax, self.shape[0],
+                                    endpoint=True)
         self.Lon, self.Lat = basemap(*np.meshgrid(self.x, self.y), inverse=True)
 
+    def cellEdges(self):
+        """Return the edges of the grid cells in longitude (radians) and in
+        sine of latitude.
+
+        Regular cells are centered on the grid points (the polar cells are
+        half cells), Gaussian cells have the areas of the quadrature weights.
+        """
+        dLon = 2*np.pi/self.shape[1]
+        lonEdges = np.radians(self.Lon[0, 0]) + dLon*(np.arange(
+                                                    self.shape[1]+1) - 0.5)
+        if self.gridtype == 'gaussian':
+            sinEdges = np.r_[-1, np.cumsum(self.weights) - 1]
+        else:
+            lat = np.radians(self.Lat[:, 0])
+            sinEdges = np.sin(np.r_[lat[0], 0.5*(lat[1:] + lat[:-1]), lat[-1]])
+        return lonEdges, sinEdges
+
     def volume(self, array, km=True):
         """Weight an area defined over the map by the area of the cells
         """
@@ -70,10 +95,15 @@ class GridObject(object):
         if self.shape != array.shape:
             raise ValueError('GridObject and array must have same shape')
 
+        r = 6371 if km else 6371000
+
+        if self.gridtype == 'gaussian':
+            # Gaussian quadrature in latitude, trapezoidal in longitude.
+            dA = (r**2)*self.weights[:, None]*2*np.pi/self.shape[1]
+            return array*dA
+
         dLon = np.abs(self.Lon[:-1,1:]-self.Lon[:-1,:-1])*np.pi/180
         dLat = np.abs(self.Lat[1:,:-1]-self.Lat[:-1,:-1])*np.pi/180
-        
-        r = 6371 if km else 6371000
 
         # formula needs colatitude
         CoLat = self.Lat+90
@@ -90,7 +120,7 @@ class GridObject(object):
 
     def integrateArea(self, array, area, latlon=False):
         """Integrate an array over a specific area."""
-        inds = self.selectArea(area, latlon=latlon, reduced=1)
+        inds = self.selectArea(area, latlon=latlon, reduced=self._reduced)
         dV = self.volume(array)
         return dV[inds].sum()
 
@@ -99,14 +129,19 @@ class GridObject(object):
         dV = self.volume(array)
         volDict = {}
         wholeVol = 0
-        for name, verts in areaDict.iteritems():
-            inds = self.selectArea(verts, reduced=1)
+        for name, verts in areaDict.items():
+            inds = self.selectArea(verts, reduced=self._reduced)
             volDict[name] = dV[inds].sum()
             wholeVol += dV[inds].sum()
         volDict['whole'] = wholeVol
             
         return volDict
 
+    @property
+    def _reduced(self):
+        """The reduction of the volume array relative to the grid."""
+        return None if self.gridtype == 'gaussian' else 1
+
     def create_interper(self, array):
         """Return a 2D interpolation object on the map, in map coordinates.
 
@@ -189,6 +224,40 @@ class GridObject(object):
         p = self.basemap.pcolormesh(self.Lon, self.Lat, Z, **kwargs)
         return p 
 
+def regrid(array, grid, newgrid):
+    """Conservatively regrid array(s) from grid to newgrid.
+
+    The value in each new cell is the area-weighted mean of the overlapping
+    old cells (see GridObject.cellEdges), so that area integrals are
+    preserved. Both grids must be global longitude/latitude grids.
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+        The field(s) on grid, shape grid.shape or (..., grid.shape).
+    grid, newgrid : <GridObject>
+
+    Returns
+    -------
+    newarray : numpy.ndarray with shape newgrid.shape or (..., newgrid.shape)
+    """
+    lonEdges, sinEdges = grid.cellEdges()
+    newLonEdges, newSinEdges = newgrid.cellEdges()
+    wlat = _overlapWeights(sinEdges, newSinEdges)
+    wlon = _overlapWeights(lonEdges, newLonEdges, period=2*np.pi)
+    return np.matmul(np.matmul(wlat, array), wlon.T)
+
+def _overlapWeights(edges, newEdges, period=None):
+    """The fraction of each new cell covered by each old cell (1D), as a
+    matrix (new cells, old cells)."""
+    shifts = [0] if period is None else [-period, 0, period]
+    overlap = 0
+    for shift in shifts:
+        lo = np.maximum(newEdges[:-1, None], edges[None, :-1]+shift)
+        hi = np.minimum(newEdges[1:, None], edges[None, 1:]+shift)
+        overlap = overlap + np.maximum(hi - lo, 0)
+    return overlap/np.diff(newEdges)[:, None]
+
 def haversine(lat1, lat2, lon1, lon2, r=6371, radians=False):
     """Calculate the distance bewteen two sets of lat/lon pairs.
 
@@ -304,7 +373,7 @@ def volumeChangeLoad(h, topo):
 
     return hw
 
-def sealevelChangeByMelt(V, topo, grid):
+def sealevelChangeByMelt(V, topo, grid, stats=None):
     """Find the topographic lowering that alters the ocean's volume by V.
 
     Because of changing coastlines, a eustatic increase (decrease) of h will
@@ -320,6 +389,9 @@ def sealevelChangeByMelt(V, topo, grid):
         The topography to alter.
     grid : <GridObject>
         The grid object assists with integration.
+    stats : dict
+        If given, its counters 'root_calls' and 'root_nfev' are incremented
+        by the root finding (see giapy.profiling).
     
     Returns
     -------
@@ -335,6 +407,8 @@ def sealevelChangeByMelt(V, topo, grid):
     # Use scipy.optimize.root to minimize volume difference.
     Vexcess = lambda h: V - grid.integrate(volumeChangeLoad(h, topo), km=False)
     h = root(Vexcess, h0)
+    if stats is not None:
+        _countRoot(stats, h)
 
     return h['x'][0]
 
@@ -368,7 +442,7 @@ def oceanUpliftLoad(h, Ta, upl):
     hw = (h - upl - np.maximum(Ta, 0))*(Tb<0) + Tb*(Tb>0)*(Ta<0)
     return hw
 
-def sealevelChangeByUplift(upl, topo, grid):
+def sealevelChangeByUplift(upl, topo, grid, stats=None):
     """Find the topographic lowering that alters the ocean's volume by V.
 
     Because of changing coastlines, a eustatic increase (decrease) of h will
@@ -385,6 +459,9 @@ def sealevelChangeByUplift(upl, topo, grid):
         The topography to alter.
     grid : <GridObject>
         The grid object assists with integration.
+    stats : dict
+        If given, its counters 'root_calls' and 'root_nfev' are incremented
+        by the root finding (see giapy.profiling).
     
     Returns
     -------
@@ -402,11 +479,17 @@ def sealevelChangeByUplift(upl, topo, grid):
     # Use scipy.optimize.root to minimize volume difference..
     Vexcess = lambda h: grid.integrate(oceanUpliftLoad(h, topo, upl), km=False)
     h = root(Vexcess, h0)
+    if stats is not None:
+        _countRoot(stats, h)
 
     return h['x'][0]
 
+def _countRoot(stats, sol):
+    """Add a scipy.optimize.root solution's evaluations to stats."""
+    stats['root_calls'] = stats.get('root_calls', 0) + 1
+    stats['root_nfev'] = stats.get('root_nfev', 0) + sol['nfev']
 
-def floatingIceRedistribute(I0, I1, S0, grid, denp=0.9077):
+def floatingIceRedistribute(I0, I1, S0, grid, denp=0.9077, stats=None):
     """Calculate load and topographic shift due to ice height changes.
 
     Calculate the water-equivalent load changes due to changing from ice
@@ -431,6 +514,8 @@ def floatingIceRedistribute(I0, I1, S0, grid, denp=0.9077):
     denp : float
         The ratio of densities of ice and water (default = 0.9077). Used it
         transforming ice heights to equivalent water heights.
+    stats : dict
+        Counters of the root finding, see sealevelChangeByMelt.
 
     Returns
     -------
@@ -447,7 +532,7 @@ def floatingIceRedistribute(I0, I1, S0, grid, denp=0.9077):
     # The change in water volume of the ocean.
     dVo = -grid.integrate(dIwh, km=False)
                                                    
-    dhwBar = sealevelChangeByMelt(dVo, S0+denp*I1, grid)
+    dhwBar = sealevelChangeByMelt(dVo, S0+denp*I1, grid, stats)
     dLoad = dIwh + volumeChangeLoad(dhwBar, S0+denp*I1)
                                                                                   
     return dLoad, dhwBar
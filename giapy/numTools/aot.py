@@ -0,0 +1,135 @@
+"""
+aot.py
+
+    Compilation of the numba kernels of giapy (the propagator matrix fills of
+    elasticlove and viscouslove, the relaxation steps of solvdeJit, and the
+    propagation of normalmodes).
+
+    The kernels are compiled when their modules are imported, with explicit
+    signatures, and cached on disk (numba's cache=True), so that only the
+    first import after installation or a change of the source pays for the
+    compilation. If the kernels have been compiled ahead of time into the
+    extension module giapy.numTools._aot_kernels, they are loaded from it
+    instead. The parallel batch fills of elasticlove and viscouslove cannot
+    be exported (numba compiles parallel loops only just in time), so with
+    the ahead-of-time module they call the exported fills one order number
+    at a time instead, and the real Love numbers (compute_love_numbers and
+    the viscous propagators) need no compilation. Kernels compiled for the
+    types of their arguments (generic, e.g., the complex fills of the
+    Laplace domain in normalmodes and laplacelove) are not exported, and
+    are still compiled (and cached) at their first call. To build it,
+
+        $ python -m giapy.numTools.aot
+
+    or install with the environment variable GIAPY_AOT=1 (see setup.py).
+
+    Author: Samuel B. Kachuck
+
+Methods
+-------
+kernel : compile (or load ahead-of-time) a kernel, used by the modules.
+ahead_of_time : whether a kernel was loaded from the ahead-of-time module.
+jitted : a kernel as a numba function, to be called by other kernels.
+generic : a kernel compiled for the types of its arguments.
+build : build the ahead-of-time extension module.
+extension : the ahead-of-time module as a setuptools extension.
+"""
+import os
+import importlib
+
+from numba import jit
+
+try:
+    from giapy.numTools import _aot_kernels
+except ImportError:
+    _aot_kernels = None
+
+AOT_MODULE = '_aot_kernels'
+
+# The modules with kernels, and the kernels they registered as
+# {(module, name): (function, signature)}.
+KERNEL_MODULES = ['giapy.numTools.solvdeJit', 'giapy.earth_tools.elasticlove',
+                  'giapy.earth_tools.viscouslove',
+                  'giapy.earth_tools.normalmodes']
+_REGISTRY = {}
+
+def _aotName(module, name):
+    return module.split('.')[-1] + '__' + name.lstrip('_')
+
+def kernel(sig):
+    """Decorate a kernel (a Python function) with numba signature sig: return
+    it from the ahead-of-time module if built, otherwise compiled (nopython)
+    and cached on disk. Used like numba.jit(sig, nopython=True)."""
+    def decorator(func):
+        module, name = func.__module__, func.__name__
+        _REGISTRY[(module, name)] = (func, sig)
+        if _aot_kernels is not None:
+            compiled = getattr(_aot_kernels, _aotName(module, name), None)
+            if compiled is not None:
+                return compiled
+        return jit(sig, nopython=True, cache=True)(func)
+    return decorator
+
+def ahead_of_time(func):
+    """Whether the kernel func was loaded from the ahead-of-time module."""
+    return _aot_kernels is not None and not hasattr(func, 'py_func')
+
+def jitted(func):
+    """Return the kernel func as a numba function (compiled lazily and cached
+    on disk) for calls from other kernels, even if func was loaded ahead of
+    time."""
+    if hasattr(func, 'py_func'):
+        return func
+    return jit(nopython=True, cache=True)(_pyFunc(func))
+
+def generic(func):
+    """Return the kernel func compiled (lazily, and cached on disk) for the
+    types of the arguments of each call, rather than its signature, e.g.,
+    for complex arrays."""
+    return jit(nopython=True, cache=True)(_pyFunc(func))
+
+def _pyFunc(func):
+    """The Python function of the kernel func."""
+    if hasattr(func, 'py_func'):
+        return func.py_func
+    for (mod, name), (pyfunc, sig) in _REGISTRY.items():
+        if _aot_kernels is not None and \
+                getattr(_aot_kernels, _aotName(mod, name), None) is func:
+            return pyfunc
+    raise ValueError('{} is not a registered kernel'.format(func))
+
+def _compiler(outdir=None):
+    """The numba.pycc.CC exporting all registered kernels."""
+    from numba.pycc import CC
+
+    for module in KERNEL_MODULES:
+        importlib.import_module(module)
+
+    cc = CC(AOT_MODULE)
+    cc.output_dir = outdir or os.path.dirname(os.path.abspath(__file__))
+    for (module, name), (func, sig) in sorted(_REGISTRY.items()):
+        cc.export(_aotName(module, name), sig)(func)
+    return cc
+
+def build(outdir=None, verbose=False):
+    """Compile the kernels ahead of time into the extension module
+    giapy.numTools._aot_kernels, in outdir (default, next to this file).
+    Requires a C compiler."""
+    cc = _compiler(outdir)
+    cc.verbose = verbose
+    cc.compile()
+    return cc.output_dir
+
+def extension():
+    """Return the ahead-of-time module as a setuptools Extension."""
+    cc = _compiler()
+    ext = cc.distutils_extension()
+    ext.name = 'giapy.numTools.' + AOT_MODULE
+    return ext
+
+if __name__ == '__main__':
+    import sys
+    # The kernel modules register with the imported module, not __main__.
+    from giapy.numTools.aot import build
+    outdir = build(verbose='-v' in sys.argv)
+    print('Built {} in {}'.format(AOT_MODULE, outdir))
@@ -0,0 +1,98 @@
+"""
+magnus.py
+
+    Fourth-order Magnus propagators for the relaxation of linear two-point
+    boundary value problems, dy/dx = A(x).y (see solvdeJit.solvde_linear).
+
+    The relaxation's difference equations are trapezoidal (Cayley) steps,
+        y_k - y_{k-1} = h A (y_k + y_{k-1})/2,
+    second-order accurate when A is A(x) at the middle of the interval. The
+    step y_k = exp(Omega) y_{k-1} of the fourth-order Magnus expansion, with
+    A at the two Gauss points x1, x2 of the interval,
+        Omega = h (A(x1) + A(x2))/2 + sqrt(3) h**2 [A(x2), A(x1)]/12,
+    is the trapezoidal step with A = 2 tanh(Omega/2)/h, so the same
+    equations (and code) give fourth-order accuracy when given these
+    matrices in place of A at the middle.
+
+    Author: Samuel B. Kachuck
+
+Methods
+-------
+gauss_points : the Gauss points of intervals.
+magnus_trapezoid : the matrices of the trapezoidal steps equal to the
+    fourth-order Magnus steps.
+tanhm : the hyperbolic tangent of matrices.
+"""
+import numpy as np
+
+# The offsets of the two Gauss points from the middle of an interval, in
+# units of its length.
+GAUSS_OFFSETS = np.array([-0.5, 0.5])/np.sqrt(3)
+
+# The Taylor coefficients of tanh(x) (of x, x**3, ..., x**11), used for
+# matrices of norm at most TANH_THETA (truncation error below 1e-16
+# relative).
+_TANH_COEFFS = [1., -1./3, 2./15, -17./315, 62./2835, -1382./155925]
+TANH_THETA = 0.125
+
+def gauss_points(xmids, h):
+    """Return the two Gauss points (..., 2) of the intervals with middles
+    xmids and lengths h."""
+    xmids, h = np.asarray(xmids), np.asarray(h)
+    return xmids[..., None] + GAUSS_OFFSETS*h[..., None]
+
+def magnus_trapezoid(A1, A2, h):
+    """Return the matrices A of the trapezoidal steps that are the
+    fourth-order Magnus steps of the intervals of length h.
+
+    Parameters
+    ----------
+    A1, A2 : (..., m, m) arrays
+        The matrices A(x) at the lower and upper Gauss points of the
+        intervals.
+    h : (...) array
+        The lengths of the intervals. Intervals of zero length get A = 0.
+
+    Returns
+    -------
+    A : (..., m, m) array, 2 tanh(Omega/2)/h.
+    """
+    h = np.asarray(h, dtype=float)[..., None, None]
+    omega = (0.5*h*(A1 + A2) +
+                np.sqrt(3)/12*h**2*(np.matmul(A2, A1) - np.matmul(A1, A2)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(h > 0, 2./h*tanhm(0.5*omega), 0.)
+
+def tanhm(X):
+    """Return the hyperbolic tangent of the (real or complex) square matrices
+    X (..., m, m).
+
+    The matrices are scaled by 2**-s to norms at most TANH_THETA, where the
+    Taylor series is used, and the doubling formula
+        tanh(2X) = 2 (I + tanh(X)**2)**-1 tanh(X)
+    is applied s times. Unlike forming tanh from exp(X), this is stable for
+    matrices with large eigenvalues of both signs (stiff propagators), as
+    long as they are not near the poles of tanh (on the imaginary axis).
+    """
+    X = np.asarray(X)
+    X = X.astype(np.result_type(X, float), copy=False)
+    m = X.shape[-1]
+    eye = np.eye(m)
+
+    norm = np.abs(X).sum(axis=-2).max(axis=-1)
+    with np.errstate(divide='ignore'):
+        s = np.ceil(np.log2(norm/TANH_THETA))
+    s = np.where(np.isfinite(s), np.maximum(s, 0), 0).astype(int)
+
+    Y = X/(2.**s)[..., None, None]
+    Y2 = np.matmul(Y, Y)
+    T = _TANH_COEFFS[-1]*eye
+    for coeff in _TANH_COEFFS[-2::-1]:
+        T = coeff*eye + np.matmul(Y2, T)
+    T = np.matmul(Y, T)
+
+    for j in range(s.max(initial=0)):
+        double = s > j
+        Tj = T[double]
+        T[double] = 2*np.linalg.solve(eye + np.matmul(Tj, Tj), Tj)
+    return T
@@ -11,7 +11,9 @@ solvde.py
         Cambridge University Press, Cambridge UK.
 """
 import numpy as np
-from numba import jit, void, int64, float64
+from numba import void, int64, float64
+
+from giapy.numTools.aot import kernel, jitted
 
 def solvde(itmax, conv, slowc, scalv, indexv, nb, y, difeq, verbose=False,
             it_count=False):
@@ -46,6 +48,12 @@ def solvde(itmax, conv, slowc, scalv, indexv, nb, y, difeq, verbose=False,
     k1=0; k2=m
     #indexv = np.asarray(indexv)
 
+    # Linear problems whose propagators are stored are relaxed entirely in
+    # compiled code.
+    if hasattr(difeq, 'relaxArrays'):
+        return solvde_linear(itmax, conv, slowc, scalv, indexv, nb, y, difeq,
+                                verbose, it_count)
+
     c = np.zeros((ne, ne-nb+1, m+1))
     s = np.zeros((ne, 2*ne+1))
 
@@ -67,13 +75,13 @@ def solvde(itmax, conv, slowc, scalv, indexv, nb, y, difeq, verbose=False,
     jc1=0
     jcf=ic3
 
-    for it in xrange(itmax):        # Primary iteration loop.
+    for it in range(itmax):        # Primary iteration loop.
         k = k1                 # Boundary conditions at first point.
         s = difeq.smatrix(k, k1, k2, 2*ne, ne-nb, 
                                     ne, indexv, s, y)
         pinvs(ne-nb, ne, ne, 2*ne, 0, k1, s, c, np.zeros(nb, dtype=int), np.zeros(nb))
 
-        for k in xrange(k1+1, k2):    # Finite difference equations at
+        for k in range(k1+1, k2):    # Finite difference equations at
             kp=k                        # all point pairs.
             s = difeq.smatrix(k, k1, k2, 2*ne, 0, 
                                         ne, indexv, s, y)
@@ -118,8 +126,75 @@ def solvde(itmax, conv, slowc, scalv, indexv, nb, y, difeq, verbose=False,
     # jit won't raise errors, consider flag.
     #raise ValueError('Too many iterations in solvde')
             
-@jit(void(int64, int64, int64, int64, int64, int64, 
-            float64[:,:], float64[:,:,:], int64[:], float64[:]), nopython=True)
+def solvde_linear(itmax, conv, slowc, scalv, indexv, nb, y, difeq,
+                    verbose=False, it_count=False):
+    """Relaxation for linear two-point boundary value problems, dy/dx =
+    A(x).y + b(x), with linear boundary conditions, in which each iteration
+    (the s matrix at all points, its reduction, back substitution and the
+    corrections) is compiled.
+
+    The parameters are those of solvde, but difeq must also provide
+    difeq.relaxArrays(), returning the propagators A (m-1, ne, ne), the
+    inhomogeneities b (m-1, ne) and the point separations h (m-1) of the
+    interior s matrices, which are s[i, indexv[j]] = -delta_ij - h A_ij / 2,
+    s[i, ne+indexv[j]] = delta_ij - h A_ij / 2, and s[i, jsf] = y_i(k) -
+    y_i(k-1) - h sum_j A_ij (y_j(k) + y_j(k-1)) / 2 - h b_i, with A, b and h
+    at index k-1. The boundary conditions are found once, from difeq.smatrix.
+
+    The work arrays are kept between calls with the same shapes (see
+    _workspace).
+    """
+    ne, m = y.shape
+    indexv = np.asarray(indexv, dtype=np.int64)
+    scalv = np.asarray(scalv, dtype=float)
+    A, b, h = difeq.relaxArrays()
+    if min(len(A), len(b), len(h)) < m-1:
+        raise ValueError('relaxArrays must have at least m-1 points')
+    c, s, indxr, pscl = _workspace(ne, nb, m)
+    Bbot, cbot, Btop, ctop = boundary_rows(difeq, ne, nb, m, indexv, s)
+
+    for it in range(itmax):
+        err = _relaxIteration(ne, nb, slowc, A, b, h, Bbot, cbot, Btop, ctop,
+                                indexv, scalv, y, s, c, indxr, pscl)
+        if verbose:
+            print("Iter.")
+            print("{:<11}".format("Error"))
+            print("{:<8}".format(it))
+            print("{0:5f}{1:<3}".format(err, ' '))
+        if err < conv:
+            break
+    if it_count:
+        return y, it+1
+    else:
+        return y,
+
+# Work arrays of solvde_linear, keyed by (ne, nb, m).
+_WORKSPACES = {}
+
+def _workspace(ne, nb, m):
+    """Return the arrays c, s, indxr and pscl for a problem of ne equations
+    with nb bottom boundary conditions at m points, reused between calls."""
+    key = (ne, nb, m)
+    if key not in _WORKSPACES:
+        _WORKSPACES[key] = (np.zeros((ne, ne-nb+1, m+1)),
+                            np.zeros((ne, 2*ne+1)),
+                            np.zeros(ne, dtype=np.int64), np.zeros(ne))
+    return _WORKSPACES[key]
+
+def boundary_rows(difeq, ne, nb, m, indexv, s):
+    """Return the linear boundary conditions of difeq as (Bbot, cbot, Btop,
+    ctop), where the conditions are B.y + c = 0 at the first (nb rows) and
+    last (ne-nb rows) points, from its s matrices at y = 0."""
+    y0 = np.zeros((ne, m))
+    cols = ne + indexv
+    s = difeq.smatrix(0, 0, m, 2*ne, ne-nb, ne, indexv, s, y0)
+    Bbot, cbot = s[ne-nb:ne][:, cols].copy(), s[ne-nb:ne, 2*ne].copy()
+    s = difeq.smatrix(m, 0, m, 2*ne, 0, ne-nb, indexv, s, y0)
+    Btop, ctop = s[:ne-nb][:, cols].copy(), s[:ne-nb, 2*ne].copy()
+    return Bbot, cbot, Btop, ctop
+
+@kernel(void(int64, int64, int64, int64, int64, int64, 
+            float64[:,:], float64[:,:,:], int64[:], float64[:]))
 def pinvs(ie1, ie2, je1, jsf, jc1, k, s, c, indxr, pscl):
     """Diagonalize the square subsection of the s matrix, and store the
     recursion coefficients in c; used internally by Solvde."""
@@ -186,7 +261,7 @@ def pinvs(ie1, ie2, je1, jsf, jc1, k, s, c, indxr, pscl):
         for j in range(je2, jsf+1):
             c[irow-1, j+jcoff, k] = s[i, j]
 
-@jit(void(int64, int64, int64, int64, int64, float64[:,:,:]), nopython=True)
+@kernel(void(int64, int64, int64, int64, int64, float64[:,:,:]))
 def bksub(ne, nb, jf, k1, k2, c):
     nbf=ne-nb
     im = 1
@@ -207,8 +282,8 @@ def bksub(ne, nb, jf, k1, k2, c):
         for k in range(k1,k2):
             c[nb+i,0,k] = c[i,jf,k+1] 
 
-@jit(void(int64, int64, int64, int64, int64, int64, int64, int64, 
-            int64, int64, int64, float64[:,:], float64[:,:,:]), nopython=True)
+@kernel(void(int64, int64, int64, int64, int64, int64, int64, int64, 
+            int64, int64, int64, float64[:,:], float64[:,:,:]))
 def red(iz1, iz2, jz1, jz2, jm1, jm2, jmf, ic1, jc1, jcf, kc, s, c):
     """Reduce columns jz1..jz21 of the s matrix, using previous results
     stored in the c matrix. Only columns jm1..jm2-1 and jmf are affected by
@@ -225,8 +300,8 @@ def red(iz1, iz2, jz1, jz2, jm1, jm2, jmf, ic1, jc1, jcf, kc, s, c):
         for i in range(iz1, iz2):
             s[i, jmf] -= s[i, j]*vx
 
-@jit(float64(int64, int64, int64, int64[:], 
-        float64[:], float64[:,:,:]), nopython=True)
+@kernel(float64(int64, int64, int64, int64[:], 
+        float64[:], float64[:,:,:]))
 def errest(ne, k1, k2, indexv, scalv, c):
     err = 0.
     for j in range(ne):
@@ -242,8 +317,8 @@ def errest(ne, k1, k2, indexv, scalv, c):
         err += errj/scalv[j]
     return err
 
-@jit(void(int64, int64, int64, float64[:,:], float64[:], 
-    float64[:,:], int64[:], float64[:,:]), nopython=True)
+@kernel(void(int64, int64, int64, float64[:,:], float64[:], 
+    float64[:,:], int64[:], float64[:,:]))
 def interior_smatrix_fast(n, k, jsf, A, b, y, indexv, s):
     """Generates the s matrix used by solvde for interior points for a linear
     system characterized by linear differential operator A and inhomogeneity b.
@@ -260,3 +335,75 @@ def interior_smatrix_fast(n, k, jsf, A, b, y, indexv, s):
                 s[i, n+indexv[j]] = -A[i,j]
             rgt += A[i,j] * (y[j, k] + y[j, k-1])
         s[i, jsf] = y[i, k] - y[i, k-1] - rgt - b[i]
+
+# The kernels called by _relaxIteration, as numba functions (even if the
+# kernels above were compiled ahead of time).
+_pinvs = jitted(pinvs)
+_red = jitted(red)
+_bksub = jitted(bksub)
+_errest = jitted(errest)
+
+@kernel(float64(int64, int64, float64, float64[:,:,:], float64[:,:],
+    float64[:], float64[:,:], float64[:], float64[:,:], float64[:], int64[:],
+    float64[:], float64[:,:], float64[:,:], float64[:,:,:], int64[:],
+    float64[:]))
+def _relaxIteration(ne, nb, slowc, A, b, h, Bbot, cbot, Btop, ctop, indexv,
+                        scalv, y, s, c, indxr, pscl):
+    """One iteration of solvde_linear, correcting y in place and returning
+    the average error."""
+    m = y.shape[1]
+    k1 = 0; k2 = m
+    jsf = 2*ne
+
+    # Boundary conditions at first point.
+    for i in range(nb):
+        rgt = cbot[i]
+        for j in range(ne):
+            s[ne-nb+i, ne+indexv[j]] = Bbot[i,j]
+            rgt += Bbot[i,j]*y[j,0]
+        s[ne-nb+i, jsf] = rgt
+    indxr[:] = 0
+    _pinvs(ne-nb, ne, ne, jsf, 0, k1, s, c, indxr[:nb], pscl[:nb])
+
+    # Finite difference equations at all point pairs.
+    for k in range(k1+1, k2):
+        hh = 0.5*h[k-1]
+        for i in range(ne):
+            rgt = 0.
+            for j in range(ne):
+                a = hh*A[k-1,i,j]
+                if i==j:
+                    s[i, indexv[j]]    = -1. - a
+                    s[i, ne+indexv[j]] =  1. - a
+                else:
+                    s[i, indexv[j]]    = -a
+                    s[i, ne+indexv[j]] = -a
+                rgt += a * (y[j, k] + y[j, k-1])
+            s[i, jsf] = y[i, k] - y[i, k-1] - rgt - h[k-1]*b[k-1,i]
+        _red(0, ne, 0, nb, nb, ne, jsf, ne-nb, 0, ne-nb, k, s, c)
+        indxr[:] = 0
+        _pinvs(0, ne, nb, jsf, 0, k, s, c, indxr, pscl)
+
+    # Final boundary conditions.
+    for i in range(ne-nb):
+        rgt = ctop[i]
+        for j in range(ne):
+            s[i, ne+indexv[j]] = Btop[i,j]
+            rgt += Btop[i,j]*y[j,m-1]
+        s[i, jsf] = rgt
+    _red(0, ne-nb, ne, ne+nb, ne+nb, jsf, jsf, ne-nb, 0, ne-nb, k2, s, c)
+    indxr[:] = 0
+    _pinvs(0, ne-nb, ne+nb, jsf, ne-nb, k2, s, c, indxr[:ne-nb],
+            pscl[:ne-nb])
+    _bksub(ne, nb, ne-nb, k1, k2, c)      # Backsubstitution.
+
+    # Convergence check, accumulate average error.
+    err = _errest(ne, k1, k2, indexv, scalv, c)/(ne*m)
+
+    # Reduce correction when error is large, and apply corrections.
+    fac = slowc/err if err > slowc else 1.
+    for j in range(ne):
+        jv = indexv[j]
+        for k in range(k1, k2):
+            y[j, k] -= fac*c[jv, 0, k]
+    return err
@@ -0,0 +1,71 @@
+"""
+timeindex.py
+
+    Map times to their indices in an array of times, allowing for roundoff in
+    the times (e.g., from np.linspace and np.union1d).
+
+    Author: Samuel B. Kachuck
+"""
+import numpy as np
+
+class TimeIndex(object):
+    """Find the indices of times in an array of (unique) times.
+
+    The times are sorted once, and times are located by binary search, and
+    matched to the nearest time within a tolerance.
+
+    Parameters
+    ----------
+    times : array
+        The times, in any order (e.g., decreasing output times).
+    rtol, atol : float
+        Times match if they differ by less than atol + rtol*abs(time)
+        (default 1e-9 and 1e-12).
+
+    Methods
+    -------
+    get(t, default=None) : the index of t, or default if t is not found.
+    index(t) : the index of t, raising ValueError if t is not found.
+    lookup(ts) : the indices of an array of times, -1 where not found.
+    """
+    def __init__(self, times, rtol=1e-9, atol=1e-12):
+        self.source = times
+        self.times = np.asarray(times, dtype=float)
+        self.rtol, self.atol = rtol, atol
+        self._order = np.argsort(self.times, kind='mergesort')
+        self._sorted = self.times[self._order]
+
+    def __len__(self):
+        return len(self.times)
+
+    def __contains__(self, t):
+        return self.get(t) is not None
+
+    def lookup(self, ts):
+        """Return the indices of times ts (array), -1 where not found."""
+        ts = np.asarray(ts, dtype=float)
+        n = len(self._sorted)
+        if n == 0:
+            return -np.ones(ts.shape, dtype=int)
+        # The nearest of the neighbouring sorted times.
+        right = np.clip(np.searchsorted(self._sorted, ts), 0, n-1)
+        left = np.clip(right-1, 0, n-1)
+        useleft = (np.abs(self._sorted[left] - ts) <
+                    np.abs(self._sorted[right] - ts))
+        nearest = np.where(useleft, left, right)
+
+        found = (np.abs(self._sorted[nearest] - ts) <=
+                    self.atol + self.rtol*np.abs(ts))
+        return np.where(found, self._order[nearest], -1)
+
+    def get(self, t, default=None):
+        """Return the index of time t, or default if it is not found."""
+        ind = int(self.lookup(t))
+        return ind if ind >= 0 else default
+
+    def index(self, t):
+        """Return the index of time t, raising ValueError if not found."""
+        ind = self.get(t)
+        if ind is None:
+            raise ValueError('time {} not in times'.format(t))
+        return ind
@@ -0,0 +1,247 @@
+"""
+parareal.py
+Author: Samuel B. Kachuck
+
+    Experimental time-parallel (parareal) driver for the sea level equation.
+
+    With topography, the load stages of GiaSimGlobal.performConvolution are
+    strictly sequential: each needs the solid surface topography and sea
+    surface from the previous one. The parareal method (Lions et al., 2001)
+    splits the ice history into time windows, predicts the state at the window
+    boundaries with a cheap coarse propagator, and iteratively corrects the
+    prediction with fine computations that run on all windows in parallel.
+
+    The state passed across a window boundary is the solid surface topography
+    (sstopo), the spectral sea surface (SS), the equivalent sea level (esl),
+    and the history of spectral loads, whose viscous responses continue into
+    later windows.
+
+    NOTE: Worker processes inherit the simulation by forking, so the parallel
+    mode needs a platform that supports the 'fork' start method.
+
+Methods
+-------
+parareal_convolution
+
+"""
+from __future__ import division
+
+import copy
+import time
+import multiprocessing
+
+import numpy as np
+
+from giapy.sle import GiaSimOutput
+
+def parareal_convolution(sim, out_times, nwindows, topo=None, ntrunc=None,
+                            eliter=5, nrem=1, massconerr=1e-2,
+                            coarse_ntrunc=32, coarse_stagetol=1e-2, tol=1e-3,
+                            maxiter=None, nprocs=None, verbose=False):
+    """Compute GiaSimGlobal.performConvolution with parareal time windows.
+
+    Parameters
+    ----------
+    sim : <giapy.sle.GiaSimGlobal>
+    out_times : array
+        The times at which to output the computation.
+    nwindows : int
+        The number of time windows into which the ice stages are split.
+    topo : array
+        Initial solid surface topography (default sim.topo, must be given).
+    ntrunc, eliter, nrem, massconerr : see GiaSimGlobal.performConvolution,
+        used for the fine propagator.
+    coarse_ntrunc : int
+        The spherical harmonic truncation of the coarse propagator (default
+        32). The coarse propagator computes no elastic iterations.
+    coarse_stagetol : float
+        The stage-merging tolerance of the coarse propagator (default 1e-2,
+        see IceHistory.coarsenStages). If None, stages are not merged.
+    tol : float
+        The relative change in boundary states between iterations below which
+        the iteration has converged (default 1e-3).
+    maxiter : int
+        The maximum number of parareal iterations (default nwindows, after
+        which the result is exact).
+    nprocs : int
+        The number of worker processes for the fine propagator (default
+        number of cpus). If 1, the fine propagator runs in this process.
+    verbose : boolean
+        Print the convergence at each iteration and the final report.
+
+    Returns
+    -------
+    observerDict : GiaSimOutput
+        The stitched output of the windows. Its pararealReport is a dictionary
+        with the number of iterations, the boundary-state change at each
+        iteration, the wall time, the summed fine-propagator time (an estimate
+        of the serial cost), and their ratio, the speedup.
+    """
+    tstart = time.time()
+
+    topo = sim.topo if topo is None else topo
+    assert topo is not None, 'parareal is only needed with topography'
+
+    ice = sim.ice
+    out_times = np.asarray(out_times)
+
+    # Split the stages into windows sharing their boundary stages.
+    bounds = np.unique(np.linspace(0, len(ice.times)-1,
+                                    nwindows+1).astype(int))
+    nwindows = len(bounds) - 1
+    maxiter = maxiter or nwindows
+    windows = [_window(ice, i0, i1) for i0, i1 in zip(bounds[:-1], bounds[1:])]
+    wtimes = [out_times[(out_times <= w.times[0])*(out_times >= w.times[-1])]
+                for w in windows]
+
+    fine = dict(ntrunc=ntrunc, eliter=eliter, nrem=nrem, massconerr=massconerr)
+    coarse = dict(ntrunc=coarse_ntrunc, eliter=0, nrem=1,
+                    massconerr=massconerr, stagetol=coarse_stagetol)
+
+    # Initial prediction by the coarse propagator.
+    states = [(topo, None, 0., {})]
+    coarseStates = []
+    for k in range(nwindows):
+        g, _ = _propagate(sim, windows[k], wtimes[k], states[k], **coarse)
+        coarseStates.append(g)
+        states.append(g)
+
+    if nprocs == 1:
+        _init_worker(sim)
+        mapper = map
+    else:
+        pool = multiprocessing.Pool(nprocs, initializer=_init_worker,
+                                        initargs=(sim,))
+        mapper = pool.map
+
+    fineStates = [None]*nwindows
+    outs = [None]*nwindows
+    tfine = np.zeros(nwindows)
+    errs = []
+
+    try:
+        for it in range(1, maxiter+1):
+            # The first it-1 windows start from exact states and are done.
+            todo = range(it-1, nwindows)
+            results = mapper(_fine_worker, [(bounds[k], bounds[k+1], wtimes[k],
+                                                states[k], fine) for k in todo])
+            for k, (f, out, dt) in zip(todo, results):
+                fineStates[k], outs[k], tfine[k] = f, out, dt
+                outs[k].inputs = sim
+                outs[k].harmTrans = sim.harmTrans
+
+            # Sequential coarse correction of the boundary states.
+            err = 0.
+            for k in todo:
+                if k == it-1:
+                    new = fineStates[k]
+                else:
+                    g, _ = _propagate(sim, windows[k], wtimes[k], states[k],
+                                            **coarse)
+                    new = _lincomb((1, g), (1, fineStates[k]),
+                                    (-1, coarseStates[k]))
+                    coarseStates[k] = g
+                err = max(err, _distance(new, states[k+1]))
+                states[k+1] = new
+            errs.append(err)
+
+            if verbose:
+                print('Parareal iteration {0}: {1:.3e}'.format(it, err))
+            if err < tol:
+                break
+    finally:
+        if nprocs != 1:
+            pool.close()
+            pool.join()
+
+    observerDict = _stitch(sim, outs)
+
+    wall = time.time() - tstart
+    observerDict.pararealReport = {'iterations' : it,
+                                   'errors'     : errs,
+                                   'wall'       : wall,
+                                   'serial'     : tfine.sum(),
+                                   'speedup'    : tfine.sum()/wall}
+    if verbose:
+        print('{0} parareal iterations, speedup {1:.2f} over serial.'.format(
+                it, tfine.sum()/wall))
+
+    return observerDict
+
+# The simulation used by worker processes, set by _init_worker.
+_SIM = None
+
+def _init_worker(sim):
+    global _SIM
+    _SIM = sim
+
+def _fine_worker(args):
+    """Run the fine propagator on one window, used by parareal_convolution."""
+    i0, i1, out_times, state, kwargs = args
+    t0 = time.time()
+    state, out = _propagate(_SIM, _window(_SIM.ice, i0, i1), out_times, state,
+                                **kwargs)
+    # Don't send the simulation, or the transform and its Legendre tables,
+    # back through the pipe.
+    out.inputs = None
+    out.harmTrans = None
+    return state, out, time.time()-t0
+
+def _window(ice, i0, i1):
+    """Return a (shallow) copy of ice with the stages i0 to i1 (inclusive)."""
+    window = copy.copy(ice)
+    window.times = np.asarray(ice.times)[i0:i1+1]
+    window.stageOrder = np.asarray(ice.stageOrder)[i0:i1+1]
+    return window
+
+def _propagate(sim, window, out_times, state, **kwargs):
+    """Compute window from state, returning the final state and output."""
+    sstopo, ss, esl, loads = state
+    wsim = copy.copy(sim)
+    wsim.ice = window
+    out = wsim.performConvolution(out_times=out_times, topo=sstopo, esl0=esl,
+                                    ss0=ss, loadHistory=loads, keep_loads=True,
+                                    **kwargs)
+    out.inputs = sim
+    newstate = (out['sstopo'].array[-1], out['SS'].array[-1],
+                out['esl'].array[-1],
+                _sumLoads((1, loads), (1, out.loadHistory)))
+    return newstate, out
+
+def _sumLoads(*terms):
+    """Sum (coefficient, load history) pairs, aligning the loads by time."""
+    loads = {}
+    for c, history in terms:
+        for t, spec in history.items():
+            loads[t] = loads.get(t, 0) + c*spec
+    return loads
+
+def _lincomb(*terms):
+    """Sum (coefficient, state) pairs."""
+    sstopo = sum(c*s[0] for c, s in terms)
+    ss = sum(c*s[1] for c, s in terms)
+    esl = sum(c*s[2] for c, s in terms)
+    loads = _sumLoads(*[(c, s[3]) for c, s in terms])
+    return sstopo, ss, esl, loads
+
+def _distance(a, b):
+    """The relative change of the topography, sea surface, and sea level."""
+    rel = lambda x, y: np.abs(x - y).max()/max(np.abs(x).max(), 1e-30)
+    return max(rel(a[0], b[0]), rel(a[1], b[1]), rel(a[2], b[2]))
+
+def _stitch(sim, outs):
+    """Join the outputs of consecutive windows into one GiaSimOutput."""
+    observerDict = GiaSimOutput(sim)
+    for name in outs[0]._observerDict:
+        obs = copy.copy(outs[0][name])
+        times, arrays = [], []
+        for out in outs:
+            o = out[name]
+            # Boundary times are shared by consecutive windows.
+            keep = np.array([t not in times for t in o.outTimes], dtype=bool)
+            times.extend(np.asarray(o.outTimes)[keep])
+            arrays.append(o.array[keep])
+        obs.outTimes = np.array(times)
+        obs.array = np.concatenate(arrays)
+        observerDict.addObserver(name, obs)
+    return observerDict
@@ -0,0 +1,227 @@
+"""
+profiling.py
+Author: Samuel B. Kachuck
+
+    Instrumentation of the load stages of GiaSimGlobal.performConvolution.
+
+    A StageProfiler records, for each load stage, the wall time of each phase
+    of the computation (see PHASES), the number of scipy.optimize.root
+    function evaluations used to find the sea level, the number of elastic
+    iterations and their final relative error, the mass-conservation ratio of
+    the load, and the memory allocated (traced with tracemalloc). The stages
+    are available as a structured array (StageProfiler.table) and can be
+    exported as JSON or as a Chrome trace (chrome://tracing, Perfetto).
+
+        >>> out = sim.performConvolution(out_times, profile=True)
+        >>> out.profile.table()['wall']
+        >>> out.profile.to_chrome_trace('trace.json')
+
+    When profiling is off, performConvolution uses a NullProfiler, whose
+    methods do nothing.
+
+Classes
+-------
+StageProfiler
+NullProfiler
+
+"""
+from __future__ import division
+
+import json
+import time
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import numpy as np
+
+# The phases of a load stage, in order of computation.
+#   ocean     : sea level change from uplift and geoid
+#   ice       : redistribution of ice, accounting for floating ice
+#   elastic   : iteration of the elastic response to the stage's load
+#   observers : load-stage update of the observers
+#   transform : spherical harmonic transform of the load
+#   response  : viscous response of the observers to the load
+PHASES = ('ocean', 'ice', 'elastic', 'observers', 'transform', 'response')
+
+# The columns of StageProfiler.table, other than the phase times (which are
+# named 't_<phase>').
+COLUMNS = [('ta', float), ('tb', float), ('wall', float)] + \
+          [('t_'+phase, float) for phase in PHASES] + \
+          [('root_calls', int), ('root_nfev', int), ('eliter', int),
+           ('elerr', float), ('masscon', float), ('alloc_net', int),
+           ('alloc_peak', int)]
+
+class StageProfiler(object):
+    """Record the cost of each load stage of performConvolution.
+
+    Parameters
+    ----------
+    memory : boolean
+        Trace memory allocations with tracemalloc (default True, ignored on
+        Python 2, which has no tracemalloc). The bytes allocated in a stage
+        are reported as its net change (alloc_net) and its peak above the
+        traced memory at its start (alloc_peak; before Python 3.9, which
+        cannot reset the peak, the peak since tracing started). Tracing
+        slows the allocation of Python objects, not the numerical work.
+
+    Methods
+    -------
+    start, stop : begin and end the profiled computation.
+    beginStage, endStage : begin and end a load stage.
+    mark : end a phase of the current stage.
+    record : store values of the current stage (e.g., eliter, masscon).
+    table : the stages as a numpy structured array.
+    summary : the total time of each phase.
+    to_json, to_chrome_trace : export the stages.
+
+    Data
+    ----
+    stages : list of dicts, one per stage, keyed by the names of COLUMNS.
+    events : list of (name, start, duration) of stages and phases, in seconds
+        from the start.
+    stats : dict of counters for the current stage, passed to the sea level
+        functions of giapy.map_tools.
+    """
+    enabled = True
+
+    def __init__(self, memory=True):
+        self.memory = memory and tracemalloc is not None
+        self.stages = []
+        self.events = []
+        self.stats = None
+        self.wall = None
+        self._tracing = False
+        self._t0 = None
+
+    def start(self):
+        """Start the clock and, if memory is True, tracemalloc."""
+        self._t0 = time.perf_counter()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def stop(self):
+        """Stop the clock and tracemalloc, if started by this profiler."""
+        self.wall = time.perf_counter() - self._t0
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def beginStage(self, ta, tb):
+        """Begin the load stage from ta to tb."""
+        now = time.perf_counter()
+        self._stage = dict(ta=ta, tb=tb, root_calls=0, root_nfev=0, eliter=0,
+                            elerr=np.nan, masscon=np.nan, alloc_net=0,
+                            alloc_peak=0)
+        for phase in PHASES:
+            self._stage['t_'+phase] = 0.
+        self.stats = self._stage
+        self._tstage = self._tlast = now
+        if self.memory and tracemalloc.is_tracing():
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._mem0 = tracemalloc.get_traced_memory()[0]
+
+    def mark(self, phase):
+        """End phase (one of PHASES) of the current stage, which began at the
+        end of the previous phase (or of the stage)."""
+        now = time.perf_counter()
+        self._stage['t_'+phase] += now - self._tlast
+        self.events.append((phase, self._tlast-self._t0, now-self._tlast))
+        self._tlast = now
+
+    def record(self, **values):
+        """Store values (keyed by COLUMNS) for the current stage."""
+        self._stage.update(values)
+
+    def endStage(self):
+        """End the current stage."""
+        now = time.perf_counter()
+        stage = self._stage
+        stage['wall'] = now - self._tstage
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            stage['alloc_net'] = current - self._mem0
+            stage['alloc_peak'] = peak - self._mem0
+        self.events.append(('stage', self._tstage-self._t0, stage['wall']))
+        self.stages.append(stage)
+        self.stats = None
+
+    def table(self):
+        """Return the stages as a structured array with fields COLUMNS."""
+        table = np.zeros(len(self.stages), dtype=COLUMNS)
+        for i, stage in enumerate(self.stages):
+            for name, _ in COLUMNS:
+                table[name][i] = stage[name]
+        return table
+
+    def summary(self):
+        """Return a dict of the total time of each phase, the time of all
+        stages, and the wall time of the computation."""
+        table = self.table()
+        summary = dict((phase, table['t_'+phase].sum()) for phase in PHASES)
+        summary['stages'] = table['wall'].sum()
+        summary['wall'] = self.wall
+        return summary
+
+    def to_json(self, fname=None):
+        """Return (or write to fname) the stages and summary as JSON."""
+        stages = [dict((name, _jsonable(stage[name])) for name, _ in COLUMNS)
+                    for stage in self.stages]
+        summary = dict((k, _jsonable(v)) for k, v in self.summary().items())
+        return _dump({'columns': [name for name, _ in COLUMNS],
+                      'stages': stages, 'summary': summary}, fname)
+
+    def to_chrome_trace(self, fname=None):
+        """Return (or write to fname) the stages and their phases in the
+        Chrome trace event format, with the stage values as arguments."""
+        stages = iter(self.stages)
+        events = []
+        for name, start, dur in self.events:
+            event = {'name': name, 'cat': 'phase', 'ph': 'X', 'pid': 0,
+                     'tid': 0, 'ts': start*1e6, 'dur': dur*1e6}
+            if name == 'stage':
+                stage = next(stages)
+                event['cat'] = 'stage'
+                event['args'] = dict((k, _jsonable(stage[k]))
+                                        for k, _ in COLUMNS)
+            events.append(event)
+        return _dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fname)
+
+class NullProfiler(object):
+    """A StageProfiler that records nothing, used when profiling is off."""
+    enabled = False
+    stats = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def beginStage(self, ta, tb):
+        pass
+
+    def mark(self, phase):
+        pass
+
+    def record(self, **values):
+        pass
+
+    def endStage(self):
+        pass
+
+def _jsonable(value):
+    """Convert numpy scalars to Python, and nan to None."""
+    value = value.item() if hasattr(value, 'item') else value
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+def _dump(obj, fname):
+    if fname is None:
+        return json.dumps(obj)
+    with open(fname, 'w') as f:
+        json.dump(obj, f)
@@ -10,6 +10,7 @@ Date  : 08 01 2015
 Methods
 -------
 configure_giasim
+precision_deviation
 
 Classes
 -------
@@ -19,22 +20,31 @@ GiaSimOutput
 """
 from __future__ import division
 
+import copy
+
 import numpy as np
-import spharm
+try:
+    import spharm
+except ImportError:
+    from giapy import spharmt as spharm
 import subprocess
 try:
     from progressbar import ProgressBar, Percentage, Bar, ETA
 except:
     pass
 
-from giapy.map_tools import GridObject, sealevelChangeByMelt,\
+from giapy.harm_tools import get_transform, get_batch_transform
+from giapy.numTools.timeindex import TimeIndex
+from giapy.profiling import StageProfiler, NullProfiler
+from giapy.map_tools import GridObject, regrid, sealevelChangeByMelt,\
                     volumeChangeLoad, sealevelChangeByUplift, oceanUpliftLoad,\
                     floatingIceRedistribute
 
-from giapy import GITVERSION, timestamp, MODPATH, call, os
+from giapy import get_gitversion, timestamp, MODPATH, os
 
 class GiaSimGlobal(object):
-    def __init__(self, earth, ice, grid=None, topo=None):
+    def __init__(self, earth, ice, grid=None, topo=None, legfunc=None,
+                    engine=None, gridtype='regular', gaussShape=None):
         """
         Compute glacial isostatic adjustment on a globe.
 
@@ -44,6 +54,20 @@ class GiaSimGlobal(object):
         ice   : <giapy.code.icehistory.IceHistory / PersistentIceHistory>
         grid  : <giapy.code.map_tools.GridObject>
         topo  : numpy.ndarray
+        legfunc : 'stored', 'computed', or None
+            Legendre function policy of the harmonic transform. If None
+            (default), chosen by giapy.harm_tools.choose_legfunc.
+        engine : 'spharm', 'numpy', or None
+            The harmonic transform, spharm (SPHEREPACK) or the pure NumPy
+            giapy.spharmt. If None (default), spharm if it is installed.
+        gridtype : 'regular' or 'gaussian'
+            The grid of the computation. With 'gaussian', the ice history and
+            topography (given on grid, the input grid) are conservatively
+            regridded onto a Gaussian grid, which integrates exactly with half
+            the latitudes. Default 'regular', the input grid.
+        gaussShape : tuple
+            The (nlat, nlon) of the Gaussian grid. Default is half the
+            latitudes of the input grid, and twice as many longitudes.
 
         Methods
         -------
@@ -55,7 +79,6 @@ class GiaSimGlobal(object):
         self.earth = earth
 
         self.ice = ice
-        self.nlat, self.nlon = ice.shape
         
         # The grid used is a cylindrical projection (equispaced lat/lon grid
         # unless otherwise specified)
@@ -66,13 +89,62 @@ class GiaSimGlobal(object):
                                     shape=ice.shape)
 
         self.topo = topo
+
+        # On a Gaussian grid, the inputs are regridded once, here.
+        self.gridtype = gridtype
+        self.engine = engine
+        self.inputGrid = self.grid
+        if gridtype == 'gaussian':
+            if gaussShape is None:
+                nlatg = (ice.shape[0]+1)//2
+                gaussShape = (nlatg, 2*nlatg)
+            self.grid = GridObject(mapparam={'projection': 'cyl'},
+                                    shape=gaussShape, gridtype='gaussian')
+            self.ice = ice.regrid(self.inputGrid, self.grid)
+            self.topo = self.toSimGrid(topo)
+        elif gridtype != 'regular':
+            raise ValueError('gridtype {} not supported.'.format(gridtype))
+
+        self.nlat, self.nlon = self.ice.shape
         
-        # Precompute and store harmonic transform coefficients, for
-        # computational efficiency, but at a memory cost.
-        self.harmTrans = spharm.Spharmt(self.nlon, self.nlat, legfunc='stored')
+        # Harmonic transforms are shared by all simulations on the same grid.
+        # Legendre functions are precomputed and stored, for computational
+        # efficiency, if they fit in the memory budget (see harm_tools).
+        self.harmTrans = get_transform(self.nlon, self.nlat, gridtype=gridtype,
+                                        legfunc=legfunc, engine=engine)
+
+    def toSimGrid(self, array):
+        """Regrid array(s) from the input grid to the grid of the
+        computation, if they differ (gridtype='gaussian')."""
+        if array is None or self.grid is self.inputGrid or \
+                np.shape(array)[-2:] != self.inputGrid.shape:
+            return array
+        return regrid(array, self.inputGrid, self.grid)
+
+    def regridOutput(self, observerDict):
+        """Regrid the gridded observers of a computation on a Gaussian grid
+        to the input grid.
+
+        Spectral observers are independent of the grid; the output's
+        transforms are switched to the input grid, so that they are
+        synthesized there by transformObservers.
+        """
+        if self.grid is self.inputGrid:
+            return observerDict
+        for obs in observerDict:
+            if isinstance(obs, HeightObserver):
+                obs.array = regrid(obs.array, self.grid, self.inputGrid)
+        nlat, nlon = self.inputGrid.shape
+        observerDict.setGrid(nlon, nlat, 'regular', 
+                                get_transform(nlon, nlat, engine=self.engine))
+        return observerDict
 
     def performConvolution(self, out_times=None, ntrunc=None, topo=None,
-                            verbose=False, eliter=5, nrem=1, massconerr=1e-2):  
+                            verbose=False, eliter=5, nrem=1, massconerr=1e-2,
+                            stagetol=None, stagenorm='mass', esl0=0,
+                            ss0=None, loadHistory=None, keep_loads=False,
+                            regrid_output=False, observers=None,
+                            precision='double', profile=False):  
         """Convolve an ice load and an earth response model in fft space.
         Calculate the uplift associated with stored earth and ice model.
         
@@ -96,6 +168,49 @@ class GiaSimGlobal(object):
         nrem   : int
             Number of removal stages between the provided ice stages
             (intermediate steps are interpolated linearly). Default 1.
+        stagetol : float
+            If set, consecutive ice stages whose accumulated change is below
+            stagetol (relative to the total change) are merged before the
+            computation, never across an output time. See
+            IceHistory.coarsenStages. Default None (no merging).
+        stagenorm : 'mass' or 'spectral'
+            The measure of load change used by stagetol. Default 'mass'.
+        esl0   : float
+            The equivalent sea level at the first ice stage. Default 0.
+        ss0    : array
+            The spectral sea surface at the first ice stage, overwriting the
+            value accumulated from loadHistory. Default None.
+        loadHistory : dict
+            Spectral loads (already multiplied by the water density), keyed by
+            the time they were applied, from before the first ice stage. Their
+            viscous responses are added to all outputs. Default None.
+        keep_loads : boolean
+            Store the spectral loads applied in this computation, in the format
+            of loadHistory, as the output's loadHistory. Default False.
+        regrid_output : boolean
+            On a Gaussian grid, regrid the output to the input grid (see
+            regridOutput). Default False.
+        observers : dict
+            Spherical harmonic truncations of individual output observers
+            ('upl', 'hor', 'vel', 'geo', 'grav'), e.g., {'geo': 90}. These
+            observers store and update only the coefficients up to their
+            truncation (capped at ntrunc). Others are stored at the full
+            resolution of the grid. Default None.
+        precision : 'double' or 'single'
+            With 'single', the observers, the stored load history and the ice
+            stages are kept in single precision (complex64 / float32), halving
+            their memory. The responses are computed, and the sea level found,
+            in double precision, so that the outputs deviate from double
+            precision by about the single precision resolution, relative 1e-7
+            to the largest value, and by up to 1e-4 where the ocean function
+            differs (e.g., the water load at coasts). See
+            precision_deviation. Default 'double'.
+        profile : boolean or <giapy.profiling.StageProfiler>
+            If True (or a StageProfiler), record the wall time of each phase
+            of each load stage, the root-finding evaluations, elastic
+            iterations, mass conservation and memory allocated, as the
+            output's profile (exportable as JSON or a Chrome trace). Default
+            False.
        
         Results
         -------
@@ -116,8 +231,24 @@ class GiaSimGlobal(object):
         earth = self.earth
         ice = self.ice
         grid = self.grid
+
+        if profile is True:
+            prof = StageProfiler()
+        elif profile:
+            prof = profile
+        else:
+            prof = NullProfiler()
+        prof.start()
+
+        if precision == 'single':
+            fdtype, cdtype = np.float32, np.complex64
+        elif precision == 'double':
+            fdtype, cdtype = np.float64, np.complex128
+        else:
+            raise ValueError('precision {} not supported.'.format(precision))
         if topo is None and self.topo is not None:
             topo = self.topo
+        topo = self.toSimGrid(topo)
         if topo is not None:
             assert topo.shape == ice.shape, 'Topo and Ice must have the same shape'
 
@@ -136,6 +267,13 @@ class GiaSimGlobal(object):
             out_times = out_times
         self.out_times = out_times
         assert out_times is not None, 'out_times is not set'
+
+        # Merge stages with negligible load changes.
+        if stagetol is not None:
+            ice = ice.coarsenStages(stagetol, grid=grid,
+                                    harmTrans=self.harmTrans,
+                                    out_times=out_times, norm=stagenorm,
+                                    verbose=verbose)
         
         # Calculate times of intermediate removal stages.
         diffs = np.diff(ice.times)
@@ -148,12 +286,43 @@ class GiaSimGlobal(object):
 
         # Initialize output observer         
         observerDict = initialize_output(self, out_times, calcTimes, ice.nlat-1, 
-                                            ntrunc, ns, ice.shape) 
+                                            ntrunc, ns, ice.shape, observers,
+                                            fdtype, cdtype)
+
+        if stagetol is not None:
+            observerDict.coarseningReport = ice.coarseningReport
+        if prof.enabled:
+            observerDict.profile = prof
+
+        if getattr(ice, 'stageArray', None) is not None and \
+                ice.stageArray.dtype != fdtype:
+            ice = copy.copy(ice)
+            ice.stageArray = ice.stageArray.astype(fdtype)
 
         for o in observerDict:
             o.loadStageUpdate(ice.times[0], sstopo=topo)
 
-        esl = 0                 # Equivalent sea level assumed to start at 0.
+        # The index of each calculation time in each observer (-1 if absent),
+        # so that the response stage needs no time lookups.
+        observerList = list(observerDict)
+        calcInds = [o.locateTimes(calcTimes) for o in observerList]
+
+        # Add the responses to loads applied before the first stage (e.g., in
+        # a previous time window).
+        if loadHistory is not None:
+            for t_load, loadSpec in loadHistory.items():
+                for k in np.flatnonzero(calcTimes < t_load):
+                    respArray = earth.getResp(t_load-calcTimes[k])
+                    for o, inds in zip(observerList, calcInds):
+                        if inds[k] >= 0:
+                            o.respStageUpdate(calcTimes[k], respArray,
+                                                loadSpec, n=inds[k])
+        if ss0 is not None:
+            observerDict['SS'].array[0] = ss0
+        if keep_loads:
+            observerDict.loadHistory = {}
+
+        esl = esl0              # Equivalent sea level, 0 unless continuing.
 
         elRespArray = earth.getResp(0.)
         ssResp = np.zeros_like(ns) 
@@ -162,6 +331,7 @@ class GiaSimGlobal(object):
         # Convolve each ice stage to the each output time.
         # Primary loop: over ice load changes.
         for icea, ta, iceb, tb in ice.pairIter():
+            prof.beginStage(ta, tb)
             ################### LOAD STAGE CALCULATION ###################
             # Determine the water load redistribution for ice, uplift, and
             # geoid changes between ta and tb,
@@ -169,13 +339,14 @@ class GiaSimGlobal(object):
                 # Get index for starting time.
                 nta = observerDict['SS'].locateByTime(ta)
                 # Collect the solid-surface topography at beginning of step.
-                Ta = observerDict['sstopo'].array[nta]
+                # (The sea level is always found in double precision.)
+                Ta = observerDict['sstopo'].array[nta].astype(float)
 
                 # Redistribute the ocean by change in ocean floor / surface.
-                ssa, ssb = observerDict['SS'].array[[nta, nta+1]] 
+                ssa, ssb = observerDict['SS'].array[[nta, nta+1]].astype(complex)
                 dSS = self.harmTrans.spectogrd(ssb-ssa)
                 dhwBarU = sealevelChangeByUplift(dSS, Ta+DENICE/DENSEA*icea, 
-                                                        grid)
+                                                        grid, prof.stats)
                 dhwU = oceanUpliftLoad(dhwBarU, Ta+DENICE/DENSEA*icea, dSS)
 
                 # Update the solid-surface topography with uplift / geoid.
@@ -183,16 +354,19 @@ class GiaSimGlobal(object):
                 esl += dhwBarU
                 dLoad = dhwU.copy()
                 dwLoad = dhwU.copy()                # Save the water load
+                prof.mark('ocean')
 
                 # Redistribute ice, consistent with current floating ice. 
                 dILoad, dhwBarI = floatingIceRedistribute(icea, iceb, Tb, grid,
-                                                            DENICE/DENSEA)
+                                                            DENICE/DENSEA,
+                                                            prof.stats)
 
                 # Combine loads from ocean changes and ice volume changes.
                 dLoad += dILoad
                 esl += dhwBarI
                 dwLoad += volumeChangeLoad(dhwBarI, Tb+DENICE/DENSEA*iceb)
                 Tb -= dhwBarI
+                prof.mark('ice')
                 
 
                 # Calculate instantaneous (elastic and gravity) responses to
@@ -206,7 +380,8 @@ class GiaSimGlobal(object):
                                 self.harmTrans.grdtospec(dLoad)) 
 
                     dhwBarUel = sealevelChangeByUplift(dSSel, 
-                                                        Tb+DENICE/DENSEA*iceb, grid)
+                                                        Tb+DENICE/DENSEA*iceb, grid,
+                                                        prof.stats)
                     dhwUel = oceanUpliftLoad(dhwBarUel, 
                                                 Tb+DENICE/DENSEA*iceb, dSSel)
 
@@ -225,7 +400,8 @@ class GiaSimGlobal(object):
                      
 
                         dhwBarUel = sealevelChangeByUplift(dSSelp, 
-                                                            Tb+DENICE/DENSEA*iceb, grid)
+                                                            Tb+DENICE/DENSEA*iceb, grid,
+                                                            prof.stats)
                         dhwUel = oceanUpliftLoad(dhwBarUel, 
                                                     Tb+DENICE/DENSEA*iceb, dSSelp)
 
@@ -244,13 +420,17 @@ class GiaSimGlobal(object):
                        
                             continue
 
-                observerDict['SS'].array[nta+1] += self.harmTrans.grdtospec(dSSel) 
+                    observerDict['SS'].array[nta+1] += \
+                                            self.harmTrans.grdtospec(dSSel) 
+                    prof.record(eliter=i+1, elerr=err)
+                    prof.mark('elastic')
 
                 for o in observerDict:
                     # Topography and load for time tb are updated and saved.
                     o.loadStageUpdate(tb, dLoad=dLoad, 
                                       topo=Tb+iceb*(Tb + DENICE/DENSEA*iceb>=0), 
                                       esl=esl, dwLoad=dwLoad, sstopo=Tb)
+                prof.mark('observers')
 
             else:
                 dLoad = (iceb-icea)*DENICE/DENSEA
@@ -259,6 +439,7 @@ class GiaSimGlobal(object):
                 for o in observerDict:
                     # Topography and load for time tb are updated and saved.
                     o.loadStageUpdate(tb, dLoad=dLoad)
+                prof.mark('observers')
 
             # Transform load change into spherical harmonics.
             loadChangeSpec = self.harmTrans.grdtospec(dLoad)/NREM
@@ -270,22 +451,198 @@ class GiaSimGlobal(object):
                                                                 massConCheck))
             # N.B. the n=0 load should be zero in cases of glacial isostasy, as 
             # mass is conserved during redistribution.
+            prof.record(masscon=massConCheck)
+            prof.mark('transform')
 
             ################# RESPONSE STAGE CALCULATION #################
             # Secondary loop: over output times.
             for inter_time in np.linspace(tb, ta, NREM, endpoint=False)[::-1]:
+                if keep_loads:
+                    observerDict.loadHistory[inter_time] = \
+                        (observerDict.loadHistory.get(inter_time, 0) + \
+                        DENSEA*loadChangeSpec).astype(cdtype)
                 # Perform the time convolution for each output time
-                for t_out in calcTimes[calcTimes < inter_time]:
-                    respArray = earth.getResp(inter_time-t_out)
-                    for o in observerDict:
-                        o.respStageUpdate(t_out, respArray, 
-                                            DENSEA*loadChangeSpec) 
+                for k in np.flatnonzero(calcTimes < inter_time):
+                    respArray = earth.getResp(inter_time-calcTimes[k])
+                    for o, inds in zip(observerList, calcInds):
+                        if inds[k] >= 0:
+                            o.respStageUpdate(calcTimes[k], respArray, 
+                                                DENSEA*loadChangeSpec,
+                                                n=inds[k])
+            prof.mark('response')
+            prof.endStage()
 
         # Don't keep the intermediate uplift stages for water redistribution
         #observerDict.removeObserver('eslUpl', 'eslGeo') 
 
+        if regrid_output:
+            self.regridOutput(observerDict)
+
+        prof.stop()
+
         return observerDict
 
+    def solveInitialTopography(self, topo, out_times=None, levels=None,
+                                tol=1e-2, maxiter=10, eliter=20, nrem=1,
+                                beta=0.5, mmix=3, verbose=False):
+        """Find the initial topography that evolves into the topography topo.
+
+        The computation is iterated, shifting the initial topography by the
+        misfit of the final solid surface topography. Early iterations use the
+        cheaper computations in levels, later ones the full resolution, and
+        the shifts are accelerated by Anderson mixing. Whenever the misfit
+        grows, the mixing is restarted from the latest iterate, and a mixed
+        step to a topography whose misfit is not finite is retaken as a plain
+        shift.
+
+        Parameters
+        ----------
+        topo : array
+            The solid surface topography at the final ice stage (present day).
+        out_times : array
+            Output times for performConvolution (default self.out_times).
+        levels : list of (ntrunc, stagetol) pairs
+            The resolution and stage merging (see performConvolution) of
+            successive levels. Each level is iterated until the misfit is
+            below tol, then the next is started from its result. The returned
+            computation is at the last level. Default is [(32, 1e-2), 
+            (64, 1e-3), (None, None)], the last being the full resolution and
+            all stages. Truncations beyond the earth model or the grid are
+            the full resolution.
+        tol : float
+            The area-averaged absolute misfit (m) of the final topography at
+            which a level has converged (default 1e-2).
+        maxiter : int
+            The maximum total number of iterations (default 10).
+        eliter, nrem : see performConvolution.
+        beta : float
+            The fraction of the misfit by which the topography is shifted
+            (default 0.5), also the mixing parameter of Anderson mixing.
+        mmix : int
+            The number of previous iterations used in Anderson mixing (default
+            3). If 0, the iteration is simple relaxation.
+        verbose : boolean
+            Print the misfit at each iteration.
+
+        Returns
+        -------
+        topo0 : array
+            The initial topography, on the grid of the computation.
+        observerDict : GiaSimOutput
+            The computation at the last level from topo0.
+        """
+        levels = levels or [(32, 1e-2), (64, 1e-3), (None, None)]
+        # Levels beyond the earth model or the grid are at full resolution.
+        nfull = min(self.earth.nmax, self.ice.nlat-1)
+        levels = [(None if ntrunc is None or ntrunc >= nfull else ntrunc,
+                    stagetol) for ntrunc, stagetol in levels]
+        topo = self.toSimGrid(topo)
+
+        area = self.grid.integrate(np.ones(self.ice.shape))
+        topo0 = topo.copy()
+        it = 0
+        for ntrunc, stagetol in levels:
+            # The mixing history is reset at each level.
+            xs, rs = [], []
+            errprev = np.inf
+            while True:
+                observerDict = self.performConvolution(out_times=out_times,
+                                    ntrunc=ntrunc, topo=topo0, eliter=eliter,
+                                    nrem=nrem, stagetol=stagetol)
+                dtopo = observerDict['sstopo'].array[-1] - topo
+                err = self.grid.integrate(np.abs(dtopo))/area
+                if verbose:
+                    print('Error at iter {0} (ntrunc={1}): {2}'.format(it, 
+                                                                ntrunc, err))
+                it += 1
+                if err < tol or it >= maxiter:
+                    break
+                if not np.isfinite(err):
+                    if not xs:
+                        raise ValueError('The misfit of topography is not '
+                                            'finite at iter {}.'.format(it-1))
+                    # The mixed step failed: retake the last step plainly.
+                    topo0 = xs[-1] - beta*rs[-1]
+                    xs, rs = [], []
+                    continue
+                if err >= errprev:
+                    # The misfit grew: restart the mixing from this iterate.
+                    xs, rs = [], []
+                errprev = err
+                xs.append(topo0.copy())
+                rs.append(dtopo)
+                xs, rs = xs[-(mmix+1):], rs[-(mmix+1):]
+                topo0 = _anderson_step(xs, rs, beta)
+            if it >= maxiter:
+                break
+
+        if (ntrunc, stagetol) != tuple(levels[-1]):
+            # Make sure the returned computation is at the final level.
+            observerDict = self.performConvolution(out_times=out_times,
+                                    ntrunc=levels[-1][0], topo=topo0,
+                                    eliter=eliter, nrem=nrem,
+                                    stagetol=levels[-1][1])
+
+        return topo0, observerDict
+
+def precision_deviation(sim, verbose=False, **kwargs):
+    """Compare a single precision computation to a double precision one.
+
+    Parameters
+    ----------
+    sim : <GiaSimGlobal>
+    verbose : boolean
+        Print the deviations.
+    **kwargs : passed to sim.performConvolution for both computations.
+
+    Returns
+    -------
+    deviations : dict
+        For each observer, the maximum absolute deviation of the single from
+        the double precision result (on the grid) and its ratio to the largest
+        absolute value of the double precision result.
+    """
+    kwargs.pop('precision', None)
+    double = sim.performConvolution(precision='double', **kwargs)
+    single = sim.performConvolution(precision='single', **kwargs)
+    double.transformObservers()
+    single.transformObservers()
+
+    deviations = {}
+    for name in double._observerDict:
+        a = np.asarray(double[name].array)
+        b = np.asarray(single[name].array, dtype=a.dtype)
+        dev = np.abs(b - a).max() if a.size else 0.
+        scale = np.abs(a).max() if a.size else 0.
+        deviations[name] = (dev, dev/scale if scale else 0.)
+        if verbose:
+            print('{0:>8}: max deviation {1:.3e} (relative {2:.3e})'.format(
+                    name, *deviations[name]))
+    return deviations
+
+def _anderson_step(xs, rs, beta):
+    """Return the next iterate x - beta*r, accelerated by Anderson mixing.
+
+    Parameters
+    ----------
+    xs, rs : lists of previous iterates and their residuals (latest last).
+    beta : float, the mixing parameter.
+    """
+    x, r = xs[-1], rs[-1]
+    if len(xs) == 1:
+        return x - beta*r
+    # Differences of iterates and residuals, as columns.
+    dX = np.array([(xs[i+1]-xs[i]).ravel() for i in range(len(xs)-1)]).T
+    dR = np.array([(rs[i+1]-rs[i]).ravel() for i in range(len(rs)-1)]).T
+    if not (np.all(np.isfinite(dX)) and np.all(np.isfinite(dR))):
+        return x - beta*r
+    try:
+        gamma = np.linalg.lstsq(dR, r.ravel(), rcond=None)[0]
+    except np.linalg.LinAlgError:
+        return x - beta*r
+    xnew = x.ravel() - beta*r.ravel() - (dX - beta*dR).dot(gamma)
+    return xnew.reshape(x.shape)
+
 def configure_giasim(configdict=None):
     """
     Convenience function for setting up a GiaSimGlobal object.
@@ -346,34 +703,47 @@ def configure_giasim(configdict=None):
 
     return sim
 
-def initialize_output(sim, out_times, calcTimes, nmax, ntrunc, ns, shape):
+def initialize_output(sim, out_times, calcTimes, nmax, ntrunc, ns, shape,
+                        truncations=None, fdtype=float, cdtype=complex):
     earth = sim.earth
+    truncations = truncations or {}
+    for name in truncations:
+        if name not in ['upl', 'hor', 'vel', 'geo', 'grav']:
+            raise ValueError('Truncation of observer {} not supported.'.format(
+                                name))
     # Initialize the return object to include...
     # ... values desired at output times
     #   [1] Uplift
-    uplObserver = earth.TotalUpliftObserver(out_times, nmax, ntrunc, ns)
+    uplObserver = earth.TotalUpliftObserver(out_times, nmax, ntrunc, ns,
+                                        truncations.get('upl'), cdtype)
     #   [2] Horizontal deformation
-    horObserver = earth.TotalHorizontalObserver(out_times, nmax, ntrunc, ns)
+    horObserver = earth.TotalHorizontalObserver(out_times, nmax, ntrunc, ns,
+                                        truncations.get('hor'), cdtype)
     #   [3] Uplift velocities
-    velObserver = earth.VelObserver(out_times, nmax, ntrunc, ns)
+    velObserver = earth.VelObserver(out_times, nmax, ntrunc, ns,
+                                        truncations.get('vel'), cdtype)
     #   [4] Geoid perturbations
-    geoObserver = earth.GeoidObserver(out_times, nmax, ntrunc, ns)
+    geoObserver = earth.GeoidObserver(out_times, nmax, ntrunc, ns,
+                                        truncations.get('geo'), cdtype)
     #   [5] Gravitational acceleration perturbations
-    gravObserver = earth.GravObserver(out_times, nmax, ntrunc, ns) 
+    gravObserver = earth.GravObserver(out_times, nmax, ntrunc, ns,
+                                        truncations.get('grav'), cdtype)
 
     # ... and values needed to perform the convolution
     #   [1] Uplift for ocean redistribution
-    SeaSurfaceObserver = earth.SeaSurfaceObserver(calcTimes, nmax, ntrunc, ns)
+    SeaSurfaceObserver = earth.SeaSurfaceObserver(calcTimes, nmax, ntrunc, ns,
+                                                    dtype=cdtype)
     #   [2] Geoid for ocean redistribution
-    eslGeoObserver = earth.GeoidObserver(calcTimes, nmax, ntrunc, ns)
+    eslGeoObserver = earth.GeoidObserver(calcTimes, nmax, ntrunc, ns,
+                                            dtype=cdtype)
     #   [3] Topography (to top of ice) to find floating ice
-    topoObserver = HeightObserver(calcTimes, shape, 'topo')
+    topoObserver = HeightObserver(calcTimes, shape, 'topo', fdtype)
     #   [4] Load (total water + ice load in water equivalent)
-    loadObserver = HeightObserver(calcTimes, shape, 'dLoad')
+    loadObserver = HeightObserver(calcTimes, shape, 'dLoad', fdtype)
     #   [5] Water load
-    wloadObserver = HeightObserver(calcTimes, shape, 'dwLoad') 
+    wloadObserver = HeightObserver(calcTimes, shape, 'dwLoad', fdtype) 
     #   [6] Solid surface topography for ocean redistribution
-    rslObserver = HeightObserver(calcTimes, shape, 'sstopo')
+    rslObserver = HeightObserver(calcTimes, shape, 'sstopo', fdtype)
     #   [7] Eustatic sea level, with average uplift and geoid over oceans.
     eslObserver = EslObserver(calcTimes) 
 
@@ -410,7 +780,8 @@ class GiaSimOutput(object):
     -------
     addObserver - add an observer to the watchlist
     removeObserver - remove an observer from the watchlist
-    transformObservers - transform each observer in the watchlist, using each's
+    transformObservers - transform each observer in the watchlist. Spectral
+        observers are stacked and transformed together, the others use their
         own transform function (must be provided by observer).
 
 
@@ -420,16 +791,24 @@ class GiaSimOutput(object):
     TIMESTAMP : the datetime of creation (calculation)
     """
     def __init__(self, inputs):
-        self.GITVERSION = GITVERSION
+        self.GITVERSION = get_gitversion()
         self.TIMESTAMP = timestamp()
         self.inputs = inputs
         self._observerDict = {}
+        self.setGrid(inputs.nlon, inputs.nlat,
+                        getattr(inputs, 'gridtype', 'regular'), inputs.harmTrans)
+
+    def setGrid(self, nlon, nlat, gridtype, harmTrans):
+        """Set the grid and transform used by transformObservers."""
+        self.nlon, self.nlat = nlon, nlat
+        self.gridtype = gridtype
+        self.harmTrans = harmTrans
 
     def __getitem__(self, key):
         return self._observerDict.__getitem__(key)
 
     def __iter__(self):
-        return self._observerDict.itervalues() 
+        return iter(self._observerDict.values())
 
     def __repr__(self):
         retstr = ''
@@ -446,9 +825,61 @@ class GiaSimOutput(object):
             del self._observerDict[name]
             delattr(self, name)
 
-    def transformObservers(self, inverse=False):
+    def transformObservers(self, inverse=False, batched=None):
+        """Transform the observers to the grid (inverse=False) or to spherical
+        harmonics (inverse=True).
+
+        With batched=True, the spectral observers are stacked and transformed
+        at once with a BatchTransform (see giapy.harm_tools), so that the
+        Legendre transforms are matrix-matrix products. By default, they are
+        batched if the simulation's transform is the NumPy engine (whose
+        transforms are BatchTransforms), and transformed one by one with
+        spharm. The BatchTransform is that of the simulation's transform, or
+        else the shared one with the same Legendre functions (stored or
+        computed, see giapy.harm_tools.choose_legfunc).
+        """
+        if batched is None:
+            batched = getattr(self.harmTrans, 'batch', None) is not None
+        if not batched:
+            for obs in self:
+                obs.transform(self.harmTrans, inverse=inverse)
+            return
+
+        # Stack the observers using the standard spectral transform by array
+        # shape and truncation, so that different truncations are kept apart.
+        stacks = {}
         for obs in self:
-            obs.transform(self.inputs.harmTrans, inverse=inverse)
+            if not _hasSpectralTransform(obs):
+                obs.transform(self.harmTrans, inverse=inverse)
+            elif obs.spectral != inverse:
+                key = (obs.array.shape[1:], getattr(obs, 'truncation', None))
+                stacks.setdefault(key, []).append(obs)
+
+        trans = getattr(self.harmTrans, 'batch', None)
+        if trans is None:
+            trans = get_batch_transform(self.nlon, self.nlat, self.gridtype,
+                                getattr(self.harmTrans, 'legfunc', 'stored'))
+        for (shape, truncation), group in stacks.items():
+            stack = np.concatenate([obs.array for obs in group])
+            single = stack.dtype in [np.complex64, np.float32]
+            if inverse:
+                stack = trans.grdtospec(stack, truncation)
+            else:
+                stack = trans.spectogrd(stack)
+            if single:
+                # Keep the precision of the observers.
+                stack = stack.astype(np.complex64 if inverse else np.float32)
+            splits = np.cumsum([len(obs.array) for obs in group])[:-1]
+            for obs, array in zip(group, np.split(stack, splits)):
+                obs.array = array
+                obs.spectral = inverse
+
+def _hasSpectralTransform(obs):
+    """Whether obs uses AbstractEarthGiaSimObserver.transform."""
+    method = type(obs).transform
+    # Unbind the method in python 2.
+    method = getattr(method, '__func__', method)
+    return method is vars(AbstractEarthGiaSimObserver)['transform']
 
 
 class AbstractGiaSimObserver(object):
@@ -486,10 +917,20 @@ class AbstractGiaSimObserver(object):
     def transform(self, trans, inverse=True):
         pass
 
+    @property
+    def timeIndex(self):
+        """The TimeIndex of outTimes, rebuilt if outTimes is replaced."""
+        timeIndex = getattr(self, '_timeIndex', None)
+        if timeIndex is None or timeIndex.source is not self.outTimes:
+            timeIndex = self._timeIndex = TimeIndex(self.outTimes)
+        return timeIndex
+
     def locateByTime(self, time):
-        if time not in self.outTimes:
-            raise ValueError('time not in self.outTimes')
-        return np.argwhere(self.outTimes == time)[0][0]
+        return self.timeIndex.index(time)
+
+    def locateTimes(self, times):
+        """Return the indices of times in outTimes, -1 where not found."""
+        return self.timeIndex.lookup(times)
 
     def nearest_to(self, time):
         """Return a field from outTimes nearest to time.
@@ -504,35 +945,63 @@ class AbstractEarthGiaSimObserver(AbstractGiaSimObserver):
 
     Must implement isolateRespArray to pull proper response curve from the
     computed earth model.
+
+    Without a truncation, the coefficients up to nmax are stored and those up
+    to ntrunc updated. With a truncation, only the coefficients up to it (and
+    ntrunc) are stored, all of which are updated.
     """
-    def __init__(self, outTimes, nmax, ntrunc, ns):
-        self.initialize(outTimes, nmax, ns)
-        self.npad = (ns <= ntrunc)
-        self.ns = ns[self.npad]
+    def __init__(self, outTimes, nmax, ntrunc, ns, truncation=None,
+                    dtype=complex):
+        if truncation is None:
+            self.initialize(outTimes, nmax, ns, dtype)
+            self.npad = (ns <= ntrunc)
+            self.ns = ns[self.npad]
+        else:
+            truncation = min(truncation, ntrunc)
+            # The stored coefficients, in the order of the full array.
+            self.npad = np.flatnonzero(ns <= truncation)
+            self.initialize(outTimes, truncation, ns[self.npad], dtype)
+        self.truncation = truncation
         self.spectral = True
 
-    def initialize(self, outTimes, ntrunc, ns):
+    def initialize(self, outTimes, ntrunc, ns, dtype=complex):
         self.array = np.zeros((len(outTimes), 
-                               int((ntrunc+1)*(ntrunc+2)/2)), dtype=complex)
+                               int((ntrunc+1)*(ntrunc+2)/2)), dtype=dtype)
         self.outTimes = outTimes
         self.ns = ns
 
     def respStageUpdate(self, *args, **kwargs):
         self.update(*args, **kwargs)
 
-    def update(self, tout, respArray, dLoad):
-        if tout not in self.outTimes:
+    def update(self, tout, respArray, dLoad, n=None):
+        """Add the response to dLoad at time tout, whose index n in outTimes
+        is looked up if not given (n < 0 for times not in outTimes)."""
+        if n is None:
+            n = self.timeIndex.get(tout, -1)
+        if n < 0:
             return
-        n = self.locateByTime(tout)
         resp = self.isolateRespArray(respArray)
-        self.array[n][self.npad] += resp * dLoad[self.npad]
+        if self.truncation is None:
+            self.array[n][self.npad] += resp * dLoad[self.npad]
+        else:
+            self.array[n] += resp * dLoad[self.npad]
 
     def transform(self, trans, inverse=True):
-        if not inverse and self.spectral:
-            self.array = trans.spectogrd(self.array.T).T
+        # Batched transforms take the time axis first, spharm takes it last.
+        if getattr(trans, 'batched', False):
+            if not inverse and self.spectral:
+                self.array = trans.spectogrd(self.array)
+                self.spectral = False
+            elif inverse and not self.spectral:
+                self.array = trans.grdtospec(self.array,
+                                            getattr(self, 'truncation', None))
+                self.spectral = True
+        elif not inverse and self.spectral:
+            self.array = np.moveaxis(trans.spectogrd(self.array.T), -1, 0)
             self.spectral = False
         elif inverse and not self.spectral:
-            self.array = trans.grdtospec(self.array.T).T
+            self.array = trans.grdtospec(np.moveaxis(self.array, 0, -1),
+                                        getattr(self, 'truncation', None)).T
             self.spectral = True
 
     def isolateRespArray(self, respArray):
@@ -543,13 +1012,13 @@ class HeightObserver(AbstractGiaSimObserver):
     """General observer for heights computed on the real-space grid and updated
     during the loadStage.
     """
-    def __init__(self, outTimes, iceShape, name):
-        self.initialize(outTimes, iceShape)
+    def __init__(self, outTimes, iceShape, name, dtype=float):
+        self.initialize(outTimes, iceShape, dtype)
         self.name = name
 
-    def initialize(self, outTimes, iceShape):
+    def initialize(self, outTimes, iceShape, dtype=float):
         self.array = np.zeros((len(outTimes), 
-                                iceShape[0], iceShape[1]))
+                                iceShape[0], iceShape[1]), dtype=dtype)
         self.outTimes = outTimes
 
     def loadStageUpdate(self, tout, **kwargs):
@@ -557,9 +1026,9 @@ class HeightObserver(AbstractGiaSimObserver):
             self.update(tout, kwargs[self.name])
 
     def update(self, tout, load):
-        if tout not in self.outTimes:
+        n = self.timeIndex.get(tout)
+        if n is None:
             return
-        n = self.locateByTime(tout)
         self.array[n] = load
 
 class EslObserver(AbstractGiaSimObserver):
@@ -572,8 +1041,8 @@ class EslObserver(AbstractGiaSimObserver):
             self.update(tout, kwargs['esl'])
 
     def update(self, tout, esl):
-        if tout not in self.outTimes:
+        n = self.timeIndex.get(tout)
+        if n is None:
             return
-        n = self.locateByTime(tout)
         self.array[n] = esl
 
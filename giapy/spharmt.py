@@ -0,0 +1,116 @@
+"""
+spharmt.py
+Author: Samuel B. Kachuck
+
+    A pure NumPy replacement for the parts of spharm (the SPHEREPACK wrappers)
+    used in giapy, with the same interface, conventions and coefficient
+    ordering, so that the module can be used in place of spharm:
+
+        >>> from giapy import spharmt as spharm
+
+    The transforms are numpy.fft.rfft over longitude and matrix products with
+    precomputed associated Legendre functions over latitude (see
+    giapy.harm_tools.BatchTransform), and run in the threads of the BLAS numpy
+    is linked against.
+
+Methods
+-------
+getspecindx
+
+Classes
+-------
+Spharmt
+
+"""
+
+import numpy as np
+
+from giapy.harm_tools import BatchTransform
+
+def getspecindx(ntrunc):
+    """Return the zonal wavenumbers (m) and degrees (n) of the spherical
+    harmonic coefficients for triangular truncation ntrunc, in the order of
+    Spharmt.grdtospec.
+    """
+    indxm = np.concatenate([np.repeat(m, ntrunc+1-m) for m in range(ntrunc+1)])
+    indxn = np.concatenate([np.arange(m, ntrunc+1) for m in range(ntrunc+1)])
+    return indxm, indxn
+
+class Spharmt(object):
+    """Spherical harmonic transforms on a regular or Gaussian grid, with the
+    interface of spharm.Spharmt.
+
+    Grids have shape (nlat, nlon) with latitudes from north to south (regular
+    grids include the poles), coefficients have shape ((ntrunc+1)*(ntrunc+2)/2).
+    Several fields are transformed at once if stacked along a last axis.
+
+    Parameters
+    ----------
+    nlon, nlat : int
+        The number of longitudes and latitudes of the grid.
+    rsphere : float
+        The radius of the sphere (m) for getgrad (default 6.3712e6).
+    gridtype : 'regular' (default) or 'gaussian'
+    legfunc : 'stored' (default) or 'computed'
+        Whether the Legendre functions are precomputed and stored, or
+        recomputed at each transform.
+    batch : <giapy.harm_tools.BatchTransform>
+        An existing batched transform for the grid, whose tables are shared.
+
+    Methods
+    -------
+    grdtospec
+    spectogrd
+    getgrad
+    """
+    batched = False
+
+    def __init__(self, nlon, nlat, rsphere=6.3712e6, gridtype='regular',
+                    legfunc='stored', batch=None):
+        if nlon < 4 or nlat < 3:
+            raise ValueError('nlon must be >= 4 and nlat >= 3')
+        self.nlon = nlon
+        self.nlat = nlat
+        self.rsphere = rsphere
+        self.gridtype = gridtype
+        self.legfunc = legfunc
+        self.batch = batch or BatchTransform(nlon, nlat, gridtype, legfunc)
+
+    def __repr__(self):
+        return ('giapy.spharmt.Spharmt(nlon={0}, nlat={1}, rsphere={2}, '
+                'gridtype={3}, legfunc={4})').format(self.nlon, self.nlat,
+                    self.rsphere, repr(self.gridtype), repr(self.legfunc))
+
+    def grdtospec(self, datagrid, ntrunc=None):
+        """Transform grids (nlat, nlon) or (nlat, nlon, nt) into coefficients
+        (ncoeff) or (ncoeff, nt), triangularly truncated at ntrunc (default
+        nlat-1)."""
+        datagrid = np.asarray(datagrid)
+        if datagrid.shape[:2] != (self.nlat, self.nlon):
+            raise ValueError('grid must be (nlat, nlon) or (nlat, nlon, nt)')
+        if ntrunc is not None and ntrunc > self.nlat-1:
+            raise ValueError('ntrunc must be <= nlat-1')
+        if datagrid.ndim == 2:
+            return self.batch.grdtospec(datagrid, ntrunc)
+        spec = self.batch.grdtospec(np.moveaxis(datagrid, -1, 0), ntrunc)
+        return spec.T
+
+    def spectogrd(self, dataspec):
+        """Transform coefficients (ncoeff) or (ncoeff, nt) into grids
+        (nlat, nlon) or (nlat, nlon, nt)."""
+        dataspec = np.asarray(dataspec)
+        if dataspec.ndim == 1:
+            return self.batch.spectogrd(dataspec)
+        return np.moveaxis(self.batch.spectogrd(dataspec.T), 0, -1)
+
+    def getgrad(self, chispec):
+        """Return the eastward and northward components of the gradient of
+        coefficients (ncoeff) or (ncoeff, nt) on the sphere, as grids (nlat,
+        nlon) or (nlat, nlon, nt)."""
+        chispec = np.asarray(chispec)
+        if chispec.ndim == 1:
+            u, v = self.batch.gradient(chispec)
+        else:
+            u, v = [np.moveaxis(g, 0, -1)
+                        for g in self.batch.gradient(chispec.T)]
+        return u/self.rsphere, v/self.rsphere
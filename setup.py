@@ -1,5 +1,12 @@
+import os
 from setuptools import setup, find_packages
 
+# Optionally compile the numba kernels ahead of time (see giapy.numTools.aot).
+ext_modules = []
+if os.environ.get('GIAPY_AOT', '0') not in ('', '0'):
+    from giapy.numTools.aot import extension
+    ext_modules.append(extension())
+
 setup(name='giapy',
     version='1.0.0',
     description='Compute glacial isostacy in python',
@@ -19,6 +26,7 @@ setup(name='giapy',
     keywords='geophysics deformation isostasy',
     packages=find_packages(),
     include_package_data=True,
+    ext_modules=ext_modules,
     entry_points={
         'console_scripts': ['giapy-ellove=giapy.command_line:ellove',
                             'giapy-velove=giapy.command_line:velove'],
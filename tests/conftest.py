@@ -0,0 +1,87 @@
+"""
+conftest.py
+Author: Samuel B. Kachuck
+
+Fixtures of the tests of the sea level equation: a small grid, with a disk
+of ice growing at a decelerating rate on an earth of two relaxation modes
+per order number, and a continent around the ice on an ocean floor.
+
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+# Processes forked (by the pools of multiprocessing) after numba's parallel
+# kernels have run on its TBB threading layer hang the interpreter at exit.
+os.environ.setdefault('NUMBA_THREADING_LAYER', 'workqueue')
+
+# sle_test.py is the benchmark script of the sea level equation, not tests.
+collect_ignore = ['sle_test.py']
+
+NLAT, NLON = 33, 64
+NMAX = 16
+
+
+def make_earth(nmax=NMAX):
+    """An earth of two relaxation modes (rates 0.2 and 2 /ka) per order
+    number, relaxing from elastic to fluid Love numbers."""
+    from giapy.earth_tools.earthSphericalLap import SphericalEarth
+    ns = np.arange(1, nmax+1)
+    hLke = np.c_[-0.5*np.ones(nmax), -0.1*np.ones(nmax), -0.3/ns]
+    hLkf = np.c_[-(2*ns+1)/3., -np.ones(nmax), -np.ones(nmax)]
+    modes = np.zeros((nmax, 2, 4))
+    modes[:,:,0] = [-0.2, -2.]
+    modes[:,0,1:] = 0.7*(hLkf - hLke)
+    modes[:,1,1:] = 0.3*(hLkf - hLke)
+    earth = SphericalEarth()
+    earth._storeModes(ns, hLke, modes)
+    return earth
+
+
+def make_ice(nstages=41, h0=1500.):
+    """A disk of ice growing from 10 ka, at a rate decreasing to 0 at 0 ka."""
+    from giapy.icehistory import PersistentIceHistory
+    Lons, Lats = np.meshgrid(np.linspace(-np.pi, np.pi, NLON),
+                             np.linspace(-np.pi/2, np.pi/2, NLAT))
+    times = np.linspace(10, 0, nstages)
+    load = h0*(1 - (times/10.)**2)[:,None,None]*_disk(Lons, Lats, 15)
+    metadata = {'Lon'               : Lons,
+                'Lat'               : Lats,
+                'nlat'              : NLAT,
+                'shape'             : Lons.shape,
+                '_alterationMask'   : np.zeros_like(Lats),
+                'areaProps'         : {},
+                'areaVerts'         : {},
+                'times'             : times,
+                'stageOrder'        : list(range(nstages)),
+                'path'              : '',
+                'fnames'            : ['','']}
+    return PersistentIceHistory(load, metadata)
+
+
+def make_topo(ice):
+    """A continent of 500 m under and around the ice, on a 2000 m deep
+    ocean floor."""
+    return -2000. + 2500.*_disk(ice.Lon, ice.Lat, 25)
+
+
+def _disk(Lons, Lats, radius):
+    """1 within radius (degrees) of (0, 0), 0 outside."""
+    return (np.cos(Lats)*np.cos(Lons) > np.cos(np.radians(radius))).astype(float)
+
+
+@pytest.fixture
+def sle():
+    return pytest.importorskip('giapy.sle')
+
+
+@pytest.fixture
+def earth():
+    return make_earth()
+
+
+@pytest.fixture
+def ice():
+    return make_ice()
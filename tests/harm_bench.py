@@ -0,0 +1,87 @@
+"""
+harm_bench.py
+Author: Samuel B. Kachuck
+
+Benchmark the pure NumPy spherical harmonic transforms (giapy.spharmt) against
+spharm on the grids of sle_test.py.
+
+For each grid and truncation, the script times grdtospec, spectogrd and
+getgrad of both engines on a field of random coefficients, and reports the
+largest differences between the engines relative to the field amplitude.
+
+Usage: python harm_bench.py [nrepeat]
+
+"""
+
+import sys
+import time
+
+import numpy as np
+import spharm
+import giapy.spharmt
+
+# (nlon, nlat, ntrunc), the first is the grid of sle_test.py, with the
+# truncation of benchmark A.
+GRIDS = [(360, 360, 128),
+         (360, 360, 359),
+         (512, 256, 255),
+         (720, 361, 360)]
+
+def random_spec(ntrunc, seed=0):
+    """Random coefficients with decaying power, real for m = 0."""
+    ms, ns = giapy.spharmt.getspecindx(ntrunc)
+    rng = np.random.RandomState(seed)
+    spec = (rng.randn(len(ms)) + 1j*rng.randn(len(ms)))/(ns+1.)
+    spec[ms == 0] = spec[ms == 0].real
+    return spec
+
+def timeit(f, nrepeat):
+    """Return the best wall time of nrepeat calls to f and its result."""
+    best = np.inf
+    for i in range(nrepeat):
+        t0 = time.time()
+        result = f()
+        best = min(best, time.time() - t0)
+    return best, result
+
+def relerr(a, b):
+    return np.abs(np.asarray(a) - np.asarray(b)).max()/np.abs(b).max()
+
+def bench(nlon, nlat, ntrunc, nrepeat=3):
+    """Compare the engines on one grid, returning a dict of results."""
+    spec = random_spec(ntrunc)
+    result = {}
+    for name, module in [('spharm', spharm), ('numpy', giapy.spharmt)]:
+        tinit, trans = timeit(lambda: module.Spharmt(nlon, nlat,
+                                                    legfunc='stored'), 1)
+        tsyn, grid = timeit(lambda: trans.spectogrd(spec), nrepeat)
+        tana, back = timeit(lambda: trans.grdtospec(grid, ntrunc), nrepeat)
+        tgrad, grad = timeit(lambda: trans.getgrad(spec), nrepeat)
+        result[name] = {'init': tinit, 'spectogrd': tsyn, 'grdtospec': tana,
+                        'getgrad': tgrad, 'grid': grid, 'back': back,
+                        'grad': grad}
+
+    s, n = result['spharm'], result['numpy']
+    result['err'] = {'spectogrd': relerr(n['grid'], s['grid']),
+                     'grdtospec': relerr(n['back'], s['back']),
+                     'getgrad': max(relerr(n['grad'][0], s['grad'][0]),
+                                    relerr(n['grad'][1], s['grad'][1]))}
+    return result
+
+if __name__ == '__main__':
+    nrepeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    header = '{0:>16} {1:>10} {2:>10} {3:>10} {4:>10}'
+    row = '{0:>16} {1:10.4f} {2:10.4f} {3:10.4f} {4:10.2e}'
+    for nlon, nlat, ntrunc in GRIDS:
+        result = bench(nlon, nlat, ntrunc, nrepeat)
+        print('\nnlon={0}, nlat={1}, ntrunc={2}'.format(nlon, nlat, ntrunc))
+        print(header.format('', 'spharm (s)', 'numpy (s)', 'ratio',
+                            'rel. diff'))
+        print(row.format('init', result['spharm']['init'],
+                         result['numpy']['init'],
+                         result['numpy']['init']/result['spharm']['init'],
+                         0))
+        for step in ['spectogrd', 'grdtospec', 'getgrad']:
+            ts, tn = result['spharm'][step], result['numpy'][step]
+            print(row.format(step, ts, tn, tn/ts, result['err'][step]))
@@ -0,0 +1,101 @@
+"""
+love_convergence.py
+Author: Samuel B. Kachuck
+
+Convergence study of the radial discretizations of the elastic Love numbers
+(compute_love_numbers) on PREM: the error of h, L and n*(1+k_d) against the
+number of layers, and the layers needed to reach relative errors of 1e-4 and
+1e-6, for
+
+    scaled/2  : the logarithmic (scaled) mesh, trapezoidal steps (the
+                default of giapy-ellove)
+    scaled/4  : the logarithmic mesh, fourth-order Magnus steps
+    radial/2  : earthParams.radial_mesh (points at the discontinuities and
+                the radii of the table, refined near the surface for the
+                largest order number), trapezoidal steps
+    radial/4  : radial_mesh, fourth-order Magnus steps
+
+The errors are relative to a radial/4 solution on REFLAYERS layers, and are
+the largest over the order numbers. Logarithmic meshes cross the
+discontinuities of the parameters, which limits both of their orders.
+
+Usage: python love_convergence.py [order numbers]
+
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from giapy.earth_tools.elasticlove import compute_love_numbers
+from giapy.earth_tools.earthParams import EarthParams, radial_mesh
+
+NS = [2, 10, 50, 200, 1000]
+LAYERS = [50, 100, 200, 400, 800, 1600, 3200]
+REFLAYERS = 8000
+TARGETS = [1e-4, 1e-6]
+
+SCHEMES = [('scaled/2', True, 2), ('scaled/4', True, 4),
+           ('radial/2', False, 2), ('radial/4', False, 4)]
+
+def love(ns, params, nlayers, scaled, order):
+    """Return X = h, L, n*(1+k_d) (3, len(ns)) and the wall time."""
+    if scaled:
+        zarray = np.linspace(params.rCore, 1., nlayers)
+    else:
+        zarray = radial_mesh(params, nlayers, nref=max(ns), kinks=True)
+    t0 = time.time()
+    X = compute_love_numbers(ns, zarray, params, scaled=scaled, order=order)
+    wall = time.time() - t0
+    X[2] = ns*(1 + X[2])
+    return X, wall
+
+def layers_needed(layers, errs, target):
+    """The layers at which the errors reach target, interpolated in log-log
+    between the first layers below it and the layers before (None if not
+    reached)."""
+    below = np.nonzero(np.asarray(errs) <= target)[0]
+    if len(below) == 0:
+        return None
+    i = below[0]
+    if i == 0:
+        return layers[0]
+    x0, x1 = np.log(layers[i-1]), np.log(layers[i])
+    y0, y1 = np.log(errs[i-1]), np.log(errs[i])
+    return int(np.ceil(np.exp(x0 + (np.log(target) - y0)*(x1 - x0)/(y1 - y0))))
+
+if __name__ == '__main__':
+    ns = np.array([int(n) for n in sys.argv[1:]] or NS)
+    params = EarthParams(model='prem')
+    params.normalize('love')
+
+    ref, _ = love(ns, params, REFLAYERS, False, 4)
+
+    errs = dict((name, []) for name, _, _ in SCHEMES)
+    walls = dict((name, []) for name, _, _ in SCHEMES)
+    for nlayers in LAYERS:
+        for name, scaled, order in SCHEMES:
+            X, wall = love(ns, params, nlayers, scaled, order)
+            errs[name].append(np.max(np.abs(X - ref)/np.abs(ref)))
+            walls[name].append(wall)
+    sys.stdout.write('\n')
+
+    print('Largest relative error over order numbers {}'.format(ns.tolist()))
+    print('{0:>8}'.format('layers') +
+          ''.join('{0:>20}'.format(name) for name, _, _ in SCHEMES))
+    for i, nlayers in enumerate(LAYERS):
+        print('{0:>8}'.format(nlayers) +
+              ''.join('{0:>11.2e} ({1:5.2f}s)'.format(errs[name][i],
+                                                      walls[name][i])
+                      for name, _, _ in SCHEMES))
+
+    print('\nLayers needed')
+    print('{0:>8}'.format('error') +
+          ''.join('{0:>20}'.format(name) for name, _, _ in SCHEMES))
+    for target in TARGETS:
+        needed = [layers_needed(LAYERS, errs[name], target)
+                    for name, _, _ in SCHEMES]
+        print('{0:>8.0e}'.format(target) +
+              ''.join('{0:>20}'.format('>{}'.format(LAYERS[-1]) if n is None
+                                       else n) for n in needed))
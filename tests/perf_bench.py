@@ -0,0 +1,459 @@
+"""
+perf_bench.py
+Author: Samuel B. Kachuck
+
+Performance benchmarks of giapy: the sea level equation on the cases of
+sle_test.py (A, D1, D2, E1, E2, F1), each at full size and scaled down
+('-small': coarser grid, time step and truncation), and sweeps of the elastic
+(compute_love_numbers, i.e., solvde) and viscoelastic (compute_viscel_numbers
+and compute_laplace_numbers) Love numbers over maximum order number and
+number of layers.
+
+Cases whose dependencies are missing (e.g., basemap for the sea level
+equation, its earth model, or the compiled integrators of viscellove) are
+skipped, with the reason.
+
+Each case runs in its own process, which records the best wall time of the
+computation (not the setup), the peak resident set size (RSS) of the process,
+and the largest relative error of its outputs against reference outputs
+stored with --make-refs.
+
+Usage:
+    python perf_bench.py list
+    python perf_bench.py run [cases or groups] [--refdir DIR] [--make-refs]
+                             [--outdir DIR] [--repeat N]
+    python perf_bench.py compare REV_A REV_B [cases or groups]
+                             [--threshold 0.1] [--rss-threshold 0.1]
+                             [--rtol 1e-6]
+
+The groups are 'small' (default), 'full', 'sle', 'love' and 'all'. 'compare'
+checks out the two git revisions into temporary worktrees, runs the cases on
+each (with this version of the benchmarks), and flags cases that are slower,
+use more memory, or whose outputs differ by more than rtol. It exits with
+status 1 if any case regressed.
+
+"""
+
+from __future__ import division
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+
+#### Sea level equation cases ####
+
+# (ice spatial, ice evolution, topography, eliter), see sle_test.py.
+SLE_CASES = {'A' : ('L1', 'T1', None, 0),
+             'D1': ('L2', 'T1', 'B1', 5),
+             'D2': ('L2', 'T2', 'B1', 5),
+             'E1': ('L2', 'T2', 'B2', 20),
+             'E2': ('L3', 'T2', 'B3', 20),
+             'F1': ('L3', 'T2', 'B3', 20)}
+
+# The Love numbers of the sea level cases, in giapy/data/earth.
+SLE_EARTH = 'mod_M3-L70-V01'
+
+# Grid size, ice time step (kyr) and truncation of full and scaled-down cases.
+SLE_SIZES = {'full' : dict(nlat=360, tstep=0.02, ntrunc=128,
+                            levels=[(32, 1e-2), (64, 1e-3), (128, None)]),
+             'small': dict(nlat=90, tstep=0.2, ntrunc=32,
+                            levels=[(16, 1e-2), (32, None)])}
+
+class SkipCase(Exception):
+    """Raised by the setup of a case that cannot run here, with the reason."""
+
+def sle_case(name, size):
+    """Set up a sea level case, returning the function that computes it."""
+    sys.path.insert(0, TESTDIR)
+    import giapy
+    try:
+        import giapy.sle
+        import giapy.earth_tools.earthSphericalLap
+        import sle_test
+    except ImportError as e:
+        raise SkipCase('the sea level equation needs {}'.format(e.name))
+
+    spatial, evolution, topoCase, eliter = SLE_CASES[name]
+    size = SLE_SIZES[size]
+    sle_test.NLON = sle_test.NLAT = size['nlat']
+
+    drctry = giapy.MODPATH+'/data/earth/'
+    if not os.path.exists(drctry+SLE_EARTH):
+        raise SkipCase('earth model {} not in {}'.format(SLE_EARTH, drctry))
+    earth = giapy.earth_tools.earthSphericalLap.SphericalEarth()
+    earth.loadLoveNumbers(SLE_EARTH, drctry=drctry)
+    ice = sle_test.gen_icehistory(spatial, evolution, tstep=size['tstep'])
+    topo = None if topoCase is None else sle_test.gen_sstopo(topoCase)
+
+    if name == 'A':
+        out_times = np.linspace(11, 0, 12)
+    else:
+        out_times = ice.times
+
+    if name == 'F1':
+        sim = giapy.sle.GiaSimGlobal(earth, ice)
+        def run():
+            topo0, out = sim.solveInitialTopography(topo,
+                                out_times=out_times, eliter=eliter,
+                                levels=size['levels'], tol=1e-2, maxiter=10)
+            return _sle_outputs(out)
+    else:
+        sim = giapy.sle.GiaSimGlobal(earth, ice, topo=topo)
+        def run():
+            out = sim.performConvolution(out_times=out_times, eliter=eliter,
+                                            ntrunc=size['ntrunc'])
+            return _sle_outputs(out)
+    return run
+
+def _sle_outputs(out):
+    """The final fields of a GiaSimOutput to compare with references."""
+    outputs = {'upl': out.upl[-1], 'hor': out.hor[-1], 'geo': out.geo[-1],
+               'esl': out.esl.array}
+    if 'sstopo' in out._observerDict:
+        outputs['sstopo'] = out.sstopo[-1]
+    return outputs, {}
+
+#### Love number cases ####
+
+LOVE_LMAX = [256, 1024, 8192]
+LOVE_NLAYERS = [100, 1000]
+VISCEL_LMAX = [64, 256]
+VISCEL_TIMES = np.logspace(-4, np.log10(250), 30)
+
+def love_case(lmax, nlayers):
+    """Set up an elastic Love number sweep (see giapy-ellove)."""
+    from giapy.earth_tools.elasticlove import compute_love_numbers
+    from giapy.earth_tools.earthParams import EarthParams
+
+    params = EarthParams(model='prem')
+    zarray = np.linspace(params.rCore, 1., nlayers)
+    ls = np.arange(1, lmax+1)
+    def run():
+        hLk, its = compute_love_numbers(ls, zarray, params, err=1e-14, Q=2,
+                                        it_counts=True, scaled=True)
+        return {'hLk': hLk}, {'iterations': int(its.sum())}
+    return run
+
+def viscel_case(lmax, nlayers):
+    """Set up a viscoelastic Love number sweep (see giapy-velove)."""
+    from giapy.earth_tools.earthParams import EarthParams
+    try:
+        from giapy.earth_tools.viscellove import compute_viscel_numbers
+    except ImportError as e:
+        raise SkipCase('viscellove needs {}'.format(e.name))
+
+    params = EarthParams(model='prem_nocrust')
+    zarray = np.linspace(params.rCore, 1., nlayers)
+    ls = np.arange(1, lmax+1)
+    def run():
+        hLkt = compute_viscel_numbers(ls, VISCEL_TIMES, zarray, params,
+                                        scaled=True)
+        return {'hLkt': hLkt}, {}
+    return run
+
+def laplace_case(lmax, nlayers):
+    """Set up a viscoelastic Love number sweep by inversion of the
+    Laplace-domain Love numbers (see giapy-velove --laplace)."""
+    from giapy.earth_tools.laplacelove import compute_laplace_numbers
+    from giapy.earth_tools.earthParams import EarthParams
+
+    params = EarthParams(model='prem_nocrust')
+    zarray = np.linspace(params.rCore, 1., nlayers)
+    ls = np.arange(1, lmax+1)
+    def run():
+        hLkt = compute_laplace_numbers(ls, VISCEL_TIMES, zarray, params)
+        return {'hLkt': hLkt}, {}
+    return run
+
+#### Case registry ####
+
+CASES = {}
+GROUPS = {'small': [], 'full': [], 'sle': [], 'love': []}
+
+for name in ['A', 'D1', 'D2', 'E1', 'E2', 'F1']:
+    for size, suffix in [('small', '-small'), ('full', '')]:
+        CASES[name+suffix] = (sle_case, (name, size))
+        GROUPS[size].append(name+suffix)
+        GROUPS['sle'].append(name+suffix)
+
+for lmax in LOVE_LMAX:
+    for nlayers in LOVE_NLAYERS:
+        name = 'love-l{}-n{}'.format(lmax, nlayers)
+        CASES[name] = (love_case, (lmax, nlayers))
+        GROUPS['small' if (lmax, nlayers) == (256, 100) else 'full'].append(name)
+        GROUPS['love'].append(name)
+
+for lmax in VISCEL_LMAX:
+    for prefix, setup in [('viscel', viscel_case), ('laplace', laplace_case)]:
+        name = '{}-l{}-n100'.format(prefix, lmax)
+        CASES[name] = (setup, (lmax, 100))
+        GROUPS['small' if lmax == 64 else 'full'].append(name)
+        GROUPS['love'].append(name)
+
+GROUPS['all'] = GROUPS['small'] + GROUPS['full']
+
+def expand(names):
+    """Expand group names into case names, keeping their order."""
+    cases = []
+    for name in names or ['small']:
+        for case in GROUPS.get(name, [name]):
+            if case not in CASES:
+                raise ValueError('unknown case or group {}'.format(case))
+            if case not in cases:
+                cases.append(case)
+    return cases
+
+#### Running ####
+
+def peak_rss():
+    """The peak resident set size of this process, in bytes."""
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return rss if sys.platform == 'darwin' else rss*1024
+
+def relerr(a, b):
+    a, b = np.asarray(a), np.asarray(b)
+    return float(np.abs(a - b).max()/max(np.abs(b).max(), 1e-300))
+
+def compare_outputs(outputs, reference):
+    """The relative error of each output with respect to the reference."""
+    return dict((key, relerr(outputs[key], reference[key]))
+                    for key in reference if key in outputs)
+
+def run_case(name, repeat=1, refdir=None, make_refs=False, outdir=None):
+    """Run a case in this process, returning a dict of results (with the
+    reason under 'skipped' if it cannot run)."""
+    setup, args = CASES[name]
+    t0 = time.time()
+    try:
+        run = setup(*args)
+    except SkipCase as e:
+        return {'case': name, 'skipped': str(e)}
+    result = {'case': name, 'setup': time.time() - t0}
+
+    wall = np.inf
+    for i in range(repeat):
+        t0 = time.time()
+        outputs, extra = run()
+        wall = min(wall, time.time() - t0)
+    result.update(extra)
+    result['wall'] = wall
+    result['rss'] = peak_rss()
+
+    fname = '{}.npz'.format(name)
+    if refdir is not None:
+        if make_refs:
+            if not os.path.isdir(refdir):
+                os.makedirs(refdir)
+            np.savez(os.path.join(refdir, fname), **outputs)
+        elif os.path.exists(os.path.join(refdir, fname)):
+            errs = compare_outputs(outputs,
+                                    np.load(os.path.join(refdir, fname)))
+            result['errors'] = errs
+            result['error'] = max(errs.values()) if errs else None
+    if outdir is not None:
+        np.savez(os.path.join(outdir, fname), **outputs)
+    return result
+
+def run_cases(cases, repeat=1, refdir=None, make_refs=False, outdir=None,
+                path=None, verbose=True):
+    """Run each case in a fresh process (so its peak RSS is its own),
+    importing giapy from path if given. Returns a list of result dicts; a
+    failed case has its error message under 'failed', a skipped one its
+    reason under 'skipped'."""
+    env = dict(os.environ)
+    if path is not None:
+        env['PYTHONPATH'] = os.pathsep.join([path] +
+                                    env.get('PYTHONPATH', '').split(os.pathsep))
+    results = []
+    for name in cases:
+        fd, resfile = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        cmd = [sys.executable, os.path.abspath(__file__), '_case', name,
+                '--repeat', str(repeat), '--result', resfile]
+        if refdir is not None:
+            cmd += ['--refdir', refdir] + (['--make-refs'] if make_refs else [])
+        if outdir is not None:
+            cmd += ['--outdir', outdir]
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE)
+        _, err = proc.communicate()
+        if proc.returncode == 0:
+            with open(resfile) as f:
+                result = json.load(f)
+        else:
+            msg = err.decode(errors='replace').strip().splitlines()
+            result = {'case': name, 'failed': msg[-1] if msg else 'failed'}
+        os.remove(resfile)
+        results.append(result)
+        if verbose:
+            print(format_result(result))
+    return results
+
+def format_result(result):
+    if 'failed' in result:
+        return '{0:>18}  FAILED: {1}'.format(result['case'], result['failed'])
+    if 'skipped' in result:
+        return '{0:>18}  skipped: {1}'.format(result['case'],
+                                                result['skipped'])
+    error = result.get('error')
+    return '{0:>18} {1:10.3f} s {2:10.1f} MB {3:>10}'.format(result['case'],
+                result['wall'], result['rss']/2.**20,
+                'n/a' if error is None else '{:.2e}'.format(error))
+
+#### Comparing revisions ####
+
+def checkout(rev, where):
+    """Check out git revision rev into a new worktree at where."""
+    subprocess.check_call(['git', 'worktree', 'add', '--detach', where, rev],
+                            cwd=TESTDIR, stdout=subprocess.DEVNULL)
+
+def remove_checkout(where):
+    subprocess.call(['git', 'worktree', 'remove', '--force', where],
+                        cwd=TESTDIR)
+
+def compare_revisions(reva, revb, cases, repeat=1, threshold=0.1,
+                        rss_threshold=0.1, rtol=1e-6):
+    """Run cases at git revisions reva and revb, returning a list of
+    (case, result a, result b, flags) with flags naming the regressions of
+    b with respect to a."""
+    tmp = tempfile.mkdtemp(prefix='giapy_bench_')
+    # Each revision has its own directories (labelled a and b, so that a
+    # revision may be compared with itself).
+    results, outdirs = [], [os.path.join(tmp, 'out_a'),
+                            os.path.join(tmp, 'out_b')]
+    try:
+        for rev, label, outdir in zip([reva, revb], 'ab', outdirs):
+            where = os.path.join(tmp, 'src_'+label)
+            os.makedirs(outdir)
+            checkout(rev, where)
+            try:
+                print('Running {} at {}'.format(', '.join(cases), rev))
+                results.append(run_cases(cases, repeat=repeat,
+                                            outdir=outdir, path=where))
+            finally:
+                remove_checkout(where)
+
+        comparison = []
+        for name, a, b in zip(cases, *results):
+            flags = []
+            if 'skipped' in a or 'skipped' in b:
+                pass
+            elif 'failed' in b:
+                flags.append('FAILED')
+            elif 'failed' not in a:
+                if b['wall'] > (1+threshold)*a['wall']:
+                    flags.append('SLOWER')
+                if b['rss'] > (1+rss_threshold)*a['rss']:
+                    flags.append('MEMORY')
+                outa = np.load(os.path.join(outdirs[0], name+'.npz'))
+                outb = np.load(os.path.join(outdirs[1], name+'.npz'))
+                dev = compare_outputs(outb, outa)
+                b['deviation'] = max(dev.values()) if dev else 0.
+                if b['deviation'] > rtol:
+                    flags.append('CHANGED')
+            comparison.append((name, a, b, flags))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return comparison
+
+def format_comparison(comparison, reva, revb):
+    lines = ['{0:>18} {1:>10} {2:>10} {3:>7} {4:>8} {5:>10}  {6}'.format(
+                'case', reva[:10], revb[:10], 'time', 'RSS', 'deviation',
+                'flags')]
+    row = '{0:>18} {1:10.3f} {2:10.3f} {3:7.2f} {4:8.2f} {5:10.2e}  {6}'
+    for name, a, b, flags in comparison:
+        if 'skipped' in a or 'skipped' in b:
+            lines.append('{0:>18} skipped: {1}'.format(name,
+                            a.get('skipped') or b.get('skipped')))
+            continue
+        if 'failed' in a or 'failed' in b:
+            lines.append('{0:>18} {1}'.format(name,
+                            'failed at '+(reva if 'failed' in a else revb)))
+            continue
+        lines.append(row.format(name, a['wall'], b['wall'],
+                        b['wall']/a['wall'], b['rss']/a['rss'],
+                        b.get('deviation', 0.), ' '.join(flags)))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Benchmark the performance of giapy')
+    sub = parser.add_subparsers(dest='command')
+
+    sub.add_parser('list', help='list the cases and groups')
+
+    prun = sub.add_parser('run', help='run cases in this tree')
+    prun.add_argument('cases', nargs='*')
+    prun.add_argument('--repeat', type=int, default=1,
+                    help='report the best of REPEAT computations, default 1')
+    prun.add_argument('--refdir', default=os.path.join(TESTDIR, 'bench_refs'),
+                    help='directory of reference outputs, default bench_refs')
+    prun.add_argument('--make-refs', action='store_true',
+                    help='store the outputs as references')
+    prun.add_argument('--outdir', default=None,
+                    help='directory into which to save the outputs')
+    prun.add_argument('--json', default=None,
+                    help='file into which to write the results')
+
+    pcomp = sub.add_parser('compare', help='compare two git revisions')
+    pcomp.add_argument('reva')
+    pcomp.add_argument('revb')
+    pcomp.add_argument('cases', nargs='*')
+    pcomp.add_argument('--repeat', type=int, default=1)
+    pcomp.add_argument('--threshold', type=float, default=0.1,
+                    help='flag relative slowdowns above, default 0.1')
+    pcomp.add_argument('--rss-threshold', type=float, default=0.1,
+                    help='flag relative increases of peak RSS above, '
+                         'default 0.1')
+    pcomp.add_argument('--rtol', type=float, default=1e-6,
+                    help='flag relative changes of the outputs above, '
+                         'default 1e-6')
+
+    # Used by run_cases to run a single case in a fresh process.
+    pcase = sub.add_parser('_case')
+    pcase.add_argument('case')
+    pcase.add_argument('--repeat', type=int, default=1)
+    pcase.add_argument('--refdir', default=None)
+    pcase.add_argument('--make-refs', action='store_true')
+    pcase.add_argument('--outdir', default=None)
+    pcase.add_argument('--result', required=True)
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for group in ['small', 'full']:
+            print('{}: {}'.format(group, ' '.join(GROUPS[group])))
+
+    elif args.command == 'run':
+        results = run_cases(expand(args.cases), args.repeat, args.refdir,
+                                args.make_refs, args.outdir)
+        if args.json is not None:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=1)
+
+    elif args.command == 'compare':
+        comparison = compare_revisions(args.reva, args.revb,
+                                        expand(args.cases), args.repeat,
+                                        args.threshold, args.rss_threshold,
+                                        args.rtol)
+        print(format_comparison(comparison, args.reva, args.revb))
+        sys.exit(int(any(flags for _, _, _, flags in comparison)))
+
+    elif args.command == '_case':
+        result = run_case(args.case, args.repeat, args.refdir,
+                            args.make_refs, args.outdir)
+        with open(args.result, 'w') as f:
+            json.dump(result, f)
+
+    else:
+        parser.print_help()
@@ -128,7 +128,7 @@ def gen_icehistory(spatial='L1', evolution='T1', tstep=0.02, **kwargs):
                     'areaProps'         : {},
                     'areaVerts'         : {},
                     'times'             : times,
-                    'stageOrder'        : range(nloadsteps)+[nloadsteps-1]*(len(times)-nloadsteps),
+                    'stageOrder'        : list(range(nloadsteps))+[nloadsteps-1]*(len(times)-nloadsteps),
                     'path'              : '',
                     'fnames'            : ['','']}
                     
@@ -152,7 +152,7 @@ def gen_icehistory(spatial='L1', evolution='T1', tstep=0.02, **kwargs):
                     'areaProps'         : {},
                     'areaVerts'         : {},
                     'times'             : times,
-                    'stageOrder'        : range(nloadsteps)+[nloadsteps-1]*(len(times)-nloadsteps),
+                    'stageOrder'        : list(range(nloadsteps))+[nloadsteps-1]*(len(times)-nloadsteps),
                     'path'              : '',
                     'fnames'            : ['','']}
 
@@ -290,6 +290,12 @@ def plot_profiles(sim, benchmark, lat=None, lon=None, data=None):
         axs[1,1].plot(data[0], data[6], '--')
         axs[1,2].plot(data[0], data[5], '--')
     return plt.gca()
+
+def report_precision(name, sim, **kwargs):
+    """Print the deviation of a single from a double precision computation
+    of a benchmark case (see giapy.sle.precision_deviation)."""
+    print('Case {}, single vs double precision:'.format(name))
+    return giapy.sle.precision_deviation(sim, verbose=True, **kwargs)
         
 if __name__ == '__main__':
     import argparse
@@ -297,6 +303,8 @@ if __name__ == '__main__':
     parser.add_argument('benchlist', nargs='+')
     parser.add_argument('--dir', type=str, default='./',
                     help='directory into which to write results, default ./')
+    parser.add_argument('--precision', action='store_true',
+                    help='report the deviation of single precision runs')
 
     args = parser.parse_args()
 
@@ -319,6 +327,9 @@ if __name__ == '__main__':
         simA = giapy.sle.GiaSimGlobal(earth, iceL1T1)
         benchmarkA = simA.performConvolution(out_times=np.linspace(11, 0, 12),
                                 ntrunc=128)
+        if args.precision:
+            report_precision('A', simA, out_times=np.linspace(11, 0, 12),
+                                ntrunc=128)
         uplA = benchmarkA.upl[-1].copy()
         horA = benchmarkA.hor[-1].copy()
         geoA = benchmarkA.geo[-1].copy()
@@ -344,6 +355,9 @@ if __name__ == '__main__':
         simD1 = giapy.sle.GiaSimGlobal(earth, iceL2T1, topo=topoB1)
         benchmarkD1 = simD1.performConvolution(out_times=iceL2T1.times,
                                 eliter=5, ntrunc=128)
+        if args.precision:
+            report_precision('D1', simD1, out_times=iceL2T1.times,
+                                eliter=5, ntrunc=128)
 
         fignums= ['10', '11', '12', '13']
         figprops= [{'lon':75}, {'lat':25}, {'lon':-40}, {'lat':100}]
@@ -355,6 +369,9 @@ if __name__ == '__main__':
         simD2 = giapy.sle.GiaSimGlobal(earth, iceL2T2, topo=topoB1)
         benchmarkD2 = simD2.performConvolution(out_times=iceL2T2.times,
                                 eliter=5, ntrunc=128)
+        if args.precision:
+            report_precision('D2', simD2, out_times=iceL2T2.times,
+                                eliter=5, ntrunc=128)
 
         fignums= ['10', '11', '12', '13']
         figprops= [{'lon':75}, {'lat':25}, {'lon':-40}, {'lat':100}]
@@ -366,6 +383,9 @@ if __name__ == '__main__':
         simE1 = giapy.sle.GiaSimGlobal(earth, iceL2T2, topo=topoB2)
         benchmarkE1 = simE1.performConvolution(out_times=iceL2T2.times,
                                 eliter=20, ntrunc=128)
+        if args.precision:
+            report_precision('E1', simE1, out_times=iceL2T2.times,
+                                eliter=20, ntrunc=128)
 
         fignums= ['10', '11', '12', '13']
         figprops= [{'lon':75}, {'lat':25}, {'lon':25}, {'lat':35}]
@@ -377,6 +397,9 @@ if __name__ == '__main__':
         simE2 = giapy.sle.GiaSimGlobal(earth, iceL3T2, topo=topoB3)
         benchmarkE2 = simE2.performConvolution(out_times=iceL3T2.times,
                                 eliter=20, ntrunc=128)
+        if args.precision:
+            report_precision('E2', simE2, out_times=iceL3T2.times,
+                                eliter=20, ntrunc=128)
 
         fignums= ['10', '11', '12', '13']
         figprops= [{'lon':75}, {'lat':25}, {'lon':25}, {'lat':35}]
@@ -384,23 +407,15 @@ if __name__ == '__main__':
             write_result(simE2, benchmarkE2, 'E2_fig{}'.format(num), drctry=drctry, **prop)
 
     if 'F1' in benchlist:
-        Aearth = (4*np.pi*6371**2)
         iceL3T2 = gen_icehistory('L3', 'T2', tstep=0.02)
-        topo = topoB3.copy()
-        i = 0
-        while True:
-            simF1 = giapy.sle.GiaSimGlobal(earth, iceL3T2, topo=topo)
-            benchmarkF1 = simF1.performConvolution(out_times=iceL3T2.times,
-                                eliter=20, ntrunc=128)
-
-            dtopo = benchmarkF1.sstopo[-1] - topoB3
-            err = simF1.grid.integrate(np.abs(dtopo))/Aearth
-            print('Error at iter {}: {}'.format(i, err))
-            if err < 1e-2 or i >= 10:
-                break
-            else:
-                topo -= 0.5*dtopo
-            i += 1
+        simF1 = giapy.sle.GiaSimGlobal(earth, iceL3T2)
+        topoF1, benchmarkF1 = simF1.solveInitialTopography(topoB3,
+                                out_times=iceL3T2.times, eliter=20,
+                                levels=[(32, 1e-2), (64, 1e-3), (128, None)],
+                                tol=1e-2, maxiter=10, verbose=True)
+        if args.precision:
+            report_precision('F1', simF1, out_times=iceL3T2.times, eliter=20,
+                                ntrunc=128, topo=topoF1)
 
         fignums= ['10', '11', '12', '13']
         figprops= [{'lon':75}, {'lat':25}, {'lon':25}, {'lat':35}]
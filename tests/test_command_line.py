@@ -0,0 +1,100 @@
+"""
+test_command_line.py
+Author: Samuel B. Kachuck
+
+Tests of the giapy-ellove and giapy-velove commands on coarse meshes.
+
+"""
+
+import sys
+
+import numpy as np
+import pytest
+
+from giapy import command_line
+from giapy.earth_tools.earthParams import EarthParams
+from giapy.earth_tools.elasticlove import compute_love_numbers
+
+
+def run(monkeypatch, command, *args):
+    monkeypatch.setattr(sys, 'argv', [command.__name__] + list(args))
+    command()
+
+
+def read_velove(fname):
+    """The order numbers and the (len(ns), len(ts), 4) table of t, h', l'
+    and k' of a giapy-velove table."""
+    with open(fname) as f:
+        ns = [int(line.split('=')[1]) for line in f if line.startswith('# l=')]
+    return np.array(ns), np.loadtxt(fname).reshape(len(ns), -1, 4)
+
+
+def test_ellove(tmpdir, monkeypatch):
+    fname = str(tmpdir.join('ellove.txt'))
+    run(monkeypatch, command_line.ellove, '4', fname, '-n', '100')
+    table = np.loadtxt(fname, skiprows=1)
+
+    ls = np.arange(1, 5)
+    hLk = compute_love_numbers(ls, np.linspace(EarthParams().rCore, 1., 100),
+                                EarthParams(), err=1e-14, Q=2,
+                                it_counts=False, scaled=True)
+    np.testing.assert_array_equal(table[:,0], ls)
+    np.testing.assert_allclose(table[:,1:],
+                                np.c_[hLk[0], hLk[1]/ls, -(1+hLk[2])])
+
+
+def test_ellove_tol(tmpdir, monkeypatch):
+    # Interpolation needs the fixed mesh of --discmesh.
+    fname = str(tmpdir.join('ellove.txt'))
+    with pytest.raises(SystemExit):
+        run(monkeypatch, command_line.ellove, '40', fname, '--tol', '1e-4')
+    run(monkeypatch, command_line.ellove, '40', fname, '--tol', '1e-4',
+        '--discmesh')
+    np.testing.assert_array_equal(np.loadtxt(fname, skiprows=1)[:,0],
+                                    np.arange(1, 41))
+
+
+@pytest.fixture(scope='module')
+def velove_table(tmpdir_factory):
+    fname = str(tmpdir_factory.mktemp('velove').join('velove.txt'))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        run(monkeypatch, command_line.velove, '-l', '2', '3', fname,
+            '--laplace', '-n', '100')
+    return fname
+
+
+def test_velove_laplace(velove_table):
+    # The Laplace-domain computation needs no compiled integrators.
+    ns, table = read_velove(velove_table)
+    np.testing.assert_array_equal(ns, [2, 3])
+    assert table[0,0,0] == 0
+
+    # The elastic row is that of giapy-ellove: h, l = L/n and
+    # k' = -(1+k_d).
+    params = EarthParams(model='prem')
+    hLk = compute_love_numbers(ns, np.linspace(params.rCore, 1., 100),
+                                params, err=1e-14, Q=2, it_counts=False,
+                                scaled=True)
+    np.testing.assert_allclose(table[:,0,1:],
+                                np.c_[hLk[0], hLk[1]/ns, -(1+hLk[2])],
+                                rtol=1e-8)
+    # Loads sink into the earth (the viscous response, from t > 0, is
+    # that of the earth without crust) and lower its geoid.
+    assert np.all(np.diff(table[:,1:,1], axis=1) < 0)
+    assert np.all(table[:,:,3] < 0) and np.all(table[:,:,3] > -1)
+
+
+def test_velove_roundtrip(velove_table):
+    # The fit modes of a table reproduce it, in the format of the stored
+    # responses (h, l and k').
+    earthSphericalLap = pytest.importorskip(
+                            'giapy.earth_tools.earthSphericalLap')
+    ns, table = read_velove(velove_table)
+    earth = earthSphericalLap.SphericalEarth()
+    resid = earth.loadVeloveNumbers(velove_table, drctry='', nmodes=6)
+    assert np.all(resid < 1e-2)
+
+    ts = table[0,:,0]
+    resp = np.array([earth.getResp(t)[ns] for t in ts]).transpose(1, 0, 2)
+    scale = np.ptp(table[:,:,1:], axis=1)[:,None,:]
+    assert np.max(np.abs(resp - table[:,:,1:])/scale) < 5e-2
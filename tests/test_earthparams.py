@@ -0,0 +1,67 @@
+"""
+test_earthparams.py
+Author: Samuel B. Kachuck
+
+Tests of the parameters of giapy.earth_tools.earthParams.EarthParams
+interpolated to meshes (onMesh), which are kept until the parameters change.
+
+"""
+
+import pickle
+
+import numpy as np
+import pytest
+
+from giapy.earth_tools.earthParams import MAXMESHES, EarthParams
+
+
+def _zmesh(params, npts=20):
+    return np.linspace(params.z[0], params.z[-1], npts)
+
+
+def test_on_mesh():
+    params = EarthParams()
+    z = _zmesh(params)
+    mesh = params.onMesh(z)
+    assert params.onMesh(z.copy()) is mesh
+    for key, val in params.getParams(z).items():
+        np.testing.assert_array_equal(mesh[key], val)
+        assert mesh[key].flags['C_CONTIGUOUS']
+
+    # The oldest of more than MAXMESHES meshes is forgotten.
+    for npts in range(21, 21+MAXMESHES):
+        params.onMesh(_zmesh(params, npts))
+    assert params.onMesh(z) is not mesh
+    assert params.onMesh(_zmesh(params, 20+MAXMESHES)) is \
+            params.onMesh(_zmesh(params, 20+MAXMESHES))
+
+    # Pickles do not keep the meshes.
+    params = pickle.loads(pickle.dumps(params))
+    assert params._meshes == {}
+    np.testing.assert_array_equal(params.onMesh(z)['den'], mesh['den'])
+
+
+@pytest.mark.parametrize('change,key', [
+    (lambda p: p.normalize('dim'), 'den'),
+    (lambda p: p.addViscosity(np.array([[p.z[0], 1.], [1e22, 1e22]])),
+        'visc'),
+    (lambda p: p.addNonadiabatic(np.array([[p.z[0], 1.], [0.1, 0.1]])),
+        'nonad'),
+    (lambda p: p.fullNonadiabatic(), 'nonad'),
+    (lambda p: p.addLithosphere(D=1e24), None)])
+def test_on_mesh_changed(change, key):
+    # Changing the parameters discards the meshes, and the surface and
+    # core-mantle boundary values.
+    params = EarthParams(normmode='love')
+    z = _zmesh(params)
+    mesh = params.onMesh(z)
+    surface = params.surface
+
+    change(params)
+    new = params.onMesh(z)
+    assert new is not mesh
+    assert params.surface is not surface
+    for k, val in params.getParams(z).items():
+        np.testing.assert_array_equal(new[k], val)
+    if key is not None:
+        assert np.any(new[key] != mesh[key])
@@ -0,0 +1,185 @@
+"""
+test_elasticlove.py
+Author: Samuel B. Kachuck
+
+Tests of the elastic Love numbers of giapy.earth_tools.elasticlove on PREM.
+
+"""
+
+import numpy as np
+import pytest
+
+from giapy.earth_tools.earthParams import EarthParams, radial_mesh
+from giapy.earth_tools.elasticlove import (adaptive_love_numbers,
+                                            compute_love_numbers,
+                                            converged_love_numbers,
+                                            gen_elasb, SphericalElasSMat)
+
+NS = np.array([2, 10, 100])
+
+
+def _X(hLk, ns):
+    """h, L and n*(1+k_d), the solutions of converged_love_numbers."""
+    return np.r_[hLk[:2], ns[None]*(1 + hLk[2:])]
+
+
+@pytest.mark.parametrize('order', [2, 4])
+def test_converged_love_numbers(order):
+    params = EarthParams()
+    ref = compute_love_numbers(NS, radial_mesh(params, 4000, nref=NS.max(),
+                                                kinks=True),
+                                params, scaled=False, order=4)
+    hLk, info = converged_love_numbers(NS, params, tol=1e-6, order=order,
+                                        full_output=True)
+
+    # The default mesh (radial_mesh) converges at the order of the
+    # discretization, and the error estimates bound the errors of the
+    # (extrapolated) Love numbers returned.
+    assert np.all(info['converged'])
+    assert np.all(np.abs(info['order'] - order) < 0.1)
+    err = np.max(np.abs(_X(hLk, NS) - _X(ref, NS))/np.abs(_X(ref, NS)),
+                    axis=0)
+    assert np.all(err <= np.maximum(info['errest'], 1e-10))
+
+
+@pytest.mark.parametrize('scaled', [False, True])
+def test_adaptive_love_numbers(scaled):
+    params = EarthParams()
+    ns = np.arange(1, 2001)
+    if scaled:
+        zarray = np.linspace(params.rCore, 1., 100)
+    else:
+        zarray = radial_mesh(params, 100, nref=ns.max())
+    ref = compute_love_numbers(ns, zarray, params, scaled=scaled)
+    hLk, info = adaptive_love_numbers(ns, zarray, params, tol=1e-5,
+                                        scaled=scaled, full_output=True)
+
+    # The error estimate bounds the error of the interpolated orders.
+    assert len(info['solved']) < len(ns)
+    err = np.max(np.abs(_X(hLk, ns) - _X(ref, ns))/np.abs(_X(ref, ns)),
+                    axis=0)
+    assert err.max() <= info['errest']
+    # On the logarithmic mesh, the solutions jump with n and the tolerance is
+    # not reached.
+    assert info['converged'] != scaled
+
+
+@pytest.mark.parametrize('comp', [True, False])
+@pytest.mark.parametrize('scaled', [False, True])
+def test_matfill_serial(comp, scaled, monkeypatch):
+    # The fills of the ahead-of-time kernels (giapy.numTools.aot), one order
+    # number at a time, are those of the parallel batch.
+    from giapy.earth_tools import elasticlove, viscouslove
+    params = EarthParams()
+    params.normalize('love')
+    ns = np.arange(1, 6)
+    zarray = np.linspace(params.rCore, 1., 50)
+    if scaled:
+        zarray = np.tile(zarray, (len(ns), 1))
+
+    elas = elasticlove.propMatElasBatch(zarray, ns, params, comp=comp,
+                                        scaled=scaled)
+    visc = viscouslove.propMatViscBatch(zarray, ns, params, scaled=scaled,
+                                        logtime=comp)
+    monkeypatch.setattr(elasticlove, '_matFillBatch',
+                        elasticlove._matFillSerial)
+    monkeypatch.setattr(viscouslove, '_matFillBatch',
+                        viscouslove._matFillSerial)
+    np.testing.assert_array_equal(elasticlove.propMatElasBatch(zarray, ns,
+                                    params, comp=comp, scaled=scaled), elas)
+    np.testing.assert_array_equal(viscouslove.propMatViscBatch(zarray, ns,
+                                    params, scaled=scaled, logtime=comp), visc)
+
+
+class _Smatrix(object):
+    """A difeq without relaxArrays, relaxed by the Python loop of solvde."""
+    def __init__(self, difeq):
+        self.smatrix = difeq.smatrix
+
+
+@pytest.mark.parametrize('kinks', [False, True])
+def test_solvde_linear(kinks):
+    # The compiled relaxation of linear problems (solvde_linear) is that of
+    # the s matrices of difeq.smatrix, on meshes of different sizes.
+    from giapy.numTools import solvdeJit
+    indexv = np.array([3,4,0,1,5,2])
+    scalv = np.ones(6)
+    ys = {}
+    for nlayers in [50, 80, 50]:
+        params = EarthParams()
+        zarray = radial_mesh(params, nlayers, nref=10, kinks=kinks)
+        ne, m = 6, len(zarray)
+        difeq = SphericalElasSMat(10, zarray, params, Q=2)
+
+        y, it = solvdeJit.solvde(500, 1e-14, 1, scalv, indexv, 3,
+                                    np.ones((ne, m)), difeq, it_count=True)
+        ypy, itpy = solvdeJit.solvde(500, 1e-14, 1, scalv, indexv, 3,
+                                        np.ones((ne, m)), _Smatrix(difeq),
+                                        it_count=True)
+        assert it == itpy
+        np.testing.assert_allclose(y, ypy, rtol=1e-10, atol=1e-12)
+
+        # The solution satisfies the boundary conditions found once from
+        # the s matrices,
+        s = np.zeros((ne, 2*ne+1))
+        Bbot, cbot, Btop, ctop = solvdeJit.boundary_rows(difeq, ne, 3, m,
+                                                            indexv, s)
+        assert Bbot.shape == (3, ne) and Btop.shape == (ne-3, ne)
+        np.testing.assert_allclose(Bbot.dot(y[:,0]) + cbot, 0, atol=1e-12)
+        np.testing.assert_allclose(Btop.dot(y[:,-1]) + ctop, 0, atol=1e-12)
+
+        # and the work arrays of each mesh size are kept between solutions.
+        work = solvdeJit._workspace(ne, 3, m)
+        assert solvdeJit._workspace(ne, 3, m)[0] is work[0]
+        assert work[0].shape == (ne, ne-3+1, m+1)
+        if m in ys:
+            np.testing.assert_array_equal(y, ys[m])
+        ys[m] = y
+    assert len(ys) == 2
+
+
+def _elasb_loop(n, hV, params, zarray, Q):
+    """gen_elasb as a loop over the mesh points (before it was vectorized)."""
+    parvals = params.onMesh(np.r_[params.rCore, zarray, 1.])
+    rhoC, gC, denC = parvals['den'][0], parvals['grav'][0], params.denCore
+    g, nonad = parvals['grav'][1:-1], parvals['nonad'][1:-1]
+    rhoS = parvals['den'][-1]
+    li = 1./(2.*n+1.)
+
+    b = np.zeros((len(zarray)+2, 6))
+    if n != 1:
+        b[0,2] = ((denC-rhoC)*gC*hV[0]*li
+                    -rhoC*(denC-rhoC)*hV[0]*li**2)
+        b[0,4] = -(denC-rhoC)*hV[0]*li
+        if Q == 1:
+            b[0,5] = (denC-rhoC)*hV[0]*li - n/params.rCore*(denC-rhoC)*hV[0]*li**2
+        else:
+            b[0,5] = denC*hV[0]*li - 1./params.rCore*(denC-rhoC)*hV[0]*li**2
+    b[-1,2] = -rhoS*li*hV[-1]
+    if Q == 1:
+        b[-1,5] = -rhoS*li*hV[-1]
+    for i, bi in enumerate(b[1:-1]):
+        hvi = 0.5*(hV[i] + hV[i+1])
+        bi[2] = -g[i]*nonad[i]*hvi*li
+        bi[4] = zarray[i]*nonad[i]*hvi*li
+        if Q == 1:
+            bi[5] = -(n+1.)*nonad[i]*li*li*hvi
+    return b
+
+
+@pytest.mark.parametrize('Q', [1, 2])
+def test_gen_elasb(Q):
+    params = EarthParams(normmode='love')
+    params.fullNonadiabatic()
+    zarray = radial_mesh(params, 50)
+    zmids = 0.5*(zarray[1:] + zarray[:-1])
+    hV = np.random.RandomState(0).randn(len(zarray))
+
+    out = np.full((len(zmids)+2, 6), np.nan)
+    for n in [10, 2, 1]:
+        b = gen_elasb(n, hV, params, zmids, Q=Q)
+        np.testing.assert_array_equal(b, _elasb_loop(n, hV, params, zmids, Q))
+        # The buffer is cleared and filled, whatever it held (e.g., the
+        # lower boundary of n > 1 before n = 1).
+        assert gen_elasb(n, hV, params, zmids, Q=Q, out=out) is out
+        np.testing.assert_array_equal(out, b)
@@ -0,0 +1,101 @@
+"""
+test_harm_tools.py
+Author: Samuel B. Kachuck
+
+Tests of giapy.harm_tools: the estimate of the stored Legendre tables, their
+disk cache (_load_stored) and the batched transforms.
+
+"""
+
+import types
+
+import numpy as np
+import pytest
+
+from giapy import harm_tools
+
+
+class _FakeSpharmt(object):
+    """Stands in for spharm.Spharmt in the tests of the disk cache: array
+    attributes set by the constructor, which forbids rebinding them."""
+    def __init__(self, nlon, nlat, gridtype='regular', legfunc='stored'):
+        d = self.__dict__
+        d['nlon'], d['nlat'] = nlon, nlat
+        d['gridtype'], d['legfunc'] = gridtype, legfunc
+        if legfunc == 'stored':
+            d['wsave'] = np.arange(nlon*nlat, dtype=float).reshape(nlat, nlon)
+            d['wvhsgs'] = np.linspace(0, 1, nlat)
+
+    def __setattr__(self, key, val):
+        raise AttributeError('Attempt to rebind read-only instance variable '
+                             + key)
+
+
+def test_legendre_table_bytes_itemsize():
+    nbytes = harm_tools.legendre_table_bytes(360, 181)
+    assert nbytes == 2*harm_tools.legendre_table_bytes(360, 181, np.float32)
+    assert nbytes % harm_tools.LEGDTYPE.itemsize == 0
+
+
+def test_load_stored_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(harm_tools, 'spharm',
+                        types.SimpleNamespace(Spharmt=_FakeSpharmt))
+    cachedir = str(tmpdir)
+
+    # The first call builds and saves the tables, the second maps them in.
+    built = harm_tools._load_stored(8, 5, 'regular', cachedir)
+    mapped = harm_tools._load_stored(8, 5, 'regular', cachedir)
+    assert tmpdir.join('spharmt_8_5_regular').check(dir=True)
+    assert len(tmpdir.listdir()) == 1
+
+    assert mapped.legfunc == 'stored'
+    assert (mapped.nlon, mapped.nlat) == (8, 5)
+    for name in ['wsave', 'wvhsgs']:
+        assert isinstance(mapped.__dict__[name], np.memmap)
+        np.testing.assert_array_equal(mapped.__dict__[name],
+                                      built.__dict__[name])
+
+
+def test_load_stored_spharm(tmpdir):
+    spharm = pytest.importorskip('spharm')
+    cachedir = str(tmpdir)
+    harm_tools._load_stored(36, 19, 'regular', cachedir)
+    trans = harm_tools._load_stored(36, 19, 'regular', cachedir)
+    ref = spharm.Spharmt(36, 19, gridtype='regular', legfunc='stored')
+
+    grid = np.random.RandomState(0).standard_normal((19, 36))
+    np.testing.assert_allclose(trans.grdtospec(grid), ref.grdtospec(grid))
+
+
+@pytest.mark.parametrize('gridtype', ['regular', 'gaussian'])
+@pytest.mark.parametrize('nlon,nlat', [(64, 64), (65, 33), (128, 64)])
+def test_batch_roundtrip(nlon, nlat, gridtype):
+    # Grids with fewer than 2*ntrunc longitudes (e.g. nlon = nlat) do not
+    # resolve the highest orders, whose coefficients are zero.
+    trans = harm_tools.BatchTransform(nlon, nlat, gridtype)
+    grids = np.random.RandomState(1).standard_normal((3, nlat, nlon))
+    spec = trans.grdtospec(grids)
+    np.testing.assert_allclose(trans.grdtospec(trans.spectogrd(spec)), spec,
+                               atol=1e-12)
+
+
+@pytest.mark.parametrize('gridtype,nlat', [('regular', 33), ('gaussian', 32)])
+def test_batch_spharm(gridtype, nlat):
+    # The batched transforms follow the conventions of spharm.
+    spharm = pytest.importorskip('spharm')
+    nlon = 72
+    ref = spharm.Spharmt(nlon, nlat, gridtype=gridtype, legfunc='stored')
+    trans = harm_tools.BatchTransform(nlon, nlat, gridtype)
+
+    rng = np.random.RandomState(2)
+    ncoeff = nlat*(nlat+1)//2
+    spec = rng.standard_normal((2, ncoeff)) + 1j*rng.standard_normal((2, ncoeff))
+    # The m = 0 coefficients are real.
+    spec[:, :nlat] = spec[:, :nlat].real
+
+    grids = trans.spectogrd(spec)
+    np.testing.assert_allclose(grids, np.moveaxis(ref.spectogrd(spec.T), -1, 0),
+                               atol=1e-10)
+    np.testing.assert_allclose(trans.grdtospec(grids),
+                               ref.grdtospec(np.moveaxis(grids, 0, -1)).T,
+                               atol=1e-10)
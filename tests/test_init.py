@@ -0,0 +1,75 @@
+"""
+test_init.py
+Author: Samuel B. Kachuck
+
+Tests of the package namespace (giapy/__init__.py): the lazy imports of the
+submodules and the git version read from the repository's files.
+
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import giapy
+
+ROOT = os.path.dirname(giapy.MODPATH)
+HASH = '0123456789abcdef0123456789abcdef01234567'
+
+
+def test_lazy_import():
+    # Importing giapy imports none of the submodules, nor their
+    # dependencies.
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    code = ('import sys, giapy; print(" ".join(m for m in ["giapy.sle", '
+            '"giapy.earth_tools", "numba", "matplotlib", "scipy"] '
+            'if m in sys.modules))')
+    out = subprocess.check_output([sys.executable, '-c', code], env=env,
+                                    cwd=ROOT)
+    assert out.decode().strip() == ''
+
+
+def test_gitversion(monkeypatch):
+    try:
+        head = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                        cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip('not in a git checkout')
+
+    # The hash is read from the files of .git, without running git.
+    def nosubprocess(*args, **kwargs):
+        raise AssertionError('GITVERSION ran a subprocess')
+    for name in ['Popen', 'call', 'check_call', 'check_output', 'run']:
+        monkeypatch.setattr(subprocess, name, nosubprocess)
+    monkeypatch.setattr(giapy, '_GITVERSION', None)
+    assert giapy.GITVERSION == head[:10]
+    assert giapy.get_gitversion() == head[:10]
+
+
+def test_read_git_head(tmpdir):
+    repo = tmpdir.mkdir('repo')
+    pkg = repo.mkdir('pkg')
+    git = repo.mkdir('.git')
+
+    # A branch, loose and packed.
+    git.join('HEAD').write('ref: refs/heads/main\n')
+    git.join('packed-refs').write('# pack-refs with: peeled\n'
+                                    '{} refs/heads/main\n'.format(HASH))
+    assert giapy._readGitHead(str(pkg)) == HASH
+    git.mkdir('refs').mkdir('heads').join('main').write(HASH[::-1]+'\n')
+    assert giapy._readGitHead(str(pkg)) == HASH[::-1]
+
+    # A detached HEAD.
+    git.join('HEAD').write(HASH+'\n')
+    assert giapy._readGitHead(str(pkg)) == HASH
+
+    # A worktree, whose .git file points to its git directory, which
+    # shares the refs of the main repository.
+    tree = tmpdir.mkdir('tree')
+    wtgit = git.mkdir('worktrees').mkdir('tree')
+    tree.join('.git').write('gitdir: {}\n'.format(wtgit))
+    wtgit.join('HEAD').write('ref: refs/heads/main\n')
+    wtgit.join('commondir').write('../..\n')
+    assert giapy._readGitHead(str(tree)) == HASH[::-1]
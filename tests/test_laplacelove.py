@@ -0,0 +1,65 @@
+"""
+test_laplacelove.py
+Author: Samuel B. Kachuck
+
+Tests of the viscoelastic Love numbers by inversion of the Laplace-domain
+Love numbers (laplacelove.compute_laplace_numbers) against the sums of the
+normal modes (normalmodes.find_modes),
+    X(t) = X_e + sum_j a_j (1 - exp(s_j t)),
+of PREM, homogeneous between its discontinuities (layered_params),
+incompressible, with a uniform 1e21 Pa s mantle, on a coarse mesh, at the
+times TS (ka).
+
+"""
+
+import numpy as np
+import pytest
+
+from giapy.earth_tools.earthParams import (EarthParams, layered_params,
+                                            radial_mesh)
+from giapy.earth_tools.elasticlove import compute_love_numbers
+from giapy.earth_tools.laplacelove import compute_laplace_numbers
+from giapy.earth_tools.normalmodes import find_modes
+
+TS = np.r_[0, np.logspace(-3, 3, 13)]
+NLAYERS = 60
+
+
+@pytest.fixture(scope='module')
+def params():
+    return layered_params(EarthParams(model='prem', normmode='love'))
+
+
+@pytest.mark.parametrize('n,tol', [(1, 1e-5), (2, 3e-5), (10, 3e-4)])
+def test_laplace_modes(params, n, tol):
+    zarray = radial_mesh(params, NLAYERS, nref=n, kinks=True)
+    hLke, modes = find_modes(n, params, zarray=zarray)
+    tn = TS*params.getLithFilter(n=n)/(0.5*params.tau)
+    Xm = hLke[:,None] - np.sum(modes[:,1:,None]*
+                                np.expm1(modes[:,:1,None]*tn), axis=0)
+
+    X = compute_laplace_numbers(n, TS, zarray, params, comp=False, nodes=16,
+                                    nprocs=1)
+    assert X.shape == (3, len(TS))
+    assert np.max(np.abs(X - Xm))/np.max(np.abs(Xm)) < tol
+
+
+def test_laplace_numbers(params):
+    ns = np.array([2, 3])
+    zarray = radial_mesh(params, NLAYERS, nref=ns.max(), kinks=True)
+    X = compute_laplace_numbers(ns, TS, zarray, params, comp=False, nodes=16,
+                                    nprocs=1)
+    assert X.shape == (len(ns), 3, len(TS))
+
+    # At t = 0, the elastic Love numbers.
+    hLk = compute_love_numbers(ns, zarray, params, comp=False)
+    np.testing.assert_allclose(X[:,:,0], hLk.T, rtol=1e-8)
+
+    # The contours converge with their number of nodes, and the processes
+    # share the solves.
+    X24 = compute_laplace_numbers(ns, TS, zarray, params, comp=False,
+                                    nodes=24, nprocs=2)
+    assert np.max(np.abs(X - X24))/np.max(np.abs(X24)) < 1e-6
+    np.testing.assert_allclose(compute_laplace_numbers(ns, TS, zarray,
+                                    params, comp=False, nodes=24, nprocs=1),
+                               X24, rtol=0, atol=0)
@@ -0,0 +1,106 @@
+"""
+test_lovefit.py
+Author: Samuel B. Kachuck
+
+Tests of the fits of viscoelastic Love numbers with exponential modes
+(lovefit.fit_modes), on series of known modes,
+    X(t) = X_e + sum_j a_j (1 - exp(s_j t)),
+at the times TS (ka), and of their storage as the responses of
+SphericalEarth (fitLoveNumbers and loadVeloveNumbers).
+
+"""
+
+import numpy as np
+import pytest
+
+from giapy.earth_tools.lovefit import fit_exponentials, fit_modes
+
+TS = np.r_[0, np.logspace(-2, 2.5, 46)]
+RATES = np.array([3., 0.2, 0.01])
+
+
+def make_series(ns, rates=RATES):
+    """Love numbers (len(ns), 3, len(TS)) of known elastic values hLke
+    (len(ns), 3) and modes (len(ns), len(rates), 4)."""
+    ns = np.asarray(ns, dtype=float)
+    hLke = np.vstack([-1 - 0.1*ns, 0.5 + 0.01*ns, -0.5 + 0.02*ns]).T
+    amps = np.array([[0.3, 0.1, 0.05], [-0.2, 0.05, 0.1], [0.5, -0.1, 0.2]])
+    modes = np.zeros((len(ns), len(rates), 4))
+    modes[:,:,0] = -rates
+    modes[:,:,1:] = amps[:len(rates)]*(1 + 0.1*ns[:,None,None])
+    hLkt = hLke[:,:,None] - np.einsum('ijk,ijl->ikl', modes[:,:,1:],
+                                np.expm1(np.multiply.outer(modes[:,:,0], TS)))
+    return hLke, modes, hLkt
+
+
+def test_fit_exponentials():
+    hLke, modes, hLkt = make_series([2])
+    rates, Ye, amps, resid = fit_exponentials(TS, hLkt[0], len(RATES))
+    np.testing.assert_allclose(rates, RATES, rtol=1e-6)
+    np.testing.assert_allclose(Ye, hLke[0], rtol=1e-6)
+    np.testing.assert_allclose(amps, modes[0,:,1:], rtol=1e-6, atol=1e-9)
+    assert np.all(resid < 1e-8)
+
+
+def test_fit_modes():
+    ns = np.arange(1, 5)
+    hLke, modes, hLkt = make_series(ns)
+
+    # Shared rates fit all the order numbers in one group.
+    fit = fit_modes(TS, hLkt, nmodes=len(RATES), share_tol=1e-6)
+    assert fit[1].shape == (len(ns), len(RATES), 4)
+    np.testing.assert_array_equal(fit[3], 0)
+    np.testing.assert_allclose(fit[0], hLke, rtol=1e-6)
+    np.testing.assert_allclose(fit[1], modes, rtol=1e-6, atol=1e-9)
+    assert np.all(fit[2] < 1e-8)
+
+    # Without sharing, each order number is its own group.
+    fit = fit_modes(TS, hLkt, nmodes=len(RATES), share_tol=None)
+    np.testing.assert_array_equal(fit[3], np.arange(len(ns)))
+    np.testing.assert_allclose(fit[1], modes, rtol=1e-6, atol=1e-9)
+
+    # Order numbers of different rates start a new group.
+    hLkt[2:] = make_series(ns[2:], rates=RATES*[1, 5, 1])[2]
+    fit = fit_modes(TS, hLkt, nmodes=len(RATES), share_tol=1e-6)
+    np.testing.assert_array_equal(fit[3], [0, 0, 1, 1])
+    np.testing.assert_allclose(fit[1][2:,:,0], np.tile(-RATES*[1, 5, 1], (2, 1)),
+                                rtol=1e-6)
+    assert np.all(fit[2] < 1e-8)
+
+
+def test_fit_love_numbers(tmpdir):
+    earthSphericalLap = pytest.importorskip(
+                                    'giapy.earth_tools.earthSphericalLap')
+    ns = np.arange(1, 5)
+    hLke, modes, hLkt = make_series(ns)
+
+    earth = earthSphericalLap.SphericalEarth()
+    resid = earth.fitLoveNumbers(TS, hLkt, nmodes=len(RATES))
+    assert np.all(resid < 1e-8)
+    assert earth.nmax == ns.max()
+    # Stored as h, l = L/n and k = -(1+k_d), as loadTabooNumbers.
+    np.testing.assert_allclose(earth.hlke[ns], np.vstack([hLke[:,0],
+                                hLke[:,1]/ns, -1 - hLke[:,2]]).T, rtol=1e-6)
+    np.testing.assert_allclose(earth.hlks[ns,:,0], modes[:,:,0], rtol=1e-6)
+    np.testing.assert_allclose(earth.hlks[ns,:,2],
+                                modes[:,:,2]/ns[:,None], rtol=1e-6)
+    np.testing.assert_allclose(earth.hlkf[ns], earth.hlke[ns] +
+                                earth.hlks[ns,:,1:].sum(axis=1))
+
+    # The same series, as written by giapy-velove (h, l = L/n and
+    # k' = -1 - k_d).
+    with open(str(tmpdir.join('velove.txt')), 'w') as f:
+        f.write("# Viscoelastic Love numbers computed in giapy. Formatted:\n")
+        f.write("# l\n")
+        f.write("# t\th'\tl'\tk'\n")
+        for l, hLkl in zip(ns, hLkt):
+            f.write('# l={}\n'.format(l))
+            for t, hLk in zip(TS, hLkl.T):
+                f.write('{0}\t{1:.17g}\t{2:.17g}\t{3:.17g}\n'.format(t, hLk[0],
+                                                hLk[1]/l, -1 - hLk[2]))
+    velove = earthSphericalLap.SphericalEarth()
+    velove.loadVeloveNumbers('velove.txt', drctry=str(tmpdir)+'/',
+                                nmodes=len(RATES))
+    np.testing.assert_allclose(velove.hlke, earth.hlke, rtol=1e-6)
+    np.testing.assert_allclose(velove.hlks, earth.hlks, rtol=1e-6,
+                                atol=1e-9)
@@ -0,0 +1,92 @@
+"""
+test_normalmodes.py
+Author: Samuel B. Kachuck
+
+Tests of the normal modes of the Love numbers (normalmodes.find_modes) of
+PREM, homogeneous between its discontinuities (layered_params), with a
+uniform 1e21 Pa s mantle, on a coarse mesh: the Laplace-domain Love numbers
+h, L and k_d computed directly and summed from the modes,
+    X(s) = X_e - sum_j a_j s_j/(s - s_j),
+agree at rates S (normalized), and normal_modes and
+SphericalEarth.calcNormalModes store them.
+
+"""
+
+import numpy as np
+import pytest
+
+from giapy.earth_tools.earthParams import (EarthParams, layered_params,
+                                            radial_mesh)
+from giapy.earth_tools.normalmodes import (find_modes, laplace_love_numbers,
+                                            normal_modes)
+
+NLAYERS = 60
+# The largest relative difference of the sums of the modes at each rate of S
+# (they converge slowly towards the fluid limit, s = 0).
+S = [1e-4, 1e-2, 1., 10.]
+TOLS = [2e-3, 2e-5, 2e-6, 2e-7]
+
+
+@pytest.fixture(scope='module')
+def params():
+    return layered_params(EarthParams(model='prem', normmode='love'))
+
+
+@pytest.mark.parametrize('n', [1, 2, 10])
+def test_find_modes(params, n):
+    hLke, modes = find_modes(n, params, nlayers=NLAYERS)
+    # Decaying modes, by decreasing rate.
+    assert len(modes) > 10
+    assert np.all(modes[:,0] < 0) and np.all(np.diff(modes[:,0]) < 0)
+
+    zarray = radial_mesh(params, NLAYERS, nref=n, kinks=True)
+    for s, tol in zip(S, TOLS):
+        X = laplace_love_numbers(n, s, params, zarray)[2]
+        if n == 1:
+            X[:2] += X[2]
+            X[2] = 0.
+        Xm = hLke - np.sum(modes[:,1:]*(modes[:,:1]/(s - modes[:,:1])),
+                            axis=0)
+        assert np.max(np.abs(X - Xm))/np.max(np.abs(X)) < tol
+
+
+def test_normal_modes_cache(tmpdir):
+    params = EarthParams(model='prem', normmode='love')
+    cachedir = str(tmpdir)
+    hLke, modes = normal_modes([2, 3], params, nprocs=1, cachedir=cachedir,
+                                nlayers=NLAYERS)
+    assert len(tmpdir.listdir()) == 1
+
+    # The saved order numbers are loaded, the others computed (and padded to
+    # the largest number of modes).
+    hLke1, modes1 = normal_modes([3, 1, 2], params, nprocs=1,
+                                    cachedir=cachedir, nlayers=NLAYERS)
+    np.testing.assert_array_equal(hLke1[[2, 0]], hLke)
+    nm = modes.shape[1]
+    np.testing.assert_array_equal(modes1[[2, 0], :nm], modes)
+    hLk1, modes1_ = find_modes(1, layered_params(params), nlayers=NLAYERS)
+    np.testing.assert_array_equal(modes1[1, :len(modes1_)], modes1_)
+    assert np.all(modes1[1, len(modes1_):] == 0)
+
+
+def test_calc_normal_modes(tmpdir):
+    earthSphericalLap = pytest.importorskip(
+                            'giapy.earth_tools.earthSphericalLap')
+    params = EarthParams(model='prem', normmode='love')
+    earth = earthSphericalLap.SphericalEarth()
+    earth.calcNormalModes(params, 3, nprocs=1, cachedir=str(tmpdir),
+                            nlayers=NLAYERS)
+    ns = np.arange(1, 4)
+    hLke, modes = normal_modes(ns, params, nprocs=1, cachedir=str(tmpdir),
+                                nlayers=NLAYERS)
+
+    # Stored as h, l = L/n and k = -(1+k_d), with rates in 1/ka.
+    assert earth.nmax == 3
+    np.testing.assert_allclose(earth.hlke[1:],
+                        np.c_[hLke[:,0], hLke[:,1]/ns, -(1+hLke[:,2])])
+    rates = modes[:,:,0]*params.getLithFilter(n=ns)[:,None]/(0.5*params.tau)
+    np.testing.assert_allclose(earth.hlks[1:,:,0], rates)
+    np.testing.assert_allclose(earth.hlks[1:,:,1:],
+                        np.stack([modes[:,:,1], modes[:,:,2]/ns[:,None],
+                                    -modes[:,:,3]], axis=-1))
+    np.testing.assert_allclose(earth.getResp(0.)[1:], earth.hlke[1:])
@@ -0,0 +1,43 @@
+"""
+test_parareal.py
+Author: Samuel B. Kachuck
+
+Tests of giapy.parareal against the serial computation (see conftest.py).
+
+"""
+
+import numpy as np
+import pytest
+
+from conftest import NMAX, make_topo
+
+OUT_TIMES = [10, 7.5, 5, 2.5, 0]
+
+
+@pytest.mark.parametrize('nprocs', [1, 2])
+def test_parareal_serial(sle, earth, ice, nprocs):
+    from giapy.parareal import parareal_convolution
+    sim = sle.GiaSimGlobal(earth, ice, topo=make_topo(ice))
+    ref = sim.performConvolution(out_times=OUT_TIMES, ntrunc=NMAX)
+
+    # After as many iterations as windows, parareal is the serial
+    # computation.
+    out = parareal_convolution(sim, OUT_TIMES, 3, ntrunc=NMAX,
+                                coarse_ntrunc=8, tol=0, nprocs=nprocs)
+    assert out.pararealReport['iterations'] == 3
+    for name in ['upl', 'geo', 'sstopo', 'esl']:
+        np.testing.assert_allclose(out[name].array, ref[name].array,
+                                    rtol=1e-10, atol=1e-10)
+    assert out.harmTrans is sim.harmTrans
+
+
+def test_parareal_converges(sle, earth, ice):
+    from giapy.parareal import parareal_convolution
+    sim = sle.GiaSimGlobal(earth, ice, topo=make_topo(ice))
+    ref = sim.performConvolution(out_times=OUT_TIMES, ntrunc=NMAX)
+
+    out = parareal_convolution(sim, OUT_TIMES, 3, ntrunc=NMAX,
+                                coarse_ntrunc=8, tol=1e-2, nprocs=1)
+    assert out.pararealReport['iterations'] < 3
+    upl, uplref = out['upl'].array, ref['upl'].array
+    assert np.max(np.abs(upl - uplref)) < 1e-3*np.max(np.abs(uplref))
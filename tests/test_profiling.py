@@ -0,0 +1,54 @@
+"""
+test_profiling.py
+Author: Samuel B. Kachuck
+
+Tests of the stage profiling of performConvolution (giapy.profiling) on a
+small grid (see conftest.py).
+
+"""
+
+import json
+
+import numpy as np
+
+from conftest import NMAX, make_topo
+from giapy.profiling import COLUMNS, PHASES
+
+
+def test_profile(sle, earth, ice, tmpdir):
+    sim = sle.GiaSimGlobal(earth, ice)
+    out = sim.performConvolution(out_times=[10, 5, 0], ntrunc=NMAX,
+                                    topo=make_topo(ice), profile=True)
+    prof = out.profile
+
+    # One row per load stage, with non-negative phase times within the
+    # stage's, and the evaluations of the sea level root finding counted.
+    table = prof.table()
+    assert len(table) == len(ice.times) - 1
+    np.testing.assert_array_equal(table['ta'], ice.times[:-1])
+    times = np.array([table['t_'+phase] for phase in PHASES])
+    assert np.all(times >= 0)
+    assert np.all(times.sum(axis=0) <= table['wall'])
+    assert np.all(table['root_calls'] > 0)
+    assert np.all(table['root_nfev'] > 0)
+    assert np.all(table['eliter'] > 0)
+    assert prof.summary()['stages'] <= prof.wall
+
+    # The exports are valid JSON.
+    data = json.loads(prof.to_json())
+    assert data['columns'] == [name for name, _ in COLUMNS]
+    assert len(data['stages']) == len(table)
+    fname = str(tmpdir.join('trace.json'))
+    prof.to_chrome_trace(fname)
+    with open(fname) as f:
+        events = json.load(f)['traceEvents']
+    stages = [e for e in events if e['name'] == 'stage']
+    assert len(stages) == len(table)
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
+    assert stages[0]['args']['root_nfev'] == table['root_nfev'][0]
+
+
+def test_profile_off(sle, earth, ice):
+    sim = sle.GiaSimGlobal(earth, ice)
+    out = sim.performConvolution(out_times=[10, 5, 0], ntrunc=NMAX)
+    assert getattr(out, 'profile', None) is None
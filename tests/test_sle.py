@@ -0,0 +1,161 @@
+"""
+test_sle.py
+Author: Samuel B. Kachuck
+
+Tests of giapy.sle on a small grid (see conftest.py).
+
+"""
+
+import numpy as np
+import pytest
+
+from conftest import NMAX, _disk, make_ice, make_topo
+
+
+def test_stagetol(sle, earth, ice):
+    sim = sle.GiaSimGlobal(earth, ice)
+    out_times = [10, 5, 0]
+    ref = sim.performConvolution(out_times=out_times, ntrunc=NMAX)
+    out = sim.performConvolution(out_times=out_times, ntrunc=NMAX,
+                                    stagetol=0.05)
+
+    report = out.coarseningReport
+    assert report['nstages'] == 41
+    assert report['ncoarse'] < report['nstages']
+
+    # The merged stages change the result by about the load change left out.
+    for name in ['upl', 'geo']:
+        a, b = ref[name].array, out[name].array
+        assert np.all(np.isfinite(b))
+        assert np.max(np.abs(b - a)) < 0.05*np.max(np.abs(a))
+
+
+def test_coarsen_altered_stages(sle, ice):
+    # The changes are measured on altered copies of the stages: the stored
+    # stages are left unchanged, and the stages coarsened are those of the
+    # history with the alterations applied.
+    from giapy.harm_tools import BatchTransform
+    trans = BatchTransform(ice.shape[1], ice.shape[0])
+    ice._alterationMask = np.where(_disk(ice.Lon, ice.Lat, 8) > 0,
+                                    hash('core'), 0)
+    ice.areaProps = {'core': 0.5}
+    stages = ice.stageArray.copy()
+    coarse = ice.coarsenStages(0.05, harmTrans=trans, norm='spectral')
+    np.testing.assert_array_equal(ice.stageArray, stages)
+    assert coarse.coarseningReport['ncoarse'] < len(stages)
+    assert coarse.coarseningReport == ice.coarsenStages(0.05,
+                        harmTrans=trans, norm='spectral').coarseningReport
+
+    altered = make_ice()
+    altered.stageArray[:, ice._alterationMask == hash('core')] *= 0.5
+    ref = altered.coarsenStages(0.05, harmTrans=trans, norm='spectral')
+    np.testing.assert_array_equal(coarse.stageOrder, ref.stageOrder)
+    assert coarse.coarseningReport == ref.coarseningReport
+
+
+def test_solve_initial_topography(sle, earth, ice):
+    # The default levels are truncated at the earth model's resolution.
+    sim = sle.GiaSimGlobal(earth, ice)
+    topo = make_topo(ice)
+    topo0, out = sim.solveInitialTopography(topo, out_times=[10, 5, 0],
+                                            tol=1e-3, maxiter=15)
+    misfit = out['sstopo'].array[-1] - topo
+    area = sim.grid.integrate(np.ones(ice.shape))
+    assert sim.grid.integrate(np.abs(misfit))/area < 1e-3
+    assert not np.allclose(topo0, topo)
+
+
+def test_anderson_step_safeguard(sle):
+    x0, x1 = np.zeros((3, 4)), np.ones((3, 4))
+    r0, r1 = np.ones((3, 4)), 0.5*np.ones((3, 4))
+    # Mixing two iterates solves the linear residual exactly,
+    assert np.allclose(sle._anderson_step([x0, x1], [r0, r1], 0.5), 2.)
+    # and falls back to the plain step with non-finite residuals.
+    r0[0, 0] = np.nan
+    np.testing.assert_array_equal(sle._anderson_step([x0, x1], [r0, r1], 0.5),
+                                  x1 - 0.5*r1)
+
+
+@pytest.mark.parametrize('gridtype', ['regular', 'gaussian'])
+def test_transform_observers(sle, earth, ice, gridtype):
+    # With spharm installed (the default engine), this compares the batched
+    # transforms with spharm.Spharmt.
+    sim = sle.GiaSimGlobal(earth, ice, gridtype=gridtype)
+    out = sim.performConvolution(out_times=[10, 5, 0], ntrunc=NMAX)
+    ref = {name: out[name].array.copy() for name in ['upl', 'geo']}
+
+    out.transformObservers(batched=True)
+    batched = {name: out[name].array.copy() for name in ref}
+    out.transformObservers(inverse=True, batched=True)
+    for name in ref:
+        np.testing.assert_allclose(out[name].array, ref[name], atol=1e-10)
+
+    out.transformObservers(batched=False)
+    for name in ref:
+        np.testing.assert_allclose(out[name].array, batched[name], atol=1e-10)
+
+
+def test_computed_legfunc(sle, earth, ice, monkeypatch):
+    # A simulation with computed Legendre functions (e.g., when stored tables
+    # exceed MEMBUDGET) never builds stored tables, batched or not.
+    from giapy import harm_tools
+    built = []
+    init = harm_tools.BatchTransform.__init__
+    def spy(self, nlon, nlat, gridtype='regular', legfunc='stored'):
+        built.append(legfunc)
+        init(self, nlon, nlat, gridtype, legfunc)
+    monkeypatch.setattr(harm_tools.BatchTransform, '__init__', spy)
+    harm_tools.clear_transforms()
+    try:
+        sim = sle.GiaSimGlobal(earth, ice, legfunc='computed', engine='numpy')
+        out = sim.performConvolution(out_times=[10, 5, 0], ntrunc=NMAX)
+        out.transformObservers()
+        out.transformObservers(inverse=True)
+        out.transformObservers(batched=True)
+    finally:
+        harm_tools.clear_transforms()
+    assert built and 'stored' not in built
+
+
+@pytest.mark.parametrize('batched', [True, False])
+def test_observer_truncation(sle, earth, ice, batched):
+    from giapy.spharmt import getspecindx
+    t = 8
+    sim = sle.GiaSimGlobal(earth, ice)
+    full = sim.performConvolution(out_times=[10, 5, 0], ntrunc=NMAX)
+    out = sim.performConvolution(out_times=[10, 5, 0], ntrunc=NMAX,
+                                    observers={'geo': t})
+
+    # The truncated observer stores only its coefficients, those of the full
+    # truncation up to degree t.
+    geo = out['geo'].array
+    assert geo.shape == (3, (t+1)*(t+2)//2)
+    ms, ns = getspecindx(ice.nlat-1)
+    np.testing.assert_allclose(geo, full['geo'].array[:, ns <= t],
+                               rtol=1e-12, atol=1e-12*np.abs(geo).max())
+
+    # It transforms to the grid and back at its truncation.
+    out.transformObservers(batched=batched)
+    assert out['geo'].array.shape == (3,) + ice.shape
+    out.transformObservers(inverse=True, batched=batched)
+    np.testing.assert_allclose(out['geo'].array, geo,
+                               atol=1e-10*np.abs(geo).max())
+
+
+def test_single_precision(sle, earth, ice):
+    sim = sle.GiaSimGlobal(earth, ice)
+    topo = make_topo(ice)
+    out = sim.performConvolution(out_times=[10, 5, 0], ntrunc=NMAX, topo=topo,
+                                    precision='single')
+    for name in ['upl', 'hor', 'geo', 'SS']:
+        assert out[name].array.dtype == np.complex64
+    for name in ['load', 'wload', 'topo', 'sstopo']:
+        assert out[name].array.dtype == np.float32
+    out.transformObservers()
+    assert out['upl'].array.dtype == np.float32
+
+    # Within the bound documented by performConvolution.
+    deviations = sle.precision_deviation(sim, out_times=[10, 5, 0],
+                                            ntrunc=NMAX, topo=topo)
+    assert max(rel for dev, rel in deviations.values()) < 1e-4
+    assert deviations['upl'][1] < 1e-6
@@ -0,0 +1,64 @@
+"""
+test_timeindex.py
+Author: Samuel B. Kachuck
+
+Tests of giapy.numTools.timeindex.TimeIndex and of its use by the observers
+of giapy.sle.
+
+"""
+
+import numpy as np
+import pytest
+
+from giapy.numTools.timeindex import TimeIndex
+
+# Decreasing output times, as in performConvolution.
+TIMES = np.linspace(20, 0, 11)
+
+
+def test_decreasing_times():
+    index = TimeIndex(TIMES)
+    assert len(index) == len(TIMES)
+    for i, t in enumerate(TIMES):
+        assert index.index(t) == i
+    np.testing.assert_array_equal(index.lookup(TIMES[::-1]),
+                                    np.arange(len(TIMES))[::-1])
+
+
+def test_tolerance():
+    index = TimeIndex(TIMES)
+    # Roundoff, e.g. of times scaled from other arrays, is matched,
+    t = 20*np.linspace(0, 1, 11)[3]
+    assert t != 6. and index.get(t) == 7
+    assert index.get(6*(1 + 1e-12)) == 7
+    assert index.get(1e-13) == 10
+    # but not differences above rtol or atol.
+    assert index.get(6*(1 + 1e-6)) is None
+    assert index.get(1e-6) is None
+    assert TimeIndex(TIMES, rtol=1e-5).get(6*(1 + 1e-6)) == 7
+
+
+def test_misses():
+    index = TimeIndex(TIMES)
+    for t in [1., -2., 25.]:
+        assert index.get(t) is None
+        assert index.get(t, -1) == -1
+        assert t not in index
+        with pytest.raises(ValueError):
+            index.index(t)
+    assert 4. in index
+    np.testing.assert_array_equal(index.lookup([4., 1., 25., 0.]),
+                                    [8, -1, -1, 10])
+    np.testing.assert_array_equal(TimeIndex([]).lookup([1., 2.]), [-1, -1])
+
+
+def test_observer_locate_by_time(sle):
+    obs = sle.HeightObserver(TIMES, (3, 4), 'load')
+    assert obs.locateByTime(6*(1 + 1e-12)) == 7
+    np.testing.assert_array_equal(obs.locateTimes([6., 5.]), [7, -1])
+    with pytest.raises(ValueError):
+        obs.locateByTime(5.)
+
+    # The index follows a change of outTimes.
+    obs.outTimes = TIMES[::2]
+    assert obs.locateByTime(4.) == 4
@@ -0,0 +1,71 @@
+"""
+test_viscouslove.py
+Author: Samuel B. Kachuck
+
+Tests of the viscous Love-number source terms of
+giapy.earth_tools.viscouslove on PREM.
+
+"""
+
+import numpy as np
+import pytest
+
+from giapy.earth_tools.earthParams import EarthParams, radial_mesh
+from giapy.earth_tools.viscouslove import gen_viscb
+
+
+def _viscb_loop(n, yE, hV, params, zarray, Q):
+    """gen_viscb as a loop over the mesh points (before it was vectorized)."""
+    parvals = params.onMesh(np.r_[params.rCore, zarray, 1.])
+    rho, g = parvals['den'][1:-1], parvals['grav'][1:-1]
+    nonad = parvals['nonad'][1:-1]
+    rhoC, gC, denC = parvals['den'][0], parvals['grav'][0], params.denCore
+    rhoS = parvals['den'][-1]
+    li = 1./(2.*n+1.)
+    z_i = 1./zarray
+
+    b = np.zeros((len(zarray)+2, 4))
+    if n != 1:
+        b[0,2] = ((denC-rhoC)*gC*hV[0] + denC*yE[4,0] +
+                    0.33*params.rCore*denC**2*yE[0,0]
+                    -rhoC*(denC-rhoC)*hV[0]*li)*li
+    b[-1,2] = -rhoS*li*hV[-1]
+    for i, bi in enumerate(b[1:-1]):
+        hvi = 0.5*(hV[i] + hV[i+1])
+        hi = 0.5*(yE[0,i] + yE[0,i+1])
+        Li = 0.5*(yE[1,i] + yE[1,i+1])
+        ki = 0.5*(yE[4,i] + yE[4,i+1])
+        qi = 0.5*(yE[5,i] + yE[5,i+1])
+        if Q == 1:
+            bi[2] = (rho[i]*(qi +
+                    (rho[i] - 4*g[i]*z_i[i])*li*hi
+                    + g[i]*z_i[i]*(n+1.)*li*Li)
+                    - g[i]*nonad[i]*hvi*li)
+        else:
+            bi[2] = (rho[i]*(qi +
+                    - 4*g[i]*z_i[i]*li*hi
+                    + g[i]*z_i[i]*(n+1.)*li*Li
+                    + z_i[i]*(n+1.)*li*ki)
+                    - g[i]*nonad[i]*hvi*li)
+        bi[3] = rho[i]*(g[i]*hi + ki)*n*li*z_i[i]
+    return b
+
+
+@pytest.mark.parametrize('Q', [1, 2])
+def test_gen_viscb(Q):
+    params = EarthParams(normmode='love')
+    params.fullNonadiabatic()
+    zarray = radial_mesh(params, 50)
+    zmids = 0.5*(zarray[1:] + zarray[:-1])
+    rs = np.random.RandomState(0)
+    yE, hV = rs.randn(6, len(zarray)), rs.randn(len(zarray))
+
+    out = np.full((len(zmids)+2, 4), np.nan)
+    for n in [10, 2, 1]:
+        b = gen_viscb(n, yE, hV, params, zmids, Q=Q)
+        np.testing.assert_array_equal(b, _viscb_loop(n, yE, hV, params,
+                                                        zmids, Q))
+        # The buffer is cleared and filled, whatever it held (e.g., the
+        # lower boundary of n > 1 before n = 1).
+        assert gen_viscb(n, yE, hV, params, zmids, Q=Q, out=out) is out
+        np.testing.assert_array_equal(out, b)